@@ -5,7 +5,18 @@
 # DATE: 08/01/2019
 # DESC: This script accepts text to standard input, and returns a Sample Sheet file
 # compatible with Illumina sequencing platforms.
-# USAGE: ./SampleSheet.py or python3 SampleSheet.py
+# USAGE: ./SampleSheet.py or python3 SampleSheet.py (interactive prompts)
+#        python3 SampleSheet.py --profile [cprofile|sampling] (interactive prompts, profiling Sample Sheet generation)
+#        python3 SampleSheet.py batch manifest.txt [...] [--metrics metrics.prom] [--profile] (no prompts; see SampleFiles/ExampleManifest.txt)
+#        python3 SampleSheet.py validate SampleSheet.csv [...] [--workflow A|B] (check existing Sample Sheets)
+#        python3 SampleSheet.py lookup GTACGTCA [...] [--mismatches N] (find the barcodes closest to index sequences)
+#        python3 SampleSheet.py demultiplex SampleSheet.csv I1.fastq.gz [I2.fastq.gz] (count index reads per sample)
+#        python3 SampleSheet.py plateview i7|i5 [--orientation revcomp] [--style markdown|html] (barcode plate layout)
+#        python3 SampleSheet.py update SampleSheet.csv 'DG-5, 1-96, 3' [--remove DG-2] (add, replace or remove plates)
+#        python3 SampleSheet.py --chemistry 2-channel (interactive prompts; color balance checked for one chemistry, or 'none')
+#        python3 SampleSheet.py watch manifests/ [--once] [--workers N] (generate Sample Sheets for manifests dropped into a directory)
+#        python3 SampleSheet.py serve [--port 8000] [--workers N] (local HTTP/JSON Sample Sheet service)
+#        import SampleSheet; SampleSheet.build_sample_sheet(...) (library use; importing does not prompt)
 # REPO: https://github.com/YamamotoLabUCSF/SampleSheet
 
 #############################################################################
@@ -25,10 +36,12 @@
 # Operation notes:
 # ==============================================
 # This script accepts text to standard input, and returns a Sample Sheet file compatible with Illumina sequencing platforms.
-# Python3 is required.  Installation of Python package "PrettyTable" is recommended (https://pypi.org/project/PrettyTable/, "A simple Python library for easily displaying tabular data in a visually appealing ASCII table format").
-# Note on PrettyTable: At the script outset, you will have an opportunity to display i7 and i5 barcode names and sequences at the console, in 96-well "array" format.  This operation requires PrettyTable.  This display can be bypassed if PrettyTable is not installed.  We recommend creating a Python virtual environment with PrettyTable installed (see README.md file, "System Setup")
-# Note on index usage: In this script, i7 is designated for use in full plate format (each well is uniquely barcoded by a single i7 index), whereas i5 defines all wells of a specific plate (up to 96 wells in a single plate are barcoded by a common i5 index).
-# This script accommodates 96-well bar-coding.
+# Python3 is required.
+# Note on plateviews: At the script outset, i7 and i5 barcode names and sequences are displayed at the console, in 96-well "array" format (also available without prompts: python3 SampleSheet.py plateview i7|i5).
+# Note on index usage: In this script, i7 is designated for use in full plate format (each well is uniquely barcoded by a single i7 index), whereas i5 defines all wells of a specific plate (all wells of a single plate, up to 96, 384 or 1536, are barcoded by a common i5 index).
+# This script accommodates 96-, 384- and 1536-well bar-coding (see PlateFormat), with wells numbered across rows or down
+# columns.  Interactive prompts use 96-well plates numbered across rows; batch manifests ('plate:', 'well_order:'), the
+# service and the plateview and update commands (--plate, --well-order) select other plate formats.
 
 # Input notes:
 # ==============================================
@@ -62,963 +75,2550 @@
 # Operating system interfaces
 import os
 
-# Object-oriented filesystem paths
-from pathlib import Path
+# In-memory text streams
+import io
 
-# System-specific parameters and functions
-import sys
+# Context manager utilities
+import contextlib
+
+# Lane assignment heap
+import heapq
+
+# Read counting for index-read demultiplexing
+import collections
+
+# Serialization of barcode table cache
+import marshal
+
+# Cached plate formats
+import functools
 
-# Implementation of import
-import importlib
-from importlib import util
+# Mismatch neighborhoods of barcode sequences
+import itertools
 
-# Prettytable
-prettytable_loader = importlib.util.find_spec('prettytable')
-found = prettytable_loader is not None
-if found is True:
-    from prettytable import PrettyTable
-else:
-    pass
+# Column access for Sample Sheet updates
+import operator
 
-# Time access and conversions, Basic data and time types
+# System-specific parameters and functions
+import sys
+
+# Time access and conversions
 import time
-from datetime import datetime
-
-# Log start time
-initialTime = datetime.now()
-
-# Define 3 lists and 4 dictionaries that this script will use to establish relationships between well_ID number (1-96) and well_ID label (A01-H12) [well_ID_list], between well_ID number (1-96) and index name (i5A01-i5H12 or i7A01-i7H12) [i5_well_IDs and i7_well_IDs], and between index name (i5A01-i5H12 or i7A01-i7H12) and index sequence (8-bp unique sequence) [i5Dict and i7Dict, i5_revcomp_Dict, i7_revcomp_Dict]:
-
-well_ID_list = [
-('1','A01'),
-('2','A02'),
-('3','A03'),
-('4','A04'),
-('5','A05'),
-('6','A06'),
-('7','A07'),
-('8','A08'),
-('9','A09'),
-('10','A10'),
-('11','A11'),
-('12','A12'),
-('13','B01'),
-('14','B02'),
-('15','B03'),
-('16','B04'),
-('17','B05'),
-('18','B06'),
-('19','B07'),
-('20','B08'),
-('21','B09'),
-('22','B10'),
-('23','B11'),
-('24','B12'),
-('25','C01'),
-('26','C02'),
-('27','C03'),
-('28','C04'),
-('29','C05'),
-('30','C06'),
-('31','C07'),
-('32','C08'),
-('33','C09'),
-('34','C10'),
-('35','C11'),
-('36','C12'),
-('37','D01'),
-('38','D02'),
-('39','D03'),
-('40','D04'),
-('41','D05'),
-('42','D06'),
-('43','D07'),
-('44','D08'),
-('45','D09'),
-('46','D10'),
-('47','D11'),
-('48','D12'),
-('49','E01'),
-('50','E02'),
-('51','E03'),
-('52','E04'),
-('53','E05'),
-('54','E06'),
-('55','E07'),
-('56','E08'),
-('57','E09'),
-('58','E10'),
-('59','E11'),
-('60','E12'),
-('61','F01'),
-('62','F02'),
-('63','F03'),
-('64','F04'),
-('65','F05'),
-('66','F06'),
-('67','F07'),
-('68','F08'),
-('69','F09'),
-('70','F10'),
-('71','F11'),
-('72','F12'),
-('73','G01'),
-('74','G02'),
-('75','G03'),
-('76','G04'),
-('77','G05'),
-('78','G06'),
-('79','G07'),
-('80','G08'),
-('81','G09'),
-('82','G10'),
-('83','G11'),
-('84','G12'),
-('85','H01'),
-('86','H02'),
-('87','H03'),
-('88','H04'),
-('89','H05'),
-('90','H06'),
-('91','H07'),
-('92','H08'),
-('93','H09'),
-('94','H10'),
-('95','H11'),
-('96','H12')
-]
-
-i5_well_IDs = [
-('1','i5A01'),
-('2','i5A02'),
-('3','i5A03'),
-('4','i5A04'),
-('5','i5A05'),
-('6','i5A06'),
-('7','i5A07'),
-('8','i5A08'),
-('9','i5A09'),
-('10','i5A10'),
-('11','i5A11'),
-('12','i5A12'),
-('13','i5B01'),
-('14','i5B02'),
-('15','i5B03'),
-('16','i5B04'),
-('17','i5B05'),
-('18','i5B06'),
-('19','i5B07'),
-('20','i5B08'),
-('21','i5B09'),
-('22','i5B10'),
-('23','i5B11'),
-('24','i5B12'),
-('25','i5C01'),
-('26','i5C02'),
-('27','i5C03'),
-('28','i5C04'),
-('29','i5C05'),
-('30','i5C06'),
-('31','i5C07'),
-('32','i5C08'),
-('33','i5C09'),
-('34','i5C10'),
-('35','i5C11'),
-('36','i5C12'),
-('37','i5D01'),
-('38','i5D02'),
-('39','i5D03'),
-('40','i5D04'),
-('41','i5D05'),
-('42','i5D06'),
-('43','i5D07'),
-('44','i5D08'),
-('45','i5D09'),
-('46','i5D10'),
-('47','i5D11'),
-('48','i5D12'),
-('49','i5E01'),
-('50','i5E02'),
-('51','i5E03'),
-('52','i5E04'),
-('53','i5E05'),
-('54','i5E06'),
-('55','i5E07'),
-('56','i5E08'),
-('57','i5E09'),
-('58','i5E10'),
-('59','i5E11'),
-('60','i5E12'),
-('61','i5F01'),
-('62','i5F02'),
-('63','i5F03'),
-('64','i5F04'),
-('65','i5F05'),
-('66','i5F06'),
-('67','i5F07'),
-('68','i5F08'),
-('69','i5F09'),
-('70','i5F10'),
-('71','i5F11'),
-('72','i5F12'),
-('73','i5G01'),
-('74','i5G02'),
-('75','i5G03'),
-('76','i5G04'),
-('77','i5G05'),
-('78','i5G06'),
-('79','i5G07'),
-('80','i5G08'),
-('81','i5G09'),
-('82','i5G10'),
-('83','i5G11'),
-('84','i5G12'),
-('85','i5H01'),
-('86','i5H02'),
-('87','i5H03'),
-('88','i5H04'),
-('89','i5H05'),
-('90','i5H06'),
-('91','i5H07'),
-('92','i5H08'),
-('93','i5H09'),
-('94','i5H10'),
-('95','i5H11'),
-('96','i5H12')
-]
-
-i7_well_IDs = [
-('1','i7A01'),
-('2','i7A02'),
-('3','i7A03'),
-('4','i7A04'),
-('5','i7A05'),
-('6','i7A06'),
-('7','i7A07'),
-('8','i7A08'),
-('9','i7A09'),
-('10','i7A10'),
-('11','i7A11'),
-('12','i7A12'),
-('13','i7B01'),
-('14','i7B02'),
-('15','i7B03'),
-('16','i7B04'),
-('17','i7B05'),
-('18','i7B06'),
-('19','i7B07'),
-('20','i7B08'),
-('21','i7B09'),
-('22','i7B10'),
-('23','i7B11'),
-('24','i7B12'),
-('25','i7C01'),
-('26','i7C02'),
-('27','i7C03'),
-('28','i7C04'),
-('29','i7C05'),
-('30','i7C06'),
-('31','i7C07'),
-('32','i7C08'),
-('33','i7C09'),
-('34','i7C10'),
-('35','i7C11'),
-('36','i7C12'),
-('37','i7D01'),
-('38','i7D02'),
-('39','i7D03'),
-('40','i7D04'),
-('41','i7D05'),
-('42','i7D06'),
-('43','i7D07'),
-('44','i7D08'),
-('45','i7D09'),
-('46','i7D10'),
-('47','i7D11'),
-('48','i7D12'),
-('49','i7E01'),
-('50','i7E02'),
-('51','i7E03'),
-('52','i7E04'),
-('53','i7E05'),
-('54','i7E06'),
-('55','i7E07'),
-('56','i7E08'),
-('57','i7E09'),
-('58','i7E10'),
-('59','i7E11'),
-('60','i7E12'),
-('61','i7F01'),
-('62','i7F02'),
-('63','i7F03'),
-('64','i7F04'),
-('65','i7F05'),
-('66','i7F06'),
-('67','i7F07'),
-('68','i7F08'),
-('69','i7F09'),
-('70','i7F10'),
-('71','i7F11'),
-('72','i7F12'),
-('73','i7G01'),
-('74','i7G02'),
-('75','i7G03'),
-('76','i7G04'),
-('77','i7G05'),
-('78','i7G06'),
-('79','i7G07'),
-('80','i7G08'),
-('81','i7G09'),
-('82','i7G10'),
-('83','i7G11'),
-('84','i7G12'),
-('85','i7H01'),
-('86','i7H02'),
-('87','i7H03'),
-('88','i7H04'),
-('89','i7H05'),
-('90','i7H06'),
-('91','i7H07'),
-('92','i7H08'),
-('93','i7H09'),
-('94','i7H10'),
-('95','i7H11'),
-('96','i7H12')
-]
-
-i5revcomp_Dict = {
-'i5A01':'CTCCATCA',
-'i5A02':'CGAATTGA',
-'i5A03':'CGTTAAGA',
-'i5A04':'AGGAGTGA',
-'i5A05':'TCAATCGA',
-'i5A06':'AGTACCGA',
-'i5A07':'TCGGATTA',
-'i5A08':'TTGTGAGA',
-'i5A09':'TCTCGAGA',
-'i5A10':'CCGGTATA',
-'i5A11':'ATCTTGCA',
-'i5A12':'CCAACTTA',
-'i5B01':'CTAGGATA',
-'i5B02':'ACCAGAGA',
-'i5B03':'AGGTCAGA',
-'i5B04':'ATCGCATA',
-'i5B05':'CGCTAGTA',
-'i5B06':'TCGATGTA',
-'i5B07':'TGAGTAGA',
-'i5B08':'AACGCTCA',
-'i5B09':'TTCGCTGA',
-'i5B10':'ACGTGCTA',
-'i5B11':'ATACGCCA',
-'i5B12':'AGCAGCTA',
-'i5C01':'TGTGAACA',
-'i5C02':'ATGCCGTA',
-'i5C03':'AGAGCACA',
-'i5C04':'CGTCTACA',
-'i5C05':'AGGCAACA',
-'i5C06':'AAGCGTCA',
-'i5C07':'CCTTATCA',
-'i5C08':'CGTTGTTA',
-'i5C09':'TGACGCTA',
-'i5C10':'ACTCATGA',
-'i5C11':'TGTGCTTA',
-'i5C12':'CACCGTTA',
-'i5D01':'CAGTAGGA',
-'i5D02':'TGGCATGA',
-'i5D03':'CATGATGA',
-'i5D04':'ATCCAGGA',
-'i5D05':'CAATGACA',
-'i5D06':'CGGAATCA',
-'i5D07':'TTGGTACA',
-'i5D08':'CTACTGTA',
-'i5D09':'TCTTCTGA',
-'i5D10':'AGTTCGTA',
-'i5D11':'ACCTACGA',
-'i5D12':'TGAACGGA',
-'i5E01':'CAACACTA',
-'i5E02':'ATAGAGCA',
-'i5E03':'ACATTCCA',
-'i5E04':'TGCAACCA',
-'i5E05':'TCCTCCTA',
-'i5E06':'CTCGTCTA',
-'i5E07':'AGAGATGA',
-'i5E08':'CCTAAGTA',
-'i5E09':'CTGGAAGA',
-'i5E10':'TGCCAATA',
-'i5E11':'TCTACGCA',
-'i5E12':'ACTGTGGA',
-'i5F01':'TGATTGCA',
-'i5F02':'CTTACGGA',
-'i5F03':'CACATGCA',
-'i5F04':'TTCAGTCA',
-'i5F05':'AAGGACCA',
-'i5F06':'TGGTGGTA',
-'i5F07':'CTCAGGTA',
-'i5F08':'TCGAGACA',
-'i5F09':'CCAGAACA',
-'i5F10':'TTACACGA',
-'i5F11':'CAGACCTA',
-'i5F12':'CGCATATA',
-'i5G01':'ACTGACTA',
-'i5G02':'ACAGGTCA',
-'i5G03':'AACACGGA',
-'i5G04':'TGTCTGGA',
-'i5G05':'CTAGTTCA',
-'i5G06':'CTATCCTA',
-'i5G07':'CATCAGCA',
-'i5G08':'AGTGGATA',
-'i5G09':'TCACCATA',
-'i5G10':'CGATCTCA',
-'i5G11':'AATTGCGA',
-'i5G12':'AGTCCTCA',
-'i5H01':'TTGACCGA',
-'i5H02':'ATGTCTCA',
-'i5H03':'AACGTAGA',
-'i5H04':'CTTGCACA',
-'i5H05':'TTCATGGA',
-'i5H06':'CCATGGTA',
-'i5H07':'TTAGCGTA',
-'i5H08':'CCATTAGA',
-'i5H09':'CTAAGCGA',
-'i5H10':'TCGTAGCA',
-'i5H11':'CAAGTGGA',
-'i5H12':'TCCGTTCA'
+
+# Imported where first used, to keep startup (and 'import SampleSheet') fast:
+#   concurrent.futures (worker processes for lane Sample Sheets and demultiplexing), gzip (FASTQ reading),
+#   csv (primer tables, quoted Sample Sheet lines), hashlib (barcode table cache), argparse (command line),
+#   pathlib (filesystem paths), fnmatch (watch folders), http.server and urllib.parse (Sample Sheet service),
+#   json (watch folders, Sample Sheet service, metrics files), signal (watch folders, Sample Sheet service), and
+#   cProfile, pstats and threading (profiling)
+
+# Plate geometry:
+# Well labels ('A01'-'H12'), well numbers ('1'-'96') and index names ('i5A01'-'i5H12', 'i7A01'-'i7H12') for 96-, 384- and
+# 1536-well plates, with wells numbered across rows ('row': A01, A02, ... A12, B01, ...) or down columns ('column': A01,
+# B01, ... H01, A02, ...).  Labels are computed once per plate format and looked up in both directions in constant time.
+plate_dimensions = {
+96: (8, 12),
+384: (16, 24),
+1536: (32, 48)
 }
 
-i5Dict = {
-'i5A01':'GAGGTAGT',
-'i5A02':'GCTTAACT',
-'i5A03':'GCAATTCT',
-'i5A04':'TCCTCACT',
-'i5A05':'AGTTAGCT',
-'i5A06':'TCATGGCT',
-'i5A07':'AGCCTAAT',
-'i5A08':'AACACTCT',
-'i5A09':'AGAGCTCT',
-'i5A10':'GGCCATAT',
-'i5A11':'TAGAACGT',
-'i5A12':'GGTTGAAT',
-'i5B01':'GATCCTAT',
-'i5B02':'TGGTCTCT',
-'i5B03':'TCCAGTCT',
-'i5B04':'TAGCGTAT',
-'i5B05':'GCGATCAT',
-'i5B06':'AGCTACAT',
-'i5B07':'ACTCATCT',
-'i5B08':'TTGCGAGT',
-'i5B09':'AAGCGACT',
-'i5B10':'TGCACGAT',
-'i5B11':'TATGCGGT',
-'i5B12':'TCGTCGAT',
-'i5C01':'ACACTTGT',
-'i5C02':'TACGGCAT',
-'i5C03':'TCTCGTGT',
-'i5C04':'GCAGATGT',
-'i5C05':'TCCGTTGT',
-'i5C06':'TTCGCAGT',
-'i5C07':'GGAATAGT',
-'i5C08':'GCAACAAT',
-'i5C09':'ACTGCGAT',
-'i5C10':'TGAGTACT',
-'i5C11':'ACACGAAT',
-'i5C12':'GTGGCAAT',
-'i5D01':'GTCATCCT',
-'i5D02':'ACCGTACT',
-'i5D03':'GTACTACT',
-'i5D04':'TAGGTCCT',
-'i5D05':'GTTACTGT',
-'i5D06':'GCCTTAGT',
-'i5D07':'AACCATGT',
-'i5D08':'GATGACAT',
-'i5D09':'AGAAGACT',
-'i5D10':'TCAAGCAT',
-'i5D11':'TGGATGCT',
-'i5D12':'ACTTGCCT',
-'i5E01':'GTTGTGAT',
-'i5E02':'TATCTCGT',
-'i5E03':'TGTAAGGT',
-'i5E04':'ACGTTGGT',
-'i5E05':'AGGAGGAT',
-'i5E06':'GAGCAGAT',
-'i5E07':'TCTCTACT',
-'i5E08':'GGATTCAT',
-'i5E09':'GACCTTCT',
-'i5E10':'ACGGTTAT',
-'i5E11':'AGATGCGT',
-'i5E12':'TGACACCT',
-'i5F01':'ACTAACGT',
-'i5F02':'GAATGCCT',
-'i5F03':'GTGTACGT',
-'i5F04':'AAGTCAGT',
-'i5F05':'TTCCTGGT',
-'i5F06':'ACCACCAT',
-'i5F07':'GAGTCCAT',
-'i5F08':'AGCTCTGT',
-'i5F09':'GGTCTTGT',
-'i5F10':'AATGTGCT',
-'i5F11':'GTCTGGAT',
-'i5F12':'GCGTATAT',
-'i5G01':'TGACTGAT',
-'i5G02':'TGTCCAGT',
-'i5G03':'TTGTGCCT',
-'i5G04':'ACAGACCT',
-'i5G05':'GATCAAGT',
-'i5G06':'GATAGGAT',
-'i5G07':'GTAGTCGT',
-'i5G08':'TCACCTAT',
-'i5G09':'AGTGGTAT',
-'i5G10':'GCTAGAGT',
-'i5G11':'TTAACGCT',
-'i5G12':'TCAGGAGT',
-'i5H01':'AACTGGCT',
-'i5H02':'TACAGAGT',
-'i5H03':'TTGCATCT',
-'i5H04':'GAACGTGT',
-'i5H05':'AAGTACCT',
-'i5H06':'GGTACCAT',
-'i5H07':'AATCGCAT',
-'i5H08':'GGTAATCT',
-'i5H09':'GATTCGCT',
-'i5H10':'AGCATCGT',
-'i5H11':'GTTCACCT',
-'i5H12':'AGGCAAGT'
+# Row labels for a number of rows: 'A'-'Z', then 'AA', 'AB', ... (1536-well plates have rows 'A'-'AF')
+def row_letters(rows):
+    letters = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+    return [letters[i] if i < 26 else letters[i // 26 - 1] + letters[i % 26] for i in range(rows)]
+
+# Zero-padded well label ('A1' -> 'A01', 'af48' -> 'AF48')
+def normalize_well_label(label):
+    label = label.strip().upper()
+    row = label.rstrip('0123456789')
+    column = label[len(row):]
+    if not row.isalpha() or not column:
+        raise ValueError("'"+label+"' is not a well label (row letter(s) followed by column number, e.g. 'A01')")
+    return row + '%02d' % int(column)
+
+class PlateFormat:
+    def __init__(self, wells=96, order='row'):
+        if wells not in plate_dimensions:
+            raise ValueError('plate format should be one of '+', '.join(str(i) for i in plate_dimensions)+' wells, got '+str(wells))
+        if order not in ('row', 'column'):
+            raise ValueError("well order should be 'row' or 'column', got '"+str(order)+"'")
+        self.wells = wells
+        self.order = order
+        self.rows, self.columns = plate_dimensions[wells]
+        self.row_labels = row_letters(self.rows)
+        if order == 'row':
+            self.labels = tuple(r + '%02d' % c for r in self.row_labels for c in range(1, self.columns + 1))
+        else:
+            self.labels = tuple(r + '%02d' % c for c in range(1, self.columns + 1) for r in self.row_labels)
+        self.numbers = {label: n for n, label in enumerate(self.labels, start=1)}
+
+    def __repr__(self):
+        return 'PlateFormat('+str(self.wells)+", '"+self.order+"')"
+
+    # Well label for a well number (1 to wells)
+    def label(self, number):
+        if not 1 <= number <= self.wells:
+            raise ValueError('well number '+str(number)+' is outside 1-'+str(self.wells)+' ('+str(self.wells)+'-well plate)')
+        return self.labels[number - 1]
+
+    # Well number for a well label ('A01' or 'A1')
+    def number(self, label):
+        number = self.numbers.get(label)
+        if number is None:
+            number = self.numbers.get(normalize_well_label(label))
+            if number is None:
+                raise ValueError("'"+label+"' is not a well of a "+str(self.wells)+'-well plate')
+        return number
+
+    # Index name for a kit ('i5' or 'i7') and well number (e.g. 'i7', 1 -> 'i7A01')
+    def index_name(self, kit, number):
+        return kit + self.label(number)
+
+    # Well number for an index name (e.g. 'i7A01' -> 1)
+    def index_number(self, name):
+        return self.number(name[2:])
+
+    # (row index, column number) of a well number (e.g. 14 -> (1, 2) for B02 on a 96-well plate numbered across rows)
+    def position(self, number):
+        label = self.label(number)
+        row = label.rstrip('0123456789')
+        return self.row_labels.index(row), int(label[len(row):])
+
+    # Plate layout: one list per plate row, of (well number, well label) for each column
+    def grid(self):
+        return [[(self.numbers[r + '%02d' % c], r + '%02d' % c) for c in range(1, self.columns + 1)] for r in self.row_labels]
+
+# Shared PlateFormat for a number of wells and well order (each format is computed once)
+@functools.lru_cache(maxsize=None)
+def plate_format(wells=96, order='row'):
+    return PlateFormat(wells, order)
+
+# Default: 96-well plate, wells numbered across rows ('1' = A01, '12' = A12, '13' = B01, ... '96' = H12)
+default_plate = plate_format(96, 'row')
+
+# Index sequences (i5Dict, i7Dict, as they occur in primers; i5revcomp_Dict, i7revcomp_Dict, reverse complements) are derived
+# from the primer tables that accompany this script (i5_barcode_primers.csv, i7_barcode_primers.csv; columns 'number',
+# 'well position', 'Name', 'Sequence').  Each index is the sequence between the flowcell adapter (P5 or P7) and the
+# Nextera read primer within the primer sequence.
+script_dir = os.path.dirname(os.path.realpath(__file__))
+i5_primers_csv = os.path.join(script_dir, 'i5_barcode_primers.csv')
+i7_primers_csv = os.path.join(script_dir, 'i7_barcode_primers.csv')
+
+primer_flanks = {
+'i5': ('AATGATACGGCGACCACCGAGATCTACAC', 'TCGTCGGCAGCGTC'),
+'i7': ('CAAGCAGAAGACGGCATACGAGAT', 'GTCTCGTGGGCTCGG')
 }
 
-i7revcomp_Dict = {
-'i7A01':'GTACGTCA',
-'i7A02':'TGCAGTTA',
-'i7A03':'ACTGTGGA',
-'i7A04':'GGTTAAGA',
-'i7A05':'TCACACTA',
-'i7A06':'TAGAGGTA',
-'i7A07':'GCGACATA',
-'i7A08':'TACATGCA',
-'i7A09':'GATGATGA',
-'i7A10':'TGTGTGCA',
-'i7A11':'TCGCTACA',
-'i7A12':'AAGCTAGA',
-'i7B01':'TAGGACCA',
-'i7B02':'TCGTTGGA',
-'i7B03':'GTGTCCTA',
-'i7B04':'TCCGTATA',
-'i7B05':'TACGCTTA',
-'i7B06':'TACAACGA',
-'i7B07':'GAAGGAGA',
-'i7B08':'AAGCATCA',
-'i7B09':'TGAGATCA',
-'i7B10':'TCTAGACA',
-'i7B11':'TGCTCATA',
-'i7B12':'TAACTCCA',
-'i7C01':'GACACACA',
-'i7C02':'TTGTAGCA',
-'i7C03':'GTCTACGA',
-'i7C04':'GCATTACA',
-'i7C05':'GTTCCATA',
-'i7C06':'GAATACCA',
-'i7C07':'TCACTTGA',
-'i7C08':'ACACAAGA',
-'i7C09':'ACTACAGA',
-'i7C10':'TCTCAGGA',
-'i7C11':'ATCGTGCA',
-'i7C12':'TCCACGTA',
-'i7D01':'ATCCATGA',
-'i7D02':'TTCGCAGA',
-'i7D03':'TCGTCTCA',
-'i7D04':'ACTTACGA',
-'i7D05':'TCGGATTA',
-'i7D06':'TTGGTCTA',
-'i7D07':'ATAGCGGA',
-'i7D08':'TGTAACCA',
-'i7D09':'ACAGGCTA',
-'i7D10':'AAGTCGCA',
-'i7D11':'GAGTTCGA',
-'i7D12':'ACTCTTCA',
-'i7E01':'AAGACCTA',
-'i7E02':'ACCATCCA',
-'i7E03':'GAACGGTA',
-'i7E04':'TAGTGAGA',
-'i7E05':'GTCCAACA',
-'i7E06':'TATGGCGA',
-'i7E07':'GCTTATCA',
-'i7E08':'GTGACTGA',
-'i7E09':'ACGTGATA',
-'i7E10':'GGTTCTTA',
-'i7E11':'GATCAGCA',
-'i7E12':'GGACAATA',
-'i7F01':'AACTCTGA',
-'i7F02':'TGACCTTA',
-'i7F03':'GGAAGTGA',
-'i7F04':'AAGAAGGA',
-'i7F05':'GCAATCTA',
-'i7F06':'ACGAGTCA',
-'i7F07':'TTATGCCA',
-'i7F08':'GCCATAGA',
-'i7F09':'TAATCGGA',
-'i7F10':'TCTCGTTA',
-'i7F11':'GGTCTGTA',
-'i7F12':'ATCCGGTA',
-'i7G01':'ATGCGACA',
-'i7G02':'TGAACGCA',
-'i7G03':'TGGTATGA',
-'i7G04':'TGGACAGA',
-'i7G05':'TTGCAAGA',
-'i7G06':'ACTAGGTA',
-'i7G07':'TACCGATA',
-'i7G08':'ATTGGTGA',
-'i7G09':'TTCCTCGA',
-'i7G10':'TCATGGTA',
-'i7G11':'TATCCACA',
-'i7G12':'GACTTGTA',
-'i7H01':'ATGGAGTA',
-'i7H02':'GTCAGATA',
-'i7H03':'GAGCACTA',
-'i7H04':'GTCATTCA',
-'i7H05':'TCCTAAGA',
-'i7H06':'GATGCGTA',
-'i7H07':'TGCTTCCA',
-'i7H08':'ATGTCAGA',
-'i7H09':'GTTGCTCA',
-'i7H10':'GATATCCA',
-'i7H11':'GTTAGCGA',
-'i7H12':'GAGGTACA'
+complement_table = str.maketrans('ACGTNacgtn', 'TGCANtgcan')
+complement_bytes_table = bytes.maketrans(b'ACGTNacgtn', b'TGCANtgcan')
+
+# Reverse complement of a DNA sequence
+def reverse_complement(sequence):
+    return sequence.translate(complement_table)[::-1]
+
+# Reverse complements of a whole set of DNA sequences (any lengths) in one pass: the set is joined into a single bytes
+# block, complemented with one bytes.translate() and reversed as a block, which also reverses the order of the sequences
+# (restored after splitting)
+def reverse_complement_all(sequences):
+    if not sequences:
+        return []
+    block = '\n'.join(sequences).encode('ascii').translate(complement_bytes_table)[::-1]
+    return block.decode('ascii').split('\n')[::-1]
+
+# View of a barcode table {index name: sequence as in primer} in 'forward' (as in primer) or 'revcomp' orientation
+def orient_barcodes(indexDict, orientation):
+    if orientation == 'forward':
+        return indexDict
+    elif orientation == 'revcomp':
+        return dict(zip(indexDict, reverse_complement_all(list(indexDict.values()))))
+    raise ValueError("orientation should be 'forward' or 'revcomp', got '"+str(orientation)+"'")
+
+# Orientations ('forward' or 'revcomp') of i7 and i5 index sequences as entered in a Sample Sheet, per Workflow
+workflow_orientations = {
+'A': ('revcomp', 'forward'),
+'B': ('revcomp', 'revcomp')
 }
 
-i7Dict = {
-'i7A01':'TGACGTAC',
-'i7A02':'TAACTGCA',
-'i7A03':'TCCACAGT',
-'i7A04':'TCTTAACC',
-'i7A05':'TAGTGTGA',
-'i7A06':'TACCTCTA',
-'i7A07':'TATGTCGC',
-'i7A08':'TGCATGTA',
-'i7A09':'TCATCATC',
-'i7A10':'TGCACACA',
-'i7A11':'TGTAGCGA',
-'i7A12':'TCTAGCTT',
-'i7B01':'TGGTCCTA',
-'i7B02':'TCCAACGA',
-'i7B03':'TAGGACAC',
-'i7B04':'TATACGGA',
-'i7B05':'TAAGCGTA',
-'i7B06':'TCGTTGTA',
-'i7B07':'TCTCCTTC',
-'i7B08':'TGATGCTT',
-'i7B09':'TGATCTCA',
-'i7B10':'TGTCTAGA',
-'i7B11':'TATGAGCA',
-'i7B12':'TGGAGTTA',
-'i7C01':'TGTGTGTC',
-'i7C02':'TGCTACAA',
-'i7C03':'TCGTAGAC',
-'i7C04':'TGTAATGC',
-'i7C05':'TATGGAAC',
-'i7C06':'TGGTATTC',
-'i7C07':'TCAAGTGA',
-'i7C08':'TCTTGTGT',
-'i7C09':'TCTGTAGT',
-'i7C10':'TCCTGAGA',
-'i7C11':'TGCACGAT',
-'i7C12':'TACGTGGA',
-'i7D01':'TCATGGAT',
-'i7D02':'TCTGCGAA',
-'i7D03':'TGAGACGA',
-'i7D04':'TCGTAAGT',
-'i7D05':'TAATCCGA',
-'i7D06':'TAGACCAA',
-'i7D07':'TCCGCTAT',
-'i7D08':'TGGTTACA',
-'i7D09':'TAGCCTGT',
-'i7D10':'TGCGACTT',
-'i7D11':'TCGAACTC',
-'i7D12':'TGAAGAGT',
-'i7E01':'TAGGTCTT',
-'i7E02':'TGGATGGT',
-'i7E03':'TACCGTTC',
-'i7E04':'TCTCACTA',
-'i7E05':'TGTTGGAC',
-'i7E06':'TCGCCATA',
-'i7E07':'TGATAAGC',
-'i7E08':'TCAGTCAC',
-'i7E09':'TATCACGT',
-'i7E10':'TAAGAACC',
-'i7E11':'TGCTGATC',
-'i7E12':'TATTGTCC',
-'i7F01':'TCAGAGTT',
-'i7F02':'TAAGGTCA',
-'i7F03':'TCACTTCC',
-'i7F04':'TCCTTCTT',
-'i7F05':'TAGATTGC',
-'i7F06':'TGACTCGT',
-'i7F07':'TGGCATAA',
-'i7F08':'TCTATGGC',
-'i7F09':'TCCGATTA',
-'i7F10':'TAACGAGA',
-'i7F11':'TACAGACC',
-'i7F12':'TACCGGAT',
-'i7G01':'TGTCGCAT',
-'i7G02':'TGCGTTCA',
-'i7G03':'TCATACCA',
-'i7G04':'TCTGTCCA',
-'i7G05':'TCTTGCAA',
-'i7G06':'TACCTAGT',
-'i7G07':'TATCGGTA',
-'i7G08':'TCACCAAT',
-'i7G09':'TCGAGGAA',
-'i7G10':'TACCATGA',
-'i7G11':'TGTGGATA',
-'i7G12':'TACAAGTC',
-'i7H01':'TACTCCAT',
-'i7H02':'TATCTGAC',
-'i7H03':'TAGTGCTC',
-'i7H04':'TGAATGAC',
-'i7H05':'TCTTAGGA',
-'i7H06':'TACGCATC',
-'i7H07':'TGGAAGCA',
-'i7H08':'TCTGACAT',
-'i7H09':'TGAGCAAC',
-'i7H10':'TGGATATC',
-'i7H11':'TCGCTAAC',
-'i7H12':'TGTACCTC'    
+# Parse a primer table (CSV text) into {index name: index sequence as it occurs in the primer}, e.g. {'i5A01': 'GAGGTAGT', ...};
+# index names combine the kit ('i5' or 'i7') with the zero-padded well position ('A1' -> 'i5A01')
+def parse_primer_table(text, kit, source='primer table'):
+    adapter, read_primer = primer_flanks[kit]
+    indexDict = {}
+    import csv
+    for line_number, row in enumerate(csv.DictReader(io.StringIO(text)), start=2):
+        well = (row.get('well position') or '').strip()
+        primer = (row.get('Sequence') or '').strip().upper()
+        if not well and not primer:
+            continue
+        start = primer.find(adapter)
+        end = primer.find(read_primer, start + len(adapter)) if start >= 0 else -1
+        if start < 0 or end <= start + len(adapter):
+            raise ValueError(str(source)+', line '+str(line_number)+': no '+kit+" index found in primer '"+(row.get('Name') or '')+"' (well position '"+well+"')")
+        try:
+            indexDict[kit + normalize_well_label(well)] = primer[start + len(adapter):end]
+        except ValueError as e:
+            raise ValueError(str(source)+', line '+str(line_number)+': '+str(e))
+    return indexDict
+
+# Load the {index name: sequence} table of a primer table, in primer orientation.
+# Parsed tables are cached (Python marshal format) in a __pycache__ directory next to the primer table, keyed by the
+# table's modification time and size, and by its SHA-256 hash when the modification time alone has changed;
+# the cache is skipped when it cannot be read or written.
+barcode_cache_version = 2
+
+def load_barcode_table(csv_path, kit):
+    from pathlib import Path
+    csv_path = Path(csv_path)
+    cache_path = csv_path.parent / '__pycache__' / (csv_path.name + '.barcodes')
+    stat = csv_path.stat()
+    cached = None
+    try:
+        with open(cache_path, 'rb') as f:
+            cached = marshal.loads(f.read())
+        if cached['version'] != barcode_cache_version or cached['kit'] != kit:
+            cached = None
+        elif (cached['mtime_ns'], cached['size']) == (stat.st_mtime_ns, stat.st_size):
+            return cached['forward']
+    except (OSError, EOFError, ValueError, TypeError, KeyError):
+        cached = None
+
+    import hashlib
+    data = csv_path.read_bytes()
+    sha256 = hashlib.sha256(data).hexdigest()
+    if cached is not None and cached['sha256'] == sha256:
+        forward = cached['forward']
+    else:
+        forward = parse_primer_table(data.decode('utf-8-sig'), kit, csv_path)
+    try:
+        cache_path.parent.mkdir(exist_ok=True)
+        tmp_path = cache_path.with_name(cache_path.name + '.' + str(os.getpid()))
+        with open(tmp_path, 'wb') as f:
+            marshal.dump({'version': barcode_cache_version, 'kit': kit, 'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size,
+                          'sha256': sha256, 'forward': forward}, f)
+        os.replace(tmp_path, cache_path)
+    except OSError:
+        pass
+    return forward
+
+# Barcode tables are loaded on first use (see Barcode kits, below); the module attributes i5Dict, i5revcomp_Dict, i7Dict and
+# i7revcomp_Dict remain available to importers (SampleSheet.i5Dict loads the i5 tables)
+barcode_table_files = {'i5': i5_primers_csv, 'i7': i7_primers_csv}
+
+# Barcode kits:
+# Index primer tables other than those that accompany this script (e.g. Nextera XT index sets A-D, IDT UD index plates,
+# in-house 10-bp sets) are named barcode kits, each an i7 and/or i5 primer table with the same columns as
+# i7_barcode_primers.csv and i5_barcode_primers.csv.  A kit is a directory holding i7_barcode_primers.csv and/or
+# i5_barcode_primers.csv within a barcode kit directory (barcode_kits next to this script, and any directories listed in
+# the SAMPLESHEET_BARCODE_KITS environment variable), named by its directory, or is registered with
+# register_barcode_kit().  The kit 'default' is the primer tables that accompany this script; manifests (and service
+# requests) choose another with 'barcode_kit: <name>'.  Kits are loaded on first use, their reverse-complement views
+# are built when first needed, and only the barcode_kit_cache_size most recently used kits stay in memory.
+default_barcode_kit = 'default'
+barcode_kit_cache_size = 8
+barcode_kits = {default_barcode_kit: barcode_table_files}
+
+# Register a barcode kit by name, from primer table files (at least one of i7_csv, i5_csv)
+def register_barcode_kit(name, i7_csv=None, i5_csv=None):
+    files = {kit: path for kit, path in (('i7', i7_csv), ('i5', i5_csv)) if path}
+    if not files:
+        raise ValueError("barcode kit '"+name+"' needs an i7 or i5 primer table")
+    barcode_kits[name] = files
+    # a kit registered again under the same name is loaded again
+    _load_barcode_kit.cache_clear()
+    render_plateview.cache_clear()
+    barcode_index.cache_clear()
+
+# Barcode kit directories: barcode_kits next to this script, then those in SAMPLESHEET_BARCODE_KITS
+def barcode_kit_dirs():
+    return [os.path.join(script_dir, 'barcode_kits')] + [i for i in os.environ.get('SAMPLESHEET_BARCODE_KITS', '').split(os.pathsep) if i]
+
+# Primer table files {'i7': path, 'i5': path} of a barcode kit, registered or found in a barcode kit directory
+def barcode_kit_files(name):
+    if name in barcode_kits:
+        return barcode_kits[name]
+    if name and not name.startswith('.') and os.path.basename(name) == name:
+        for directory in barcode_kit_dirs():
+            files = {kit: os.path.join(directory, name, kit + '_barcode_primers.csv') for kit in ('i7', 'i5')}
+            files = {kit: path for kit, path in files.items() if os.path.isfile(path)}
+            if files:
+                return files
+    raise ValueError("unknown barcode kit '"+str(name)+"' (barcode kits: "+', '.join(barcode_kit_names())+")")
+
+# Names of the registered barcode kits and of those in barcode kit directories
+def barcode_kit_names():
+    names = list(barcode_kits)
+    for directory in barcode_kit_dirs():
+        with contextlib.suppress(OSError), os.scandir(directory) as entries:
+            names.extend(sorted(entry.name for entry in entries if entry.is_dir() and not entry.name.startswith('.') and
+                                any(os.path.isfile(os.path.join(entry.path, kit + '_barcode_primers.csv')) for kit in ('i7', 'i5'))))
+    return list(dict.fromkeys(names))
+
+class BarcodeKit:
+    def __init__(self, name, files):
+        self.name = name
+        self.files = files
+        self.tables = {}
+
+    def __repr__(self):
+        return "BarcodeKit('"+self.name+"')"
+
+    # Barcode table {index name: sequence} of an index kit ('i7' or 'i5') in 'forward' (as in primer) or 'revcomp'
+    # orientation; a forward table is loaded, and a revcomp table derived from it, when first needed
+    def table(self, kit, orientation='forward'):
+        table = self.tables.get((kit, orientation))
+        if table is None:
+            if orientation not in ('forward', 'revcomp'):
+                raise ValueError("orientation should be 'forward' or 'revcomp', got '"+str(orientation)+"'")
+            if kit not in self.files:
+                raise ValueError("barcode kit '"+self.name+"' has no "+str(kit)+" primer table")
+            if orientation == 'forward':
+                table = load_barcode_table(self.files[kit], kit)
+            else:
+                table = orient_barcodes(self.table(kit), 'revcomp')
+            self.tables[kit, orientation] = table
+        return table
+
+    # Index sequences of an index kit by well number on a 1536-well plate (see SampleRecords), None for wells beyond
+    # the barcode table; built once per kit and orientation
+    def well_sequences(self, kit, orientation='forward'):
+        sequences = self.tables.get((kit, orientation, 'wells'))
+        if sequences is None:
+            table = self.table(kit, orientation)
+            sequences = (None,) + tuple(table.get(kit + label) for label in plate_format(1536, 'row').labels)
+            self.tables[kit, orientation, 'wells'] = sequences
+        return sequences
+
+# Barcode kit by name (None for the default kit); the most recently used kits are kept loaded, cached by kit name so
+# that None and 'default' share one BarcodeKit
+def load_barcode_kit(name=None):
+    return _load_barcode_kit(name or default_barcode_kit)
+
+@functools.lru_cache(maxsize=barcode_kit_cache_size)
+def _load_barcode_kit(name):
+    return BarcodeKit(name, barcode_kit_files(name))
+
+# Barcode table {index name: sequence} of a kit ('i7' or 'i5') in 'forward' (as in primer) or 'revcomp' orientation,
+# from a barcode kit (by name; None for the default kit)
+def barcode_table(kit, orientation='forward', barcode_kit=None):
+    return load_barcode_kit(barcode_kit).table(kit, orientation)
+
+barcode_table_names = {
+'i5Dict': ('i5', 'forward'),
+'i5revcomp_Dict': ('i5', 'revcomp'),
+'i7Dict': ('i7', 'forward'),
+'i7revcomp_Dict': ('i7', 'revcomp')
 }
 
-# Generate console table-views of i5 barcoded sequences:
+def __getattr__(name):
+    if name in barcode_table_names:
+        return barcode_table(*barcode_table_names[name])
+    raise AttributeError("module '"+__name__+"' has no attribute '"+name+"'")
+
+# i7 and i5 tables {index name: sequence} in the orientations entered in a Sample Sheet for a Workflow ('A' or 'B'),
+# from a barcode kit (None for the default kit); the i5 table is empty for a kit without i5 primers
+def workflow_barcodes(workflow, barcode_kit=None):
+    i7_orientation, i5_orientation = workflow_orientations[workflow]
+    kit = load_barcode_kit(barcode_kit)
+    return kit.table('i7', i7_orientation), kit.table('i5', i5_orientation) if 'i5' in kit.files else {}
+
+# Plateviews: a barcode table laid out by plate geometry, each well showing well number, index name and sequence (wells
+# beyond the barcode table show their number only).  Views are rendered in one pass over the plate grid and the most
+# recently used are cached per (kit, orientation, plate format, style, barcode kit):
+#   'text': bordered console table, cells centered
+#   'markdown': Markdown table, cell lines separated by <br>
+#   'html': HTML <table>, cell lines separated by <br>
+plateview_styles = ('text', 'markdown', 'html')
+
+# Center text in width columns (an odd remainder goes right of odd-length text, left of even-length text)
+def center_cell(text, width):
+    excess = width - len(text)
+    left = excess // 2 + (excess % 2 if len(text) % 2 == 0 else 0)
+    return ' ' * left + text + ' ' * (excess - left)
+
+@functools.lru_cache(maxsize=256)
+def render_plateview(kit, orientation='forward', wells=96, order='row', style='text', barcode_kit=None):
+    if style not in plateview_styles:
+        raise ValueError('plateview style should be one of '+', '.join(plateview_styles)+", got '"+str(style)+"'")
+    plate = plate_format(wells, order)
+    table = barcode_table(kit, orientation, barcode_kit)
+    header = [' '] + [str(c) for c in range(1, plate.columns + 1)]
+    rows = []
+    for row_label, row in zip(plate.row_labels, plate.grid()):
+        cells = []
+        for number, label in row:
+            name = kit + label
+            cells.append([str(number), name, table[name]] if name in table else [str(number), '', ''])
+        rows.append((row_label, cells))
+
+    if style == 'markdown':
+        lines = ['| ' + ' | '.join(header) + ' |', '|' + '---|' * len(header)]
+        lines.extend('| **' + row_label + '** | ' + ' | '.join('<br>'.join(i for i in cell if i) for cell in cells) + ' |' for row_label, cells in rows)
+        return '\n'.join(lines)
+    if style == 'html':
+        lines = ['<table>', '<tr>' + ''.join('<th>' + i.strip() + '</th>' for i in header) + '</tr>']
+        lines.extend('<tr><th>' + row_label + '</th>' + ''.join('<td>' + '<br>'.join(i for i in cell if i) + '</td>' for cell in cells) + '</tr>' for row_label, cells in rows)
+        lines.append('</table>')
+        return '\n'.join(lines)
+
+    # text: rows of cells are separated by a blank line
+    widths = [max([len(header[0])] + [len(row_label) for row_label, cells in rows])]
+    widths.extend(max([len(header[c])] + [len(i) for row_label, cells in rows for i in cells[c - 1]]) for c in range(1, len(header)))
+    border = '+' + '+'.join('-' * (width + 2) for width in widths) + '+'
+
+    def line(values):
+        return '| ' + ' | '.join(center_cell(value, width) for value, width in zip(values, widths)) + ' |'
+
+    lines = [border, line(header), border]
+    for r, (row_label, cells) in enumerate(rows):
+        lines.append(line([row_label] + [cell[0] for cell in cells]))
+        lines.append(line([''] + [cell[1] for cell in cells]))
+        lines.append(line([''] + [cell[2] for cell in cells]))
+        if r < len(rows) - 1:
+            lines.append(line([''] * len(header)))
+    lines.append(border)
+    return '\n'.join(lines)
+
+# Print a plateview of a barcode table (kit 'i7' or 'i5', orientation 'forward' or 'revcomp') from a barcode kit
+def plateview(kit, orientation='forward', plate=None, style='text', barcode_kit=None):
+    plate = plate or default_plate
+    print(render_plateview(kit, orientation, plate.wells, plate.order, style, barcode_kit or default_barcode_kit))
+
 # Define console plateviews
 def i5_plateview():
-    i5_plateview = PrettyTable()
-
-    plt_x = list(range(1,13))
-    plt_x.insert(0,' ')
-    i5_plateview.field_names = plt_x
-
-    i5_plateview_rowAa = [i5_well_IDs[i][0]+'\n'+i5_well_IDs[i][1]+'\n' for i in range(0,12)]
-    i5_plateview_rowAb = [i5Dict[k] for k in sorted(i5Dict.keys())[:12]]
-    i5_plateview_rowA = [a + b + '\n' for a, b in zip(i5_plateview_rowAa, i5_plateview_rowAb)]
-    i5_plateview_rowA.insert(0,'A')
-
-    i5_plateview_rowBa = [i5_well_IDs[i][0]+'\n'+i5_well_IDs[i][1]+'\n' for i in range(12,24)]
-    i5_plateview_rowBb = [i5Dict[k] for k in sorted(i5Dict.keys())[12:24]]
-    i5_plateview_rowB = [a + b + '\n' for a, b in zip(i5_plateview_rowBa, i5_plateview_rowBb)]
-    i5_plateview_rowB.insert(0,'B')
-
-    i5_plateview_rowCa = [i5_well_IDs[i][0]+'\n'+i5_well_IDs[i][1]+'\n' for i in range(24,36)]
-    i5_plateview_rowCb = [i5Dict[k] for k in sorted(i5Dict.keys())[24:36]]
-    i5_plateview_rowC = [a + b + '\n' for a, b in zip(i5_plateview_rowCa, i5_plateview_rowCb)]
-    i5_plateview_rowC.insert(0,'C')
-
-    i5_plateview_rowDa = [i5_well_IDs[i][0]+'\n'+i5_well_IDs[i][1]+'\n' for i in range(36,48)]
-    i5_plateview_rowDb = [i5Dict[k] for k in sorted(i5Dict.keys())[36:48]]
-    i5_plateview_rowD = [a + b + '\n' for a, b in zip(i5_plateview_rowDa, i5_plateview_rowDb)]
-    i5_plateview_rowD.insert(0,'D')
-
-    i5_plateview_rowEa = [i5_well_IDs[i][0]+'\n'+i5_well_IDs[i][1]+'\n' for i in range(48,60)]
-    i5_plateview_rowEb = [i5Dict[k] for k in sorted(i5Dict.keys())[48:60]]
-    i5_plateview_rowE = [a + b + '\n' for a, b in zip(i5_plateview_rowEa, i5_plateview_rowEb)]
-    i5_plateview_rowE.insert(0,'E')
-
-    i5_plateview_rowFa = [i5_well_IDs[i][0]+'\n'+i5_well_IDs[i][1]+'\n' for i in range(60,72)]
-    i5_plateview_rowFb = [i5Dict[k] for k in sorted(i5Dict.keys())[60:72]]
-    i5_plateview_rowF = [a + b + '\n' for a, b in zip(i5_plateview_rowFa, i5_plateview_rowFb)]
-    i5_plateview_rowF.insert(0,'F')
-
-    i5_plateview_rowGa = [i5_well_IDs[i][0]+'\n'+i5_well_IDs[i][1]+'\n' for i in range(72,84)]
-    i5_plateview_rowGb = [i5Dict[k] for k in sorted(i5Dict.keys())[72:84]]
-    i5_plateview_rowG = [a + b + '\n' for a, b in zip(i5_plateview_rowGa, i5_plateview_rowGb)]
-    i5_plateview_rowG.insert(0,'G')
-
-    i5_plateview_rowHa = [i5_well_IDs[i][0]+'\n'+i5_well_IDs[i][1]+'\n' for i in range(84,96)]
-    i5_plateview_rowHb = [i5Dict[k] for k in sorted(i5Dict.keys())[84:96]]
-    i5_plateview_rowH = [a + b for a, b in zip(i5_plateview_rowHa, i5_plateview_rowHb)]
-    i5_plateview_rowH.insert(0,'H')
-
-    i5_plateview.add_row(i5_plateview_rowA)
-    i5_plateview.add_row(i5_plateview_rowB)
-    i5_plateview.add_row(i5_plateview_rowC)
-    i5_plateview.add_row(i5_plateview_rowD)
-    i5_plateview.add_row(i5_plateview_rowE)
-    i5_plateview.add_row(i5_plateview_rowF)
-    i5_plateview.add_row(i5_plateview_rowG)
-    i5_plateview.add_row(i5_plateview_rowH)
-    
-    print(i5_plateview)
-    
+    plateview('i5', 'forward')
+
 def i5_revcomp_plateview():
-    i5_revcomp_plateview = PrettyTable()
-
-    plt_x = list(range(1,13))
-    plt_x.insert(0,' ')
-    i5_revcomp_plateview.field_names = plt_x
-
-    i5_revcomp_plateview_rowAa = [i5_well_IDs[i][0]+'\n'+i5_well_IDs[i][1]+'\n' for i in range(0,12)]
-    i5_revcomp_plateview_rowAb = [i5revcomp_Dict[k] for k in sorted(i5revcomp_Dict.keys())[:12]]
-    i5_revcomp_plateview_rowA = [a + b + '\n' for a, b in zip(i5_revcomp_plateview_rowAa, i5_revcomp_plateview_rowAb)]
-    i5_revcomp_plateview_rowA.insert(0,'A')
-
-    i5_revcomp_plateview_rowBa = [i5_well_IDs[i][0]+'\n'+i5_well_IDs[i][1]+'\n' for i in range(12,24)]
-    i5_revcomp_plateview_rowBb = [i5revcomp_Dict[k] for k in sorted(i5revcomp_Dict.keys())[12:24]]
-    i5_revcomp_plateview_rowB = [a + b + '\n' for a, b in zip(i5_revcomp_plateview_rowBa, i5_revcomp_plateview_rowBb)]
-    i5_revcomp_plateview_rowB.insert(0,'B')
-
-    i5_revcomp_plateview_rowCa = [i5_well_IDs[i][0]+'\n'+i5_well_IDs[i][1]+'\n' for i in range(24,36)]
-    i5_revcomp_plateview_rowCb = [i5revcomp_Dict[k] for k in sorted(i5revcomp_Dict.keys())[24:36]]
-    i5_revcomp_plateview_rowC = [a + b + '\n' for a, b in zip(i5_revcomp_plateview_rowCa, i5_revcomp_plateview_rowCb)]
-    i5_revcomp_plateview_rowC.insert(0,'C')
-
-    i5_revcomp_plateview_rowDa = [i5_well_IDs[i][0]+'\n'+i5_well_IDs[i][1]+'\n' for i in range(36,48)]
-    i5_revcomp_plateview_rowDb = [i5revcomp_Dict[k] for k in sorted(i5revcomp_Dict.keys())[36:48]]
-    i5_revcomp_plateview_rowD = [a + b + '\n' for a, b in zip(i5_revcomp_plateview_rowDa, i5_revcomp_plateview_rowDb)]
-    i5_revcomp_plateview_rowD.insert(0,'D')
-
-    i5_revcomp_plateview_rowEa = [i5_well_IDs[i][0]+'\n'+i5_well_IDs[i][1]+'\n' for i in range(48,60)]
-    i5_revcomp_plateview_rowEb = [i5revcomp_Dict[k] for k in sorted(i5revcomp_Dict.keys())[48:60]]
-    i5_revcomp_plateview_rowE = [a + b + '\n' for a, b in zip(i5_revcomp_plateview_rowEa, i5_revcomp_plateview_rowEb)]
-    i5_revcomp_plateview_rowE.insert(0,'E')
-
-    i5_revcomp_plateview_rowFa = [i5_well_IDs[i][0]+'\n'+i5_well_IDs[i][1]+'\n' for i in range(60,72)]
-    i5_revcomp_plateview_rowFb = [i5revcomp_Dict[k] for k in sorted(i5revcomp_Dict.keys())[60:72]]
-    i5_revcomp_plateview_rowF = [a + b + '\n' for a, b in zip(i5_revcomp_plateview_rowFa, i5_revcomp_plateview_rowFb)]
-    i5_revcomp_plateview_rowF.insert(0,'F')
-
-    i5_revcomp_plateview_rowGa = [i5_well_IDs[i][0]+'\n'+i5_well_IDs[i][1]+'\n' for i in range(72,84)]
-    i5_revcomp_plateview_rowGb = [i5revcomp_Dict[k] for k in sorted(i5revcomp_Dict.keys())[72:84]]
-    i5_revcomp_plateview_rowG = [a + b + '\n' for a, b in zip(i5_revcomp_plateview_rowGa, i5_revcomp_plateview_rowGb)]
-    i5_revcomp_plateview_rowG.insert(0,'G')
-
-    i5_revcomp_plateview_rowHa = [i5_well_IDs[i][0]+'\n'+i5_well_IDs[i][1]+'\n' for i in range(84,96)]
-    i5_revcomp_plateview_rowHb = [i5revcomp_Dict[k] for k in sorted(i5revcomp_Dict.keys())[84:96]]
-    i5_revcomp_plateview_rowH = [a + b for a, b in zip(i5_revcomp_plateview_rowHa, i5_revcomp_plateview_rowHb)]
-    i5_revcomp_plateview_rowH.insert(0,'H')
-
-    i5_revcomp_plateview.add_row(i5_revcomp_plateview_rowA)
-    i5_revcomp_plateview.add_row(i5_revcomp_plateview_rowB)
-    i5_revcomp_plateview.add_row(i5_revcomp_plateview_rowC)
-    i5_revcomp_plateview.add_row(i5_revcomp_plateview_rowD)
-    i5_revcomp_plateview.add_row(i5_revcomp_plateview_rowE)
-    i5_revcomp_plateview.add_row(i5_revcomp_plateview_rowF)
-    i5_revcomp_plateview.add_row(i5_revcomp_plateview_rowG)
-    i5_revcomp_plateview.add_row(i5_revcomp_plateview_rowH)
-    
-    print(i5_revcomp_plateview)
+    plateview('i5', 'revcomp')
 
-# Generate console table-views of i7 barcoded sequences
 def i7_plateview():
-    i7_plateview = PrettyTable()
-
-    plt_x = list(range(1,13))
-    plt_x.insert(0,' ')
-    i7_plateview.field_names = plt_x
-
-    i7_plateview_rowAa = [i7_well_IDs[i][0]+'\n'+i7_well_IDs[i][1]+'\n' for i in range(0,12)]
-    i7_plateview_rowAb = [i7Dict[k] for k in sorted(i7Dict.keys())[:12]]
-    i7_plateview_rowA = [a + b + '\n' for a, b in zip(i7_plateview_rowAa, i7_plateview_rowAb)]
-    i7_plateview_rowA.insert(0,'A')
-
-    i7_plateview_rowBa = [i7_well_IDs[i][0]+'\n'+i7_well_IDs[i][1]+'\n' for i in range(12,24)]
-    i7_plateview_rowBb = [i7Dict[k] for k in sorted(i7Dict.keys())[12:24]]
-    i7_plateview_rowB = [a + b + '\n' for a, b in zip(i7_plateview_rowBa, i7_plateview_rowBb)]
-    i7_plateview_rowB.insert(0,'B')
-
-    i7_plateview_rowCa = [i7_well_IDs[i][0]+'\n'+i7_well_IDs[i][1]+'\n' for i in range(24,36)]
-    i7_plateview_rowCb = [i7Dict[k] for k in sorted(i7Dict.keys())[24:36]]
-    i7_plateview_rowC = [a + b + '\n' for a, b in zip(i7_plateview_rowCa, i7_plateview_rowCb)]
-    i7_plateview_rowC.insert(0,'C')
-
-    i7_plateview_rowDa = [i7_well_IDs[i][0]+'\n'+i7_well_IDs[i][1]+'\n' for i in range(36,48)]
-    i7_plateview_rowDb = [i7Dict[k] for k in sorted(i7Dict.keys())[36:48]]
-    i7_plateview_rowD = [a + b + '\n' for a, b in zip(i7_plateview_rowDa, i7_plateview_rowDb)]
-    i7_plateview_rowD.insert(0,'D')
-
-    i7_plateview_rowEa = [i7_well_IDs[i][0]+'\n'+i7_well_IDs[i][1]+'\n' for i in range(48,60)]
-    i7_plateview_rowEb = [i7Dict[k] for k in sorted(i7Dict.keys())[48:60]]
-    i7_plateview_rowE = [a + b + '\n' for a, b in zip(i7_plateview_rowEa, i7_plateview_rowEb)]
-    i7_plateview_rowE.insert(0,'E')
-
-    i7_plateview_rowFa = [i7_well_IDs[i][0]+'\n'+i7_well_IDs[i][1]+'\n' for i in range(60,72)]
-    i7_plateview_rowFb = [i7Dict[k] for k in sorted(i7Dict.keys())[60:72]]
-    i7_plateview_rowF = [a + b + '\n' for a, b in zip(i7_plateview_rowFa, i7_plateview_rowFb)]
-    i7_plateview_rowF.insert(0,'F')
-
-    i7_plateview_rowGa = [i7_well_IDs[i][0]+'\n'+i7_well_IDs[i][1]+'\n' for i in range(72,84)]
-    i7_plateview_rowGb = [i7Dict[k] for k in sorted(i7Dict.keys())[72:84]]
-    i7_plateview_rowG = [a + b + '\n' for a, b in zip(i7_plateview_rowGa, i7_plateview_rowGb)]
-    i7_plateview_rowG.insert(0,'G')
-
-    i7_plateview_rowHa = [i7_well_IDs[i][0]+'\n'+i7_well_IDs[i][1]+'\n' for i in range(84,96)]
-    i7_plateview_rowHb = [i7Dict[k] for k in sorted(i7Dict.keys())[84:96]]
-    i7_plateview_rowH = [a + b for a, b in zip(i7_plateview_rowHa, i7_plateview_rowHb)]
-    i7_plateview_rowH.insert(0,'H')
-
-    i7_plateview.add_row(i7_plateview_rowA)
-    i7_plateview.add_row(i7_plateview_rowB)
-    i7_plateview.add_row(i7_plateview_rowC)
-    i7_plateview.add_row(i7_plateview_rowD)
-    i7_plateview.add_row(i7_plateview_rowE)
-    i7_plateview.add_row(i7_plateview_rowF)
-    i7_plateview.add_row(i7_plateview_rowG)
-    i7_plateview.add_row(i7_plateview_rowH)
-    
-    print(i7_plateview)
-    
+    plateview('i7', 'forward')
+
 def i7_revcomp_plateview():
-    i7_revcomp_plateview = PrettyTable()
-
-    plt_x = list(range(1,13))
-    plt_x.insert(0,' ')
-    i7_revcomp_plateview.field_names = plt_x
-
-    i7_revcomp_plateview_rowAa = [i7_well_IDs[i][0]+'\n'+i7_well_IDs[i][1]+'\n' for i in range(0,12)]
-    i7_revcomp_plateview_rowAb = [i7revcomp_Dict[k] for k in sorted(i7revcomp_Dict.keys())[:12]]
-    i7_revcomp_plateview_rowA = [a + b + '\n' for a, b in zip(i7_revcomp_plateview_rowAa, i7_revcomp_plateview_rowAb)]
-    i7_revcomp_plateview_rowA.insert(0,'A')
-
-    i7_revcomp_plateview_rowBa = [i7_well_IDs[i][0]+'\n'+i7_well_IDs[i][1]+'\n' for i in range(12,24)]
-    i7_revcomp_plateview_rowBb = [i7revcomp_Dict[k] for k in sorted(i7revcomp_Dict.keys())[12:24]]
-    i7_revcomp_plateview_rowB = [a + b + '\n' for a, b in zip(i7_revcomp_plateview_rowBa, i7_revcomp_plateview_rowBb)]
-    i7_revcomp_plateview_rowB.insert(0,'B')
-
-    i7_revcomp_plateview_rowCa = [i7_well_IDs[i][0]+'\n'+i7_well_IDs[i][1]+'\n' for i in range(24,36)]
-    i7_revcomp_plateview_rowCb = [i7revcomp_Dict[k] for k in sorted(i7revcomp_Dict.keys())[24:36]]
-    i7_revcomp_plateview_rowC = [a + b + '\n' for a, b in zip(i7_revcomp_plateview_rowCa, i7_revcomp_plateview_rowCb)]
-    i7_revcomp_plateview_rowC.insert(0,'C')
-
-    i7_revcomp_plateview_rowDa = [i7_well_IDs[i][0]+'\n'+i7_well_IDs[i][1]+'\n' for i in range(36,48)]
-    i7_revcomp_plateview_rowDb = [i7revcomp_Dict[k] for k in sorted(i7revcomp_Dict.keys())[36:48]]
-    i7_revcomp_plateview_rowD = [a + b + '\n' for a, b in zip(i7_revcomp_plateview_rowDa, i7_revcomp_plateview_rowDb)]
-    i7_revcomp_plateview_rowD.insert(0,'D')
-
-    i7_revcomp_plateview_rowEa = [i7_well_IDs[i][0]+'\n'+i7_well_IDs[i][1]+'\n' for i in range(48,60)]
-    i7_revcomp_plateview_rowEb = [i7revcomp_Dict[k] for k in sorted(i7revcomp_Dict.keys())[48:60]]
-    i7_revcomp_plateview_rowE = [a + b + '\n' for a, b in zip(i7_revcomp_plateview_rowEa, i7_revcomp_plateview_rowEb)]
-    i7_revcomp_plateview_rowE.insert(0,'E')
-
-    i7_revcomp_plateview_rowFa = [i7_well_IDs[i][0]+'\n'+i7_well_IDs[i][1]+'\n' for i in range(60,72)]
-    i7_revcomp_plateview_rowFb = [i7revcomp_Dict[k] for k in sorted(i7revcomp_Dict.keys())[60:72]]
-    i7_revcomp_plateview_rowF = [a + b + '\n' for a, b in zip(i7_revcomp_plateview_rowFa, i7_revcomp_plateview_rowFb)]
-    i7_revcomp_plateview_rowF.insert(0,'F')
-
-    i7_revcomp_plateview_rowGa = [i7_well_IDs[i][0]+'\n'+i7_well_IDs[i][1]+'\n' for i in range(72,84)]
-    i7_revcomp_plateview_rowGb = [i7revcomp_Dict[k] for k in sorted(i7revcomp_Dict.keys())[72:84]]
-    i7_revcomp_plateview_rowG = [a + b + '\n' for a, b in zip(i7_revcomp_plateview_rowGa, i7_revcomp_plateview_rowGb)]
-    i7_revcomp_plateview_rowG.insert(0,'G')
-
-    i7_revcomp_plateview_rowHa = [i7_well_IDs[i][0]+'\n'+i7_well_IDs[i][1]+'\n' for i in range(84,96)]
-    i7_revcomp_plateview_rowHb = [i7revcomp_Dict[k] for k in sorted(i7revcomp_Dict.keys())[84:96]]
-    i7_revcomp_plateview_rowH = [a + b for a, b in zip(i7_revcomp_plateview_rowHa, i7_revcomp_plateview_rowHb)]
-    i7_revcomp_plateview_rowH.insert(0,'H')
-
-    i7_revcomp_plateview.add_row(i7_revcomp_plateview_rowA)
-    i7_revcomp_plateview.add_row(i7_revcomp_plateview_rowB)
-    i7_revcomp_plateview.add_row(i7_revcomp_plateview_rowC)
-    i7_revcomp_plateview.add_row(i7_revcomp_plateview_rowD)
-    i7_revcomp_plateview.add_row(i7_revcomp_plateview_rowE)
-    i7_revcomp_plateview.add_row(i7_revcomp_plateview_rowF)
-    i7_revcomp_plateview.add_row(i7_revcomp_plateview_rowG)
-    i7_revcomp_plateview.add_row(i7_revcomp_plateview_rowH)
-    
-    print(i7_revcomp_plateview)
+    plateview('i7', 'revcomp')
+
+# Run metrics:
+# Stages of Sample Sheet generation ('parse', 'expand', 'validate', 'render', 'write') are timed as spans on the
+# monotonic high-resolution clock (time.perf_counter_ns()), and counters record what was done (plates, samples, rows and
+# bytes written, index collisions found, ...).  Functions with a metrics argument record into it when one is given.
+# Metrics can be written to a file as JSON, or in the Prometheus text format (e.g. for a node_exporter textfile
+# collector), for monitoring batch jobs.
+metrics_stages = ('parse', 'expand', 'validate', 'render', 'write')
+
+class Metrics:
+    def __init__(self):
+        self.stages = {}
+        self.counters = {}
+
+    # Time the enclosed code as a span of a stage
+    @contextlib.contextmanager
+    def span(self, stage):
+        start = time.perf_counter_ns()
+        try:
+            yield
+        finally:
+            nanoseconds, calls = self.stages.get(stage, (0, 0))
+            self.stages[stage] = (nanoseconds + time.perf_counter_ns() - start, calls + 1)
+
+    # Add to a counter
+    def count(self, counter, value=1):
+        self.counters[counter] = self.counters.get(counter, 0) + value
+
+    # Total time of a stage, in seconds
+    def seconds(self, stage):
+        return self.stages.get(stage, (0, 0))[0] / 1e9
+
+    # Add spans and counters recorded elsewhere (the as_dict() of another Metrics object, e.g. from a worker process)
+    def merge(self, values):
+        for stage, span in values['stages'].items():
+            nanoseconds, calls = self.stages.get(stage, (0, 0))
+            self.stages[stage] = (nanoseconds + round(span['seconds'] * 1e9), calls + span['calls'])
+        for counter, value in values['counters'].items():
+            self.count(counter, value)
+
+    def as_dict(self):
+        return {'stages': {stage: {'seconds': nanoseconds / 1e9, 'calls': calls} for stage, (nanoseconds, calls) in self.stages.items()},
+                'counters': dict(self.counters)}
+
+    # Prometheus text exposition format: stage times and calls labeled by stage, one metric per counter
+    def prometheus_text(self, prefix='samplesheet'):
+        lines = ['# HELP '+prefix+'_stage_seconds_total Time spent in Sample Sheet generation stages.',
+                 '# TYPE '+prefix+'_stage_seconds_total counter']
+        lines.extend(prefix+'_stage_seconds_total{stage="'+stage+'"} '+repr(nanoseconds / 1e9) for stage, (nanoseconds, calls) in self.stages.items())
+        lines.extend(('# HELP '+prefix+'_stage_calls_total Spans timed per Sample Sheet generation stage.',
+                      '# TYPE '+prefix+'_stage_calls_total counter'))
+        lines.extend(prefix+'_stage_calls_total{stage="'+stage+'"} '+str(calls) for stage, (nanoseconds, calls) in self.stages.items())
+        for counter, value in sorted(self.counters.items()):
+            lines.extend(('# TYPE '+prefix+'_'+counter+'_total counter', prefix+'_'+counter+'_total '+str(value)))
+        lines.extend(('# TYPE '+prefix+'_metrics_timestamp_seconds gauge', prefix+'_metrics_timestamp_seconds '+'%.3f' % time.time()))
+        return '\n'.join(lines)+'\n'
+
+    # Write a metrics file (atomically, so collectors never read a partial file): JSON for a '.json' file name,
+    # Prometheus text otherwise
+    def write(self, path):
+        with atomic_open(path) as f:
+            if str(path).endswith('.json'):
+                import json
+                json.dump(self.as_dict(), f, indent=1)
+                f.write('\n')
+            else:
+                f.write(self.prometheus_text())
+
+# Span of a stage, timed in metrics if given
+def metrics_span(metrics, stage):
+    return contextlib.nullcontext() if metrics is None else metrics.span(stage)
+
+# Stage times of metrics, in milliseconds ('parse 0.12 ms, expand 0.40 ms, ...')
+def format_stage_times(metrics):
+    stages = [i for i in metrics_stages if i in metrics.stages] + [i for i in metrics.stages if i not in metrics_stages]
+    return ', '.join(stage+' '+'%.2f' % (1000 * metrics.seconds(stage))+' ms' for stage in stages)
+
+# Duration in seconds as 'H hr|MM min|SS sec|UUUUUU microsec'
+def format_duration(seconds):
+    microseconds = round(seconds * 1e6)
+    minutes, microseconds = divmod(microseconds, 60000000)
+    hours, minutes = divmod(minutes, 60)
+    return str(hours)+' hr|'+'%02d' % minutes+' min|'+'%02d' % (microseconds // 1000000)+' sec|'+'%06d' % (microseconds % 1000000)+' microsec'
+
+# Profiling:
+# Sample Sheet generation can be profiled with cProfile ('cprofile': exact call counts and times, written as a pstats
+# file for pstats or snakeviz) or with a sampling profiler ('sampling': the call stack of the profiled thread is recorded
+# every interval seconds, with little overhead, and written as collapsed stacks, one 'outer;...;inner samples' line per
+# stack, for flamegraph.pl or speedscope).  The profile is written next to the Sample Sheet, and the hottest functions
+# are summarized.  Work done in worker processes (lane Sample Sheets) is not profiled.
+profile_kinds = ('cprofile', 'sampling')
+profile_suffixes = {'cprofile': '.pstats', 'sampling': '.collapsed'}
+
+class Profiler:
+    def __init__(self, kind='cprofile', interval=0.001):
+        if kind not in profile_kinds:
+            raise ValueError('profiler should be one of '+', '.join(profile_kinds)+", got '"+str(kind)+"'")
+        self.kind = kind
+        self.interval = interval
+        self.profile = None
+        self.stacks = {}
+
+    # Profile the enclosed code (a profiler may be entered several times; its profiles add up)
+    def __enter__(self):
+        if self.kind == 'cprofile':
+            import cProfile
+            self.profile = self.profile or cProfile.Profile()
+            self.profile.enable()
+        else:
+            import threading
+            self.stopped = threading.Event()
+            self.switch_interval = sys.getswitchinterval()
+            # the sampler thread must get the interpreter lock at each interval
+            sys.setswitchinterval(min(self.switch_interval, self.interval / 2))
+            self.sampler = threading.Thread(target=self.sample, args=(threading.get_ident(),), daemon=True)
+            self.sampler.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.kind == 'cprofile':
+            self.profile.disable()
+        else:
+            self.stopped.set()
+            self.sampler.join()
+            sys.setswitchinterval(self.switch_interval)
+
+    # Sampler thread: count the call stacks of a thread every interval until stopped
+    def sample(self, thread_id):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(thread_id)
+            names = []
+            while frame is not None:
+                names.append(function_label(frame.f_code.co_filename, frame.f_code.co_firstlineno, frame.f_code.co_name))
+                frame = frame.f_back
+            stack = ';'.join(reversed(names))
+            self.stacks[stack] = self.stacks.get(stack, 0) + 1
+
+    # Write the profile next to a Sample Sheet file ('SampleSheet.csv' -> 'SampleSheet.pstats' or
+    # 'SampleSheet.collapsed'); returns the profile path
+    def dump(self, filepath):
+        from pathlib import Path
+        profile_path = Path(filepath).with_suffix(profile_suffixes[self.kind])
+        if self.kind == 'cprofile':
+            self.profile.dump_stats(profile_path)
+        else:
+            with open(profile_path, 'w') as f:
+                f.writelines(stack+' '+str(samples)+'\n' for stack, samples in sorted(self.stacks.items()))
+        return profile_path
+
+    # Text summary of the top hottest functions: by own time (cprofile) or by samples in the function itself (sampling)
+    def summary(self, top=15):
+        if self.kind == 'cprofile':
+            import pstats
+            stats = pstats.Stats(self.profile).stats if self.profile else {}
+            lines = ['   own s    cum s     calls  function']
+            for (filename, line, name), (primitive_calls, calls, own, cumulative, callers) in sorted(stats.items(), key=lambda i: i[1][2], reverse=True)[:top]:
+                lines.append('%8.4f %8.4f %9d  %s' % (own, cumulative, calls, function_label(filename, line, name)))
+            return '\n'.join(lines)
+        own = {}
+        for stack, samples in self.stacks.items():
+            function = stack.rpartition(';')[2]
+            own[function] = own.get(function, 0) + samples
+        total = sum(own.values())
+        lines = [str(total)+' samples every '+'%g' % (1000 * self.interval)+' ms', ' samples      %  function']
+        for function, samples in sorted(own.items(), key=lambda i: i[1], reverse=True)[:top]:
+            lines.append('%8d %5.1f%%  %s' % (samples, 100 * samples / total, function))
+        return '\n'.join(lines)
+
+# Function name with its file and first line ('data_rows (SampleSheet.py:612)'; built-in functions by name alone)
+def function_label(filename, line, name):
+    if filename == '~':
+        return name
+    return name+' ('+os.path.basename(filename)+':'+str(line)+')'
+
+# Profile the enclosed code with profiler, if given
+def profiling(profiler):
+    return contextlib.nullcontext() if profiler is None else profiler
+
+# Sample Sheet construction (shared by interactive and batch operation):
+# Parse [Header] details ('InvestigatorName, ProjectName'); skipped entries are recorded as 'NA'
+def parse_header(header):
+    fields = [i.strip() for i in header.split(',', 1)]
+    InvestigatorName = fields[0] if fields[0] else 'NA'
+    ProjectName = fields[1] if len(fields) > 1 and fields[1] else 'NA'
+    return InvestigatorName, ProjectName
+
+# Parse [Reads] details ('SE, #' or 'PE, #, #'); returns readstype ('SE' or 'PE') and [Reads] section text
+def parse_reads(reads):
+    readslist = [i.strip() for i in reads.split(',')]
+    if readslist[0] == 'SE' and len(readslist) == 2:
+        return 'SE', readslist[1]
+    elif readslist[0] == 'PE' and len(readslist) == 3:
+        return 'PE', readslist[1]+'\n'+readslist[2]
+    raise ValueError("[Reads] entry should be 'SE, #' or 'PE, #, #', got '"+reads.strip()+"'")
+
+# Plate lines:
+# A plate line is 'plate name, i7 wells' (SE) or 'plate name, i7 wells, i5 wells' (PE).  Wells are given as well numbers
+# counted in the plate's well order ('5', '1-96'), as well labels ('A05') or as blocks of wells between two corner labels
+# ('A01-D06': rows A-D of columns 1-6, listed in the plate's well order, i.e. down columns with 'well_order: column'), and
+# several ranges may be combined ('1-12,25-36'; the i5 field follows the last comma of the line, so its ranges are
+# separated by semicolons: '1-4;9-12').  Each distinct well field is compiled into well numbers once per plate format,
+# and every error of an input list is reported with its line and column before anything is expanded or written.
+well_separators = str.maketrans(';', ',')
+
+# Well numbers of a plate format by well number text and well label ('1' and 'A01' -> 1; labels also unpadded, 'A1')
+@functools.lru_cache(maxsize=None)
+def well_tokens(plate):
+    tokens = {str(n): n for n in range(1, plate.wells + 1)}
+    for label, n in plate.numbers.items():
+        row = label.rstrip('0123456789')
+        tokens[label] = tokens[row + str(int(label[len(row):]))] = n
+    return tokens
+
+# Index names of a kit for the well numbers of a plate format (index_names[n] is the index name of well n)
+@functools.lru_cache(maxsize=None)
+def plate_index_names(plate, kit):
+    return (None,) + tuple(kit + label for label in plate.labels)
+
+# Well number of one well number or well label of a well field; raises ValueError for other text
+def well_token(plate, token):
+    tokens = well_tokens(plate)
+    number = tokens.get(token) or tokens.get(token.upper())
+    if number is None:
+        if token.isdigit():
+            plate.label(int(token))
+        elif token[:1].isalpha() and token[-1:].isdigit():
+            return plate.number(token)
+        raise ValueError("'"+token+"' is not a well number or well label")
+    return number
+
+# Compile a well field ('1-12,25-36', 'A01-D06', ...) for a plate format: (well numbers, in the order listed; errors, as
+# (offset in the field, message))
+@functools.lru_cache(maxsize=4096)
+def compile_wells(plate, field):
+    numbers = []
+    seen = set()
+    errors = []
+    offset = 0
+    for item in field.translate(well_separators).split(','):
+        position = offset + len(item) - len(item.lstrip())
+        offset = offset + len(item) + 1
+        item = item.strip()
+        first, dash, last = (i.strip() for i in item.partition('-'))
+        if not first or (dash and not last):
+            errors.append((position + (item.index('-') + 1 if first else 0), 'missing well number or label'))
+            continue
+        try:
+            start = well_token(plate, first)
+        except ValueError as e:
+            errors.append((position, str(e)))
+            continue
+        try:
+            end = well_token(plate, last) if dash else start
+        except ValueError as e:
+            rest = item.partition('-')[2]
+            errors.append((position + item.index('-') + 1 + len(rest) - len(rest.lstrip()), str(e)))
+            continue
+        last = last or first
+        if first[0].isdigit() != last[0].isdigit():
+            errors.append((position, "well range '"+item+"' mixes a well number and a well label"))
+            continue
+        if first[0].isdigit():
+            wells = range(start, end + 1)
+            reversed_range = end < start
+        else:
+            (start_row, start_column), (end_row, end_column) = plate.position(start), plate.position(end)
+            wells = sorted(plate.numbers[row + '%02d' % column] for row in plate.row_labels[start_row:end_row + 1]
+                           for column in range(start_column, end_column + 1))
+            reversed_range = end_row < start_row or end_column < start_column
+        if reversed_range:
+            errors.append((position, "well range '"+item+"' is reversed"))
+        elif not seen.isdisjoint(wells):
+            errors.append((position, 'well '+plate.label(next(n for n in wells if n in seen))+' is listed more than once'))
+        seen.update(wells)
+        numbers.extend(wells)
+    return tuple(numbers), tuple(errors)
+
+# Parse plate lines in one pass: ([(plate name, i7 well numbers, i5 well numbers or None for SE)], [(line number, column,
+# message)] for every error); lines are numbered from 1 in input_list order, or by line_numbers (e.g. manifest lines)
+def parse_plate_lines(input_list, readstype, plate=None, line_numbers=None):
+    plate = plate or default_plate
+    fields = 'plate name, i7 wells, i5 wells' if readstype == 'PE' else 'plate name, i7 wells'
+    plates = []
+    errors = []
+    for n, line in enumerate(input_list):
+        line_number = line_numbers[n] if line_numbers else n + 1
+        first = line.find(',')
+        last = line.rfind(',') if readstype == 'PE' else len(line)
+        if first < 0 or last <= first:
+            errors.append((line_number, len(line.rstrip()) + 1, "expected '"+fields+"'"))
+            continue
+        name = line[:first].strip()
+        if not name:
+            errors.append((line_number, 1, 'missing plate name'))
+        i7_wells, i7_errors = compile_wells(plate, line[first + 1:last])
+        errors.extend((line_number, first + 2 + offset, 'i7 wells: '+message) for offset, message in i7_errors)
+        i5_wells = None
+        if readstype == 'PE':
+            i5_wells, i5_errors = compile_wells(plate, line[last + 1:])
+            errors.extend((line_number, last + 2 + offset, 'i5 wells: '+message) for offset, message in i5_errors)
+        plates.append((name, i7_wells, i5_wells))
+    return plates, errors
+
+# Text of plate line errors ('line 3, column 9: ...'), at most max_errors of them
+def format_plate_line_errors(errors, max_errors=100):
+    lines = ['line '+str(line_number)+', column '+str(column)+': '+message for line_number, column, message in errors[:max_errors]]
+    if len(errors) > max_errors:
+        lines.append('... and '+str(len(errors) - max_errors)+' more')
+    return '\n'.join(lines)
+
+# Expand [Data] input list (plate lines, see above) into a list of [plate name, i7 index names, i5 index names] per
+# plate, with index numbers counted in plate's well order; raises ValueError listing every error of the input list.  An
+# i5 index range (e.g. 'DG-1, 1-96, 1-96') combines every i7 index of the line with each i5 index of the range (see
+# data_rows()).  Parsing and expansion are timed in metrics, if given.
+def expand_input_list(input_list, readstype, plate=None, line_numbers=None, metrics=None):
+    plate = plate or default_plate
+    with metrics_span(metrics, 'parse'):
+        plates, errors = parse_plate_lines(input_list, readstype, plate, line_numbers)
+    if errors:
+        raise ValueError(('' if len(errors) == 1 else str(len(errors))+' errors in plate lines:\n')+format_plate_line_errors(errors))
+    with metrics_span(metrics, 'expand'):
+        i7_names = plate_index_names(plate, 'i7')
+        if readstype == 'SE':
+            return [[name, [i7_names[n] for n in i7_wells]] for name, i7_wells, i5_wells in plates]
+        i5_names = plate_index_names(plate, 'i5')
+        return [[name, [i7_names[n] for n in i7_wells], [i5_names[n] for n in i5_wells]] for name, i7_wells, i5_wells in plates]
+
+# Check that the sequencing run format (SE/PE) is compatible with the Illumina Indexed Sequencing Workflow (A/B)
+def check_workflow(workflow, readstype):
+    if workflow not in ('A', 'B'):
+        raise ValueError("workflow should be 'A' or 'B', got '"+workflow+"'")
+    if readstype == 'SE' and workflow == 'B':
+        raise ValueError("Workflow 'B' and 'SE' sequencing specifications are not compatible")
+
+# [Data] column names per sequencing run format (SE/PE)
+data_columns = {
+    'PE': ('Sample_ID', 'Sample_Name', 'I7_Index_ID', 'index', 'I5_Index_ID', 'index2'),
+    'SE': ('Sample_ID', 'Sample_Name', 'I7_Index_ID', 'index'),
+}
 
-# Welcome/orient to script:
-print("""
+# [Header], [Reads] and [Settings] sections, ending with the [Data] column names line (optionally led by a Lane column)
+def sample_sheet_header(InvestigatorName, ProjectName, readstype, readsvalue, lane_column=False):
+    columns = ','.join(data_columns[readstype])
+    if lane_column:
+        columns = 'Lane,' + columns
+    return ("""[Header]
+IEMFileVersion,4\n""" +
+"InvestigatorName," + InvestigatorName +
+"\nProjectName," + ProjectName +
+"\nDate," + (time.strftime("%m/%d/%Y")) + 
+"""\nWorkflow,GenerateFASTQ
+Application,FASTQ Only
+Assay,Nextera
+Description,Sequencing
+Chemistry,Amplicon
+
+[Reads]\n""" +
+readsvalue +
+"""\n\n[Settings]
+ReverseComplement,0
+Adapter,CTGTCTCTTATACACATCT
+
+[Data]\n""" +
+columns + "\n")
+
+# [Data] rows for expanded plates, generated one sample at a time as lists of column values
+# (index sequences oriented per Workflow: i7 reverse complement; i5 as in primer for 'A', reverse complement for 'B').
+# A plate with one i5 index names its samples '<plate name>-<i7 well>'; a plate with an i5 index range is expanded
+# combinatorially (every i7 index with each i5 index, i5 by i5) and names its samples '<plate name>-<i7 well>-<i5 well>'.
+# Sample_IDs are numbered from first_sample_id.
+def data_rows(expanded, workflow, readstype, first_sample_id=1, barcode_kit=None):
+    i7_sequences, i5_sequences = workflow_barcodes(workflow, barcode_kit)
+    count = first_sample_id - 1
+    try:
+        for plate in expanded:
+            i7_columns = [(plate[0] + '-' + i7_ID[2:], i7_ID, i7_sequences[i7_ID]) for i7_ID in plate[1]]
+            if readstype == 'SE':
+                for sample_name, i7_ID, i7_sequence in i7_columns:
+                    count = count + 1
+                    yield [str(count), sample_name, i7_ID, i7_sequence]
+                continue
+            for i5_ID in plate[2]:
+                i5_sequence = i5_sequences[i5_ID]
+                i5_suffix = '-' + i5_ID[2:] if len(plate[2]) > 1 else ''
+                for sample_name, i7_ID, i7_sequence in i7_columns:
+                    count = count + 1
+                    yield [str(count), sample_name + i5_suffix, i7_ID, i7_sequence, i5_ID, i5_sequence]
+    except KeyError as e:
+        raise ValueError('index '+str(e)+' is not in the barcode tables')
+
+# Compact sample records:
+# The samples of expanded plates, held as parallel arrays of plate number (into the list of plate names), i7 well
+# number and i5 well number (0 for SE runs): 6 bytes per sample, against a list of Sample_Name, index name and
+# sequence strings per [Data] row.  Well numbers are taken on a 1536-well plate, whose well labels include those of 96-
+# and 384-well plates; Sample_Names and sequences are looked up by well number only when samples are read.  Index checks
+# and lane sharding read index pairs from one SampleRecords per set of plates; [Data] rows are written by data_rows().
+class SampleRecords:
+    __slots__ = ('plate_names', 'named_by_i5', 'plates', 'i7_wells', 'i5_wells')
+    grid = None
+
+    def __init__(self, expanded):
+        import array
+        if SampleRecords.grid is None:
+            SampleRecords.grid = plate_format(1536, 'row')
+        self.plate_names = [plate[0] for plate in expanded]
+        # plates with an i5 index range name their samples '<plate name>-<i7 well>-<i5 well>' (see data_rows())
+        self.named_by_i5 = [len(plate) > 2 and len(plate[2]) > 1 for plate in expanded]
+        self.plates = array.array('H' if len(expanded) < 1 << 16 else 'I')
+        self.i7_wells = array.array('H')
+        self.i5_wells = array.array('H')
+        for plate_id, plate in enumerate(expanded):
+            i7_wells = array.array('H', map(self.grid.index_number, plate[1]))
+            for i5_well in map(self.grid.index_number, plate[2]) if len(plate) > 2 else (0,):
+                self.plates.extend(itertools.repeat(plate_id, len(i7_wells)))
+                self.i7_wells.extend(i7_wells)
+                self.i5_wells.extend(itertools.repeat(i5_well, len(i7_wells)))
+
+    def __len__(self):
+        return len(self.plates)
+
+    # Sample_Name of the sample at position n
+    def sample_name(self, n):
+        labels = self.grid.labels
+        name = self.plate_names[self.plates[n]] + '-' + labels[self.i7_wells[n] - 1]
+        if self.named_by_i5[self.plates[n]]:
+            name = name + '-' + labels[self.i5_wells[n] - 1]
+        return name
+
+    # Index sequences of a kit by well number, oriented per Workflow (None for wells beyond the barcode table)
+    def well_sequences(self, kit, workflow, barcode_kit=None):
+        orientation = workflow_orientations[workflow][0 if kit == 'i7' else 1]
+        return load_barcode_kit(barcode_kit).well_sequences(kit, orientation)
+
+    # (i7 sequence, i5 sequence, '' for SE) of each sample, oriented per Workflow
+    def index_pairs(self, workflow, readstype, barcode_kit=None):
+        i7_sequences = self.well_sequences('i7', workflow, barcode_kit)
+        i5_sequences = self.well_sequences('i5', workflow, barcode_kit) if readstype == 'PE' else ('',)
+        for i7_well, i5_well in zip(self.i7_wells, self.i5_wells):
+            index_pair = (i7_sequences[i7_well], i5_sequences[i5_well])
+            if None in index_pair:
+                kit, well = ('i7', i7_well) if index_pair[0] is None else ('i5', i5_well)
+                raise ValueError("index '"+kit+self.grid.labels[well - 1]+"' is not in the barcode tables")
+            yield index_pair
+
+# Sample Sheet output formats:
+# Each format has a 'header' function, returning the text that precedes the data rows, and a 'lines' function, returning
+# the text of a block of data rows (lists of column values from data_rows()); writers produce the data rows once and pass
+# each block to every requested format.
+#   'v1': Illumina Experiment Manager (IEM) v4 Sample Sheet ([Header], [Reads], [Settings], [Data])
+#   'v2': BCL Convert Sample Sheet v2 ([Header], [Reads], [BCLConvert_Settings], [BCLConvert_Data]); Sample_Name is
+#         used as Sample_ID (BCL Convert names FASTQ files by Sample_ID), with characters other than letters, digits,
+#         '-' and '_' replaced by '-' (plate names that would then give the same Sample_IDs are an error), and OverrideCycles is derived from the [Reads]
+#         cycles and index length.  Index2 is always written in forward-strand orientation (as in primer, i.e. as for
+#         Workflow 'A'): BCL Convert reverse complements it itself for reverse-strand (Workflow 'B') instruments, as
+#         given by the run's RunInfo.xml, so a Workflow 'B' i5 would otherwise be reverse complemented twice.
+# Header functions take (InvestigatorName, ProjectName, readstype, readsvalue, index_lengths, lane_column), where
+# index_lengths is (i7 index length, i5 index length or None); lines functions take (rows, lane), where lane is the
+# Lane column value or None.  A format with an 'i5_orientation' is given rows with i5 sequences in that orientation,
+# whatever the Workflow, and a format with a 'sample_name' function is given rows with Sample_Names passed through it.
+
+def iem_v4_header(InvestigatorName, ProjectName, readstype, readsvalue, index_lengths, lane_column):
+    return sample_sheet_header(InvestigatorName, ProjectName, readstype, readsvalue, lane_column)
+
+def iem_v4_lines(rows, lane):
+    if lane is None:
+        return '\n'.join([','.join(row) for row in rows]) + '\n'
+    return '\n'.join([lane + ',' + ','.join(row) for row in rows]) + '\n'
+
+# BCL Convert RunName values: letters, digits, '-', '_' and '.' only (other characters are replaced by '-')
+def bclconvert_name(text, allowed='-_.'):
+    return ''.join(i if i.isascii() and i.isalnum() or i in allowed else '-' for i in text.strip())
+
+# BCL Convert Sample_ID values: letters, digits, '-' and '_' only
+def bclconvert_sample_id(text):
+    return bclconvert_name(text, '-_')
+
+def bclconvert_v2_header(InvestigatorName, ProjectName, readstype, readsvalue, index_lengths, lane_column):
+    read_cycles = readsvalue.split('\n')
+    if readstype == 'PE':
+        reads = ['Read1Cycles,' + read_cycles[0], 'Read2Cycles,' + read_cycles[1],
+                 'Index1Cycles,' + str(index_lengths[0]), 'Index2Cycles,' + str(index_lengths[1])]
+        override_cycles = 'Y' + read_cycles[0] + ';I' + str(index_lengths[0]) + ';I' + str(index_lengths[1]) + ';Y' + read_cycles[1]
+        adapters = ['AdapterRead1,CTGTCTCTTATACACATCT', 'AdapterRead2,CTGTCTCTTATACACATCT']
+        columns = 'Sample_ID,Index,Index2'
+    elif readstype == 'SE':
+        reads = ['Read1Cycles,' + read_cycles[0], 'Index1Cycles,' + str(index_lengths[0])]
+        override_cycles = 'Y' + read_cycles[0] + ';I' + str(index_lengths[0])
+        adapters = ['AdapterRead1,CTGTCTCTTATACACATCT']
+        columns = 'Sample_ID,Index'
+    if lane_column:
+        columns = 'Lane,' + columns
+    header = ['[Header]', 'FileFormatVersion,2']
+    if ProjectName != 'NA':
+        header.append('RunName,' + bclconvert_name(ProjectName))
+    return '\n'.join(header + [''] + ['[Reads]'] + reads + [''] + ['[BCLConvert_Settings]'] + adapters +
+                     ['OverrideCycles,' + override_cycles, ''] + ['[BCLConvert_Data]', columns]) + '\n'
+
+def bclconvert_v2_lines(rows, lane):
+    prefix = '' if lane is None else lane + ','
+    if len(rows[0]) > 4:
+        return '\n'.join([prefix + row[1] + ',' + row[3] + ',' + row[5] for row in rows]) + '\n'
+    return '\n'.join([prefix + row[1] + ',' + row[3] for row in rows]) + '\n'
+
+sample_sheet_formats = {
+'v1': {'header': iem_v4_header, 'lines': iem_v4_lines},
+'v2': {'header': bclconvert_v2_header, 'lines': bclconvert_v2_lines, 'i5_orientation': 'forward', 'sample_name': bclconvert_sample_id}
+}
+
+# Lines function of a Sample Sheet format, given rows with i5 sequences reverse complemented (each distinct i5 sequence
+# is reverse complemented once)
+def reoriented_i5_lines(lines):
+    reoriented = {}
+
+    def reoriented_lines(rows, lane):
+        for sequence in {row[5] for row in rows}.difference(reoriented):
+            reoriented[sequence] = reverse_complement(sequence)
+        return lines([row[:5] + [reoriented[row[5]]] for row in rows], lane)
+    return reoriented_lines
+
+# Lines function of a Sample Sheet format, given rows with Sample_Names renamed by a format's sample_name function
+def renamed_sample_lines(lines, sample_name):
+    def renamed_lines(rows, lane):
+        return lines([row[:1] + [sample_name(row[1])] + row[2:] for row in rows], lane)
+    return renamed_lines
+
+# Check that plate names (and so the Sample_Names of their samples, '<plate name>-<well>...') stay distinct when renamed
+# by a format's sample_name function; returns whether any name changes
+def check_renamed_plates(lane_plates, sample_name):
+    renamed = {}
+    for plates in lane_plates:
+        for plate in plates:
+            name = sample_name(plate[0])
+            if renamed.setdefault(name, plate[0]) != plate[0]:
+                raise ValueError("plate names '"+renamed[name]+"' and '"+plate[0]+"' both give Sample_IDs '"+name+"-...' in a BCL "
+                                 "Convert (v2) Sample Sheet, which allows only letters, digits, '-' and '_' (rename a plate)")
+    return any(name != plate_name for name, plate_name in renamed.items())
+
+# Index lengths (i7, i5 or None for SE) of the samples of expanded plates; BCL Convert needs a single length per index
+def index_lengths(lane_plates, workflow, readstype, barcode_kit=None):
+    i7_sequences, i5_sequences = workflow_barcodes(workflow, barcode_kit)
+    i7_lengths = set()
+    i5_lengths = set()
+    try:
+        for plates in lane_plates:
+            for plate in plates:
+                i7_lengths.update(len(i7_sequences[i]) for i in plate[1])
+                if readstype == 'PE':
+                    i5_lengths.update(len(i5_sequences[i]) for i in plate[2])
+    except KeyError as e:
+        raise ValueError('index '+str(e)+' is not in the barcode tables')
+    if len(i7_lengths) > 1 or len(i5_lengths) > 1:
+        raise ValueError('indices of different lengths (i7: '+', '.join(str(i) for i in sorted(i7_lengths))+
+                         '; i5: '+', '.join(str(i) for i in sorted(i5_lengths))+') cannot share one Sample Sheet')
+    return (min(i7_lengths, default=0), min(i5_lengths) if i5_lengths else None)
+
+# Write complete Sample Sheets in one or more formats from a single pass over the data rows.  outputs is a list of
+# (format name, open text stream); lane_plates is a list of expanded plate lists, one per lane (a single list when
+# lane_column is False).  Sample_IDs continue across lanes.  Returns the number of data rows written to each stream.
+# Rendering (of blocks of rows to text) and writing are timed in metrics, if given, which counts rows written.  Index
+# sequences are taken from barcode_kit (by name; None for the default kit).
+def write_sample_sheets(outputs, workflow, InvestigatorName, ProjectName, readstype, readsvalue, lane_plates, lane_column=False, block_size=4096, metrics=None, barcode_kit=None):
+    for name, f in outputs:
+        if name not in sample_sheet_formats:
+            raise ValueError("Sample Sheet format should be one of "+', '.join(sample_sheet_formats)+", got '"+str(name)+"'")
+    formats = []
+    for name, f in outputs:
+        sheet_format = sample_sheet_formats[name]
+        if readstype == 'PE' and sheet_format.get('i5_orientation', workflow_orientations[workflow][1]) != workflow_orientations[workflow][1]:
+            sheet_format = dict(sheet_format, lines=reoriented_i5_lines(sheet_format['lines']))
+        if 'sample_name' in sheet_format and check_renamed_plates(lane_plates, sheet_format['sample_name']):
+            sheet_format = dict(sheet_format, lines=renamed_sample_lines(sheet_format['lines'], sheet_format['sample_name']))
+        formats.append((sheet_format, f))
+    lengths = index_lengths(lane_plates, workflow, readstype, barcode_kit) if any(name != 'v1' for name, f in outputs) else None
+    with metrics_span(metrics, 'write'):
+        for sheet_format, f in formats:
+            f.write(sheet_format['header'](InvestigatorName, ProjectName, readstype, readsvalue, lengths, lane_column))
+    rows_written = 0
+    for lane, plates in enumerate(lane_plates, start=1):
+        lane_label = str(lane) if lane_column else None
+        rows = data_rows(plates, workflow, readstype, rows_written + 1, barcode_kit)
+        while True:
+            with metrics_span(metrics, 'render'):
+                block = list(itertools.islice(rows, block_size))
+                texts = [sheet_format['lines'](block, lane_label) for sheet_format, f in formats] if block else []
+            if not block:
+                break
+            with metrics_span(metrics, 'write'):
+                for (sheet_format, f), text in zip(formats, texts):
+                    f.write(text)
+            rows_written = rows_written + len(block)
+    if metrics is not None:
+        metrics.count('rows_written', rows_written * len(formats))
+    return rows_written
+
+# Write a complete Sample Sheet ([Header], [Reads], [Settings], [Data]) to an open text stream (file, sys.stdout, io.StringIO);
+# returns the number of [Data] rows written
+def write_sample_sheet(f, workflow, InvestigatorName, ProjectName, readstype, readsvalue, expanded, sheet_format='v1', metrics=None, barcode_kit=None):
+    return write_sample_sheets([(sheet_format, f)], workflow, InvestigatorName, ProjectName, readstype, readsvalue, [expanded], metrics=metrics, barcode_kit=barcode_kit)
+
+# Open a Sample Sheet file for writing once, with a large write buffer; filename '-' writes to standard output.
+# A file opened with mode 'w' is written atomically (see atomic_open()), unless it is a device or pipe.
+write_buffer_size = 1 << 16
+
+def open_sample_sheet(filename, mode='w'):
+    if str(filename) == '-':
+        return contextlib.nullcontext(sys.stdout)
+    if mode == 'w' and (os.path.isfile(filename) or not os.path.exists(filename)):
+        return atomic_open(filename)
+    return open(filename, mode, buffering=write_buffer_size)
+
+# Open a text file for writing atomically: text goes to a temporary file in the same directory, which replaces filename
+# once it is complete and closed, so readers (and watchers of the directory) see either the previous file or the
+# complete new one.  A write that fails leaves the previous file in place.
+@contextlib.contextmanager
+def atomic_open(filename, buffering=write_buffer_size):
+    directory, name = os.path.split(os.fspath(filename))
+    temp_path = os.path.join(directory, '.' + name + '.' + str(os.getpid()) + '.tmp')
+    try:
+        with open(temp_path, 'w', buffering=buffering) as f:
+            yield f
+        os.replace(temp_path, filename)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.remove(temp_path)
+        raise
+
+# Build a Sample Sheet from the same entries the interactive prompts collect (workflow, header, reads, input_list);
+# returns the Sample Sheet text
+def build_sample_sheet(workflow, header, reads, input_list):
+    InvestigatorName, ProjectName = parse_header(header)
+    readstype, readsvalue = parse_reads(reads)
+    check_workflow(workflow, readstype)
+    expanded = expand_input_list(input_list, readstype)
+    f = io.StringIO()
+    write_sample_sheet(f, workflow, InvestigatorName, ProjectName, readstype, readsvalue, expanded)
+    return f.getvalue()
+
+# Index collision checks:
+# Index sequences are compared as 2-bit packed integers (A=0, C=1, G=2, T=3); the Hamming distance between two packed
+# sequences is the number of 2-bit groups that differ in their XOR.  Sequences of one length are compared in batches:
+# all of them are packed side by side into one integer, so a single XOR compares one sequence with every other, and
+# the differing groups are counted per byte (bytes.translate) and summed per sequence by one multiplication.  Index
+# pairs (i7 + i5) are compared by the sum of their i7 and i5 distances, using distance tables of the distinct i7 and
+# i5 sequences rather than comparing every pair of samples.
+near_collision_distance = 2
+popcount_table = bytes(bin(i).count('1') for i in range(256))
+
+base_digits_table = str.maketrans('ACGT', '0123')
+
+# 2-bit packed integer encoding of a DNA sequence (A, C, G, T only)
+def pack_sequence(sequence):
+    try:
+        return int(sequence.translate(base_digits_table), 4)
+    except ValueError:
+        raise ValueError("index sequence '"+sequence+"' should contain only A, C, G, T")
+
+# Hamming distance table (list of lists) between all DNA sequences in a tuple; sequences of different lengths
+# are compared over their common leading bases.  Tables are cached per tuple of sequences (plates drawn from the same
+# barcode kits share their tables across checks, e.g. in the Sample Sheet service); callers must not modify them.
+@functools.lru_cache(maxsize=64)
+def hamming_matrix(sequences):
+    packed = [pack_sequence(i) for i in sequences]
+    if len({len(i) for i in sequences}) == 1:
+        return packed_hamming_rows(packed, len(sequences[0]))
+    lengths = [len(i) for i in sequences]
+    masks = {length: int('01' * length or '0', 2) for length in lengths}
+    matrix = [[0] * len(sequences) for i in sequences]
+    for a in range(len(sequences)):
+        for b in range(a + 1, len(sequences)):
+            length = min(lengths[a], lengths[b])
+            x = (packed[a] >> 2 * (lengths[a] - length)) ^ (packed[b] >> 2 * (lengths[b] - length))
+            distance = bin((x | (x >> 1)) & masks[length]).count('1')
+            matrix[a][b] = matrix[b][a] = distance
+    return matrix
+
+# Hamming distance table of packed sequences of one length, one row per sequence.  Each sequence takes a field of
+# 2 * field_bytes bytes in one integer (its packed bases in the lower half); a row is the XOR of every field with one
+# sequence, reduced to one bit per differing base, counted per byte, and summed over the lower half of each field by
+# multiplying with 0x0101...01 (byte sums stay below 256, so no byte carries into the next).
+def packed_hamming_rows(packed, length):
+    field_bytes = max(1, (2 * length + 7) // 8)
+    size = 2 * field_bytes * len(packed)
+    fields = int.from_bytes(b''.join(i.to_bytes(2 * field_bytes, 'little') for i in packed), 'little')
+    ones = int.from_bytes((b'\x01' + bytes(2 * field_bytes - 1)) * len(packed), 'little')
+    low_bits = int.from_bytes((b'\x55' * field_bytes + bytes(field_bytes)) * len(packed), 'little')
+    byte_sums = int.from_bytes(b'\x01' * field_bytes, 'little')
+    matrix = []
+    for sequence in packed:
+        x = (sequence * ones) ^ fields
+        counts = ((x | (x >> 1)) & low_bits).to_bytes(size, 'little').translate(popcount_table)
+        sums = (int.from_bytes(counts, 'little') * byte_sums).to_bytes(size, 'little')
+        matrix.append(list(sums[field_bytes - 1::2 * field_bytes]))
+    return matrix
+
+# Check that the index pairs written for expanded plates can be told apart.  Returns a report dictionary:
+#   'samples', 'index_pairs': numbers of samples and of distinct index pairs (i7 sequence, i5 sequence; i5 is '' for SE)
+#   'min_distance': minimum Hamming distance between distinct index pairs (0 if any samples share an index pair;
+#       None if there is only one index pair)
+#   'collisions': [(index pair, [sample names])] for index pairs shared by more than one sample
+#   'near_collisions': [(sample name, index pair, sample name, index pair, distance)] for distinct index pairs within
+#       near_distance of each other (one sample named per index pair)
+# expanded may also be the SampleRecords of expanded plates, shared with check_color_balance()
+def check_index_collisions(expanded, workflow, readstype, near_distance=near_collision_distance, barcode_kit=None):
+    # first sample of each index pair, and all samples of shared index pairs (Sample_Names only for those reported)
+    records = expanded if isinstance(expanded, SampleRecords) else SampleRecords(expanded)
+    samples = {}
+    shared = {}
+    for n, index_pair in enumerate(records.index_pairs(workflow, readstype, barcode_kit)):
+        if index_pair not in samples:
+            samples[index_pair] = n
+        elif index_pair in shared:
+            shared[index_pair].append(n)
+        else:
+            shared[index_pair] = [samples[index_pair], n]
+    collisions = [(index_pair, [records.sample_name(n) for n in shared[index_pair]])
+                  for index_pair in sorted(shared, key=samples.get)]
+
+    i7_seqs = tuple(sorted({i[0] for i in samples}))
+    i5_seqs = tuple(sorted({i[1] for i in samples}))
+    i7_positions = {seq: n for n, seq in enumerate(i7_seqs)}
+    i5_positions = {seq: n for n, seq in enumerate(i5_seqs)}
+    i7_distances = hamming_matrix(i7_seqs)
+    i5_distances = hamming_matrix(i5_seqs) if readstype == 'PE' else [[0]]
+    pairs = {(i7_positions[i7], i5_positions[i5]): (i7, i5) for i7, i5 in samples}
+
+    # near-collisions: for each index pair, look only at i7 and i5 neighbors within near_distance
+    i7_neighbors = [[c for c in range(len(i7_seqs)) if row[c] <= near_distance] for row in i7_distances]
+    i5_neighbors = [[d for d in range(len(i5_seqs)) if row[d] <= near_distance] for row in i5_distances]
+    near_collisions = []
+    for a, b in sorted(pairs):
+        for c in i7_neighbors[a]:
+            for d in i5_neighbors[b]:
+                distance = i7_distances[a][c] + i5_distances[b][d]
+                if distance <= near_distance and (c, d) > (a, b) and (c, d) in pairs:
+                    near_collisions.append((records.sample_name(samples[pairs[a, b]]), pairs[a, b],
+                                            records.sample_name(samples[pairs[c, d]]), pairs[c, d], distance))
+
+    # minimum distance: i7 distance plus the closest i5 pairing between the i5 sets used with each i7
+    if collisions:
+        min_distance = 0
+    elif near_collisions:
+        min_distance = min(i[4] for i in near_collisions)
+    else:
+        i5_sets = {}
+        for a, b in pairs:
+            i5_sets.setdefault(a, set()).add(b)
+        i5_sets = {a: tuple(sorted(b)) for a, b in i5_sets.items()}
+        i7_used = sorted(i5_sets)
+        closest = {}
+        min_distance = None
+        for n, a in enumerate(i7_used):
+            for c in i7_used[n:]:
+                if min_distance is not None and i7_distances[a][c] >= min_distance:
+                    continue
+                key = (i5_sets[a], i5_sets[c], a == c)
+                if key not in closest:
+                    if a == c:
+                        closest[key] = min((i5_distances[b][d] for x, b in enumerate(key[0]) for d in key[0][x + 1:]), default=None)
+                    else:
+                        closest[key] = min(i5_distances[b][d] for b in key[0] for d in key[1])
+                if closest[key] is not None and (min_distance is None or i7_distances[a][c] + closest[key] < min_distance):
+                    min_distance = i7_distances[a][c] + closest[key]
+
+    return {'samples': len(records), 'index_pairs': len(samples), 'min_distance': min_distance,
+            'collisions': collisions, 'near_collisions': near_collisions}
+
+# Text summary of an index collision report
+def format_collision_report(report, near_distance=near_collision_distance):
+    lines = [str(report['samples'])+' samples, '+str(report['index_pairs'])+' distinct index pairs; minimum Hamming distance between index pairs: '+
+             ('NA' if report['min_distance'] is None else str(report['min_distance']))]
+    for index_pair, names in report['collisions']:
+        lines.append('COLLISION: index pair '+'+'.join(i for i in index_pair if i)+' is shared by '+', '.join(names))
+    for name1, pair1, name2, pair2, distance in report['near_collisions']:
+        lines.append('NEAR COLLISION (distance '+str(distance)+' <= '+str(near_distance)+'): '+name1+' ('+'+'.join(i for i in pair1 if i)+') vs. '+
+                     name2+' ('+'+'.join(i for i in pair2 if i)+')')
+    return '\n'.join(lines)
+
+# Sequences within near_distance of each sequence of a sorted tuple, itself included: {sequence: ((sequence, distance),
+# ...)}, from hamming_matrix(); computed once per tuple of sequences, so index pairs near a given pair are found among
+# the neighbors of its i7 and i5 sequences (as lookup_barcode() finds barcodes near a sequence) without a scan
+@functools.lru_cache(maxsize=64)
+def near_sequences(sequences, near_distance=near_collision_distance):
+    return {sequence: tuple((other, distance) for other, distance in zip(sequences, row) if distance <= near_distance)
+            for sequence, row in zip(sequences, hamming_matrix(sequences))}
+
+# Near-collisions of added index pairs with each other and with existing index pairs (both {index pair: sample name},
+# e.g. the rows kept in a Sample Sheet being updated), as in check_index_collisions().  sequences holds the i7 and i5
+# sequences (collections of distinct sequences, which may include others) of both; only the index pairs made of
+# neighbors of each added pair's i7 and i5 sequences are looked up, so the cost grows with the added pairs only.
+def added_near_collisions(added_pairs, existing_pairs, sequences, readstype, near_distance=near_collision_distance):
+    i7_near = near_sequences(tuple(sorted(sequences[0])), near_distance)
+    i5_near = near_sequences(tuple(sorted(sequences[1])), near_distance) if readstype == 'PE' else {'': (('', 0),)}
+    near_collisions = []
+    for index_pair, sample_name in added_pairs.items():
+        for i7, i7_distance in i7_near[index_pair[0]]:
+            for i5, i5_distance in i5_near[index_pair[1]]:
+                other = (i7, i5)
+                if i7_distance + i5_distance > near_distance or other == index_pair:
+                    continue
+                if other in existing_pairs:
+                    near_collisions.append((sample_name, index_pair, existing_pairs[other], other, i7_distance + i5_distance))
+                elif other in added_pairs and other > index_pair:
+                    near_collisions.append((sample_name, index_pair, added_pairs[other], other, i7_distance + i5_distance))
+    return near_collisions
+
+# Index color balance checks:
+# Index cycles are imaged in 4-channel chemistry (e.g. MiSeq, HiSeq 2500/4000) or 2-channel chemistry (e.g. NovaSeq 6000,
+# NextSeq, MiniSeq).  A cycle registers only when the pooled samples give signal in each channel: in 4-channel chemistry
+# the red laser detects A and C and the green laser G and T; in 2-channel chemistry the red image shows A and C and the
+# green image A and T (G is dark).  Index reads are checked in the orientation entered in the Sample Sheet for the
+# Workflow, weighting each index sequence by the number of samples that use it.  Neither Workflow implies a chemistry
+# (Workflow A includes MiSeq and NovaSeq 6000, Workflow B HiSeq 4000 and NextSeq), so both are checked unless a
+# chemistry setting chooses one, or none.  Known kit property: the i7 indices of the default kit all end in A (as read),
+# so a 4-channel check flags the last i7 cycle of every Sample Sheet from that kit.
+channel_bases = {
+'4-channel': {'red': 'AC', 'green': 'GT'},
+'2-channel': {'red': 'AC', 'green': 'AT'}
+}
+min_channel_fraction = 0.1
+color_balance_chemistries = tuple(channel_bases)
+chemistry_settings = ('all', 'none') + color_balance_chemistries
+chemistry_help = ("index chemistry to check color balance for: 4-channel (MiSeq, HiSeq), 2-channel (NovaSeq 6000, NextSeq, "
+                  "MiniSeq), all (default) or none; the default kit's i7 indices all end in A, so 4-channel checks always flag "
+                  "the last i7 cycle")
+
+# Chemistries checked for a chemistry setting ('all', 'none' or a channel_bases name)
+def setting_chemistries(setting='all'):
+    if setting not in chemistry_settings:
+        raise ValueError("chemistry should be one of "+', '.join(chemistry_settings)+", got '"+str(setting)+"'")
+    return color_balance_chemistries if setting == 'all' else () if setting == 'none' else (setting,)
+
+# Per-cycle base composition of a pool of index sequences ({sequence: number of samples}): a list (one per cycle) of
+# {base: fraction of samples}; sequences shorter than the longest sequence do not contribute to later cycles
+def base_composition(sequence_counts):
+    cycles = []
+    length = max((len(i) for i in sequence_counts), default=0)
+    for position in range(length):
+        counts = {'A': 0, 'C': 0, 'G': 0, 'T': 0}
+        total = 0
+        for sequence, number in sequence_counts.items():
+            if position < len(sequence):
+                base = sequence[position]
+                counts[base] = counts.get(base, 0) + number
+                total = total + number
+        cycles.append({base: number / total for base, number in counts.items()})
+    return cycles
+
+# Check per-cycle color balance of the i7 (and, for PE, i5) index reads of expanded plates.  Returns a report dictionary:
+#   'samples': number of samples
+#   'reads': {'i7': cycles, 'i5': cycles}, where each cycle is a dictionary with 'cycle' (1-based), 'composition'
+#       ({base: fraction}), 'channels' ({chemistry: {channel: fraction of samples with signal}}) and 'flags' (a list
+#       of messages for channels without signal, or with signal from fewer than min_fraction of samples)
+# expanded may also be the SampleRecords of expanded plates, shared with check_index_collisions()
+def check_color_balance(expanded, workflow, readstype, chemistries=color_balance_chemistries, min_fraction=min_channel_fraction, barcode_kit=None):
+    i7_counts = {}
+    i5_counts = {}
+    records = expanded if isinstance(expanded, SampleRecords) else SampleRecords(expanded)
+    for i7, i5 in records.index_pairs(workflow, readstype, barcode_kit):
+        i7_counts[i7] = i7_counts.get(i7, 0) + 1
+        i5_counts[i5] = i5_counts.get(i5, 0) + 1
+    reads = {'i7': i7_counts, 'i5': i5_counts} if readstype == 'PE' else {'i7': i7_counts}
+    return index_color_balance(reads, len(records), chemistries, min_fraction)
+
+# Color balance report (see check_color_balance()) of a number of samples, from the index sequences of each index read
+# ({'i7': {sequence: number of samples}, 'i5': ...}), e.g. counts kept up to date as rows are added and removed
+def index_color_balance(reads, samples, chemistries=color_balance_chemistries, min_fraction=min_channel_fraction):
+    report = {'samples': samples, 'reads': {}}
+    for read, sequence_counts in reads.items():
+        cycles = []
+        for n, composition in enumerate(base_composition(sequence_counts), start=1):
+            channels = {}
+            flags = []
+            for chemistry in chemistries:
+                channels[chemistry] = {}
+                for channel, bases in channel_bases[chemistry].items():
+                    fraction = sum(composition.get(base, 0) for base in bases)
+                    channels[chemistry][channel] = fraction
+                    if fraction == 0:
+                        flags.append(chemistry+': no signal in '+channel+' channel')
+                    elif fraction < min_fraction:
+                        flags.append(chemistry+': '+channel+' channel signal from only '+'%.0f%%' % (100 * fraction)+' of samples')
+            cycles.append({'cycle': n, 'composition': composition, 'channels': channels, 'flags': flags})
+        report['reads'][read] = cycles
+    return report
+
+# Text summary of a color balance report (flagged cycles only, unless all_cycles is True)
+def format_color_balance_report(report, all_cycles=False):
+    lines = []
+    for read, cycles in report['reads'].items():
+        flagged = [i for i in cycles if i['flags']]
+        lines.append(read+' index read: '+str(len(cycles))+' cycles, '+(str(len(flagged))+' unbalanced' if flagged else 'balanced'))
+        for cycle in (cycles if all_cycles else flagged):
+            composition = ' '.join(base+' '+'%3.0f%%' % (100 * fraction) for base, fraction in cycle['composition'].items())
+            lines.append('    cycle '+'%2d' % cycle['cycle']+': '+composition+('  UNBALANCED: '+'; '.join(cycle['flags']) if cycle['flags'] else ''))
+    return '\n'.join(lines)
+
+# Multi-lane sharding:
+# Plates are assigned to lanes largest first, each to the lane with the fewest samples so far that shares none of the
+# plate's index pairs (i7 + i5 sequences); index pairs may repeat across lanes but not within a lane.
+# (i7, i5) index sequence pairs of the samples of each expanded plate ('' for i5 in SE runs), one list per plate
+def plate_index_pairs(expanded, workflow, readstype, barcode_kit=None):
+    index_pairs = SampleRecords(expanded).index_pairs(workflow, readstype, barcode_kit)
+    return [list(itertools.islice(index_pairs, len(plate[1]) * (len(plate[2]) if len(plate) > 2 else 1))) for plate in expanded]
+
+# Assign expanded plates to a number of lanes; returns one list of plates per lane (plates keep their input order)
+def shard_plates(expanded, workflow, readstype, lanes, barcode_kit=None):
+    if lanes < 1:
+        raise ValueError('number of lanes should be at least 1, got '+str(lanes))
+    lane_loads = [(0, lane) for lane in range(lanes)]
+    lane_pairs = [set() for lane in range(lanes)]
+    lane_members = [[] for lane in range(lanes)]
+    plate_pairs = plate_index_pairs(expanded, workflow, readstype, barcode_kit)
+    for n in sorted(range(len(expanded)), key=lambda n: -len(plate_pairs[n])):
+        pairs = plate_pairs[n]
+        if len(set(pairs)) < len(pairs):
+            raise ValueError("plate '"+expanded[n][0]+"' repeats an index pair within the plate")
+        skipped = []
+        while lane_loads:
+            load, lane = heapq.heappop(lane_loads)
+            if lane_pairs[lane].isdisjoint(pairs):
+                break
+            skipped.append((load, lane))
+        else:
+            raise ValueError("plate '"+expanded[n][0]+"' shares index pairs with plates in every lane; use more lanes")
+        lane_pairs[lane].update(pairs)
+        lane_members[lane].append(n)
+        heapq.heappush(lane_loads, (load + len(pairs), lane))
+        for i in skipped:
+            heapq.heappush(lane_loads, i)
+    return [[expanded[n] for n in sorted(members)] for members in lane_members]
+
+# Write one Sample Sheet for all lanes, with a leading Lane column in [Data] (Sample_IDs continue across lanes);
+# returns the number of [Data] rows written
+def write_lane_sample_sheet(f, workflow, InvestigatorName, ProjectName, readstype, readsvalue, lane_plates, sheet_format='v1'):
+    return write_sample_sheets([(sheet_format, f)], workflow, InvestigatorName, ProjectName, readstype, readsvalue, lane_plates, lane_column=True)
+
+# Sample Sheet file name with a suffix ('SampleSheet.csv', '_Lane1' -> 'SampleSheet_Lane1.csv')
+def suffixed_filepath(filepath, suffix):
+    from pathlib import Path
+    filepath = Path(filepath)
+    return filepath.with_name(filepath.stem + suffix + filepath.suffix)
+
+# Sample Sheet file names for formats: the first format is written to filepath, others to '<name>_<format>.csv'
+def format_filepaths(filepath, sheet_formats):
+    return [(name, filepath if n == 0 else suffixed_filepath(filepath, '_' + name)) for n, name in enumerate(sheet_formats)]
+
+# Write one Sample Sheet per lane ('<name>_Lane<#>.csv' next to filepath, in each format) concurrently in worker processes;
+# returns the lane Sample Sheet paths.  The workers' rendering and writing are timed together in metrics, as 'write'.
+def write_lane_sample_sheets(filepath, workflow, InvestigatorName, ProjectName, readstype, readsvalue, lane_plates, workers=None, sheet_formats=('v1',), metrics=None, barcode_kit=None):
+    jobs = []
+    for lane, plates in enumerate(lane_plates, start=1):
+        outputs = format_filepaths(suffixed_filepath(filepath, '_Lane' + str(lane)), sheet_formats)
+        jobs.append((outputs, workflow, InvestigatorName, ProjectName, readstype, readsvalue, plates, barcode_kit))
+    with metrics_span(metrics, 'write'):
+        if workers == 1 or len(jobs) == 1:
+            rows = [write_sample_sheet_files(job) for job in jobs]
+        else:
+            import concurrent.futures
+            with concurrent.futures.ProcessPoolExecutor(max_workers=workers or min(len(jobs), os.cpu_count() or 1)) as executor:
+                rows = list(executor.map(write_sample_sheet_files, jobs))
+    if metrics is not None:
+        metrics.count('rows_written', sum(rows) * len(sheet_formats))
+    return [path for job in jobs for name, path in job[0]]
+
+# Worker: write a Sample Sheet in one or more formats from (outputs [(format name, filepath)], workflow,
+# InvestigatorName, ProjectName, readstype, readsvalue, expanded, barcode kit); returns the number of data rows written
+def write_sample_sheet_files(job):
+    with contextlib.ExitStack() as stack:
+        outputs = [(name, stack.enter_context(open_sample_sheet(path, 'w'))) for name, path in job[0]]
+        return write_sample_sheets(outputs, job[1], job[2], job[3], job[4], job[5], [job[6]], barcode_kit=job[7])
+
+# Barcode lookup:
+# Observed index sequences are resolved to barcodes with a hash table holding every sequence within max_mismatches
+# substitutions (A, C, G, T or N) of each barcode, so a lookup is a single dictionary access.  Each key keeps only
+# its closest barcodes: (mismatches, candidates), where a candidate is a table label plus index name (e.g.
+# ('i7', 'revcomp', 'i7A01')); a sequence with more than one closest candidate is ambiguous.
+lookup_bases = 'ACGTN'
+
+# Sequences that differ from sequence at exactly mismatches positions
+def mismatch_neighbors(sequence, mismatches):
+    if mismatches == 0:
+        yield sequence
+        return
+    for positions in itertools.combinations(range(len(sequence)), mismatches):
+        choices = [lookup_bases.replace(sequence[p], '') for p in positions]
+        for bases in itertools.product(*choices):
+            neighbor = list(sequence)
+            for p, base in zip(positions, bases):
+                neighbor[p] = base
+            yield ''.join(neighbor)
+
+# The i7 and i5 barcode tables of a barcode kit (None for the default kit) in both orientations, by (kit, orientation)
+# label
+def barcode_tables(barcode_kit=None):
+    kit_files = load_barcode_kit(barcode_kit).files
+    return {(kit, orientation): barcode_table(kit, orientation, barcode_kit) for kit in ('i7', 'i5') if kit in kit_files
+            for orientation in ('forward', 'revcomp')}
+
+# Lookup table {sequence: (mismatches, candidates)} for barcode tables {label: {index name: sequence}}
+def build_barcode_index(tables, max_mismatches=2):
+    index = {}
+    for mismatches in range(max_mismatches + 1):
+        for label, table in tables.items():
+            for name, sequence in table.items():
+                candidate = label + (name,)
+                for neighbor in mismatch_neighbors(sequence, mismatches):
+                    entry = index.get(neighbor)
+                    if entry is None:
+                        index[neighbor] = (mismatches, (candidate,))
+                    elif entry[0] == mismatches and candidate not in entry[1]:
+                        index[neighbor] = (mismatches, entry[1] + (candidate,))
+    return index
+
+# Lookup table for the i7 and i5 barcode tables of a barcode kit in both orientations (built once per process for the
+# most recently used kits)
+@functools.lru_cache(maxsize=barcode_kit_cache_size)
+def barcode_index(max_mismatches=2, barcode_kit=None):
+    return build_barcode_index(barcode_tables(barcode_kit), max_mismatches)
+
+# Closest barcodes of a barcode kit (None for the default kit) to an observed index sequence: (mismatches, candidates),
+# or None if no barcode is within max_mismatches; more than one candidate means the sequence is ambiguous
+def lookup_barcode(sequence, max_mismatches=2, barcode_kit=None):
+    return barcode_index(max_mismatches, barcode_kit or default_barcode_kit).get(sequence.upper())
+
+# Text of the closest barcodes of a lookup_barcode() entry
+def format_lookup_entry(entry, max_mismatches):
+    if entry is None:
+        return 'no barcode within '+str(max_mismatches)+' mismatches'
+    mismatches, candidates = entry
+    matches = '; '.join(' '.join(candidate) for candidate in candidates)
+    return ('ambiguous: ' if len(candidates) > 1 else '')+matches+' ('+str(mismatches)+(' mismatch)' if mismatches == 1 else ' mismatches)')
+
+# Look up observed index sequences in a barcode kit, printing their closest barcodes
+def lookup(sequences, max_mismatches=2, barcode_kit=None):
+    for sequence in sequences:
+        print(sequence+': '+format_lookup_entry(lookup_barcode(sequence, max_mismatches, barcode_kit), max_mismatches))
+
+# Sample Sheet validation:
+# A Sample Sheet in the [Header]/[Reads]/[Settings]/[Data] layout written by this script (including hand-edited copies)
+# is read one line at a time; [Data] rows are checked as they are read, so only the Sample_IDs and index pairs seen so
+# far (for duplicate checks) are held in memory, never the rows themselves.  Each index sequence is checked against the
+# barcode tables (of a barcode kit, None for the default kit) in the orientation of the Workflow, given or, if None,
+# taken from the first i5 index that matches either orientation (SE sheets are checked as Workflow 'A').  Sample_IDs
+# and index pairs must be unique within a lane.
+max_reported_errors = 100
+
+# Split a Sample Sheet line into fields, dropping the trailing empty fields spreadsheet programs add
+def sample_sheet_fields(line):
+    if '"' in line:
+        import csv
+        fields = next(csv.reader([line]))
+    else:
+        fields = line.split(',')
+    while fields and not fields[-1].strip():
+        fields.pop()
+    return fields
+
+# Non-empty lines of a Sample Sheet file, read one at a time, as (section name (e.g. '[Data]'), line number, fields)
+def sample_sheet_lines(sheet_path):
+    section = None
+    with open(sheet_path, encoding='utf-8-sig', newline='') as f:
+        for line_number, line in enumerate(f, start=1):
+            line = line.rstrip('\r\n')
+            if line.startswith('['):
+                section = line.split(']', 1)[0] + ']'
+                continue
+            fields = sample_sheet_fields(line)
+            if fields:
+                yield section, line_number, fields
+
+# Check a Sample Sheet file.  Returns a report dictionary:
+#   'header', 'settings': {key: value} of the [Header] and [Settings] sections; 'reads': [cycles] from [Reads]
+#   'workflow': Workflow the indices were checked against (None if it could not be determined)
+#   'rows': number of [Data] rows
+#   'error_count': number of problems found; 'errors': [(line number, message)] for the first max_errors of them
+def validate_sample_sheet(sheet_path, workflow=None, max_errors=max_reported_errors, barcode_kit=None):
+    report = {'header': {}, 'reads': [], 'settings': {}, 'workflow': workflow, 'rows': 0, 'error_count': 0, 'errors': []}
+
+    def error(line_number, message):
+        report['error_count'] = report['error_count'] + 1
+        if len(report['errors']) < max_errors:
+            report['errors'].append((line_number, message))
+
+    i7_sequences = barcode_table('i7', 'revcomp', barcode_kit)
+    i5_tables = {w: workflow_barcodes(w, barcode_kit)[1] for w in workflow_orientations}
+    i5_sequences = i5_tables[workflow] if workflow else None
+    i7_known = set(i7_sequences.values())
+    i5_names = i5_tables['A']
+    i5_known = {w: set(table.values()) for w, table in i5_tables.items()}
+    columns = None
+    sample_ids = {}
+    index_pairs = {}
+    for section, line_number, fields in sample_sheet_lines(sheet_path):
+        if section == '[Data]' and columns is not None:
+            report['rows'] = report['rows'] + 1
+            if len(fields) != len(columns):
+                error(line_number, 'expected '+str(len(columns))+' columns ('+','.join(columns)+'), got '+str(len(fields)))
+                continue
+            lane = fields[column['Lane']] + ',' if 'Lane' in column else ''
+            sample_id = fields[column['Sample_ID']]
+            i7_sequence = fields[column['index']].upper()
+            i5_sequence = fields[column['index2']].upper() if 'index2' in column else ''
+            # duplicate checks keep one short string per Sample_ID and per index pair ('<lane>,<i7>,<i5>')
+            if not sample_id:
+                error(line_number, 'empty Sample_ID')
+            elif lane + sample_id in sample_ids:
+                error(line_number, "duplicate Sample_ID '"+sample_id+"' (line "+str(sample_ids[lane + sample_id])+")")
+            else:
+                sample_ids[lane + sample_id] = line_number
+            index_pair = lane + i7_sequence + ',' + i5_sequence
+            if index_pair in index_pairs:
+                error(line_number, 'duplicate index pair '+i7_sequence+(' + '+i5_sequence if i5_sequence else '')+
+                      ' (line '+str(index_pairs[index_pair])+')')
+            else:
+                index_pairs[index_pair] = line_number
+
+            # i7 index: reverse complement of the primer index in both Workflows
+            if 'I7_Index_ID' in column:
+                i7_ID = fields[column['I7_Index_ID']]
+                if i7_ID not in i7_sequences:
+                    error(line_number, "I7_Index_ID '"+i7_ID+"' is not in the barcode tables")
+                elif i7_sequences[i7_ID] != i7_sequence:
+                    error(line_number, 'index for '+i7_ID+' should be '+i7_sequences[i7_ID]+', got '+i7_sequence+
+                          (' (not reverse complemented)' if barcode_table('i7', 'forward', barcode_kit)[i7_ID] == i7_sequence else ''))
+            elif i7_sequence not in i7_known:
+                error(line_number, 'index '+i7_sequence+' is not in the barcode tables')
+            if 'index2' not in column:
+                continue
+
+            # i5 index: as in the primer for Workflow 'A', reverse complement for Workflow 'B'
+            i5_ID = fields[column['I5_Index_ID']] if 'I5_Index_ID' in column else None
+            if i5_ID is not None and i5_ID not in i5_names:
+                error(line_number, "I5_Index_ID '"+i5_ID+"' is not in the barcode tables")
+                continue
+            if i5_sequences is None:
+                if i5_ID is not None:
+                    matches = [w for w in ('A', 'B') if i5_tables[w][i5_ID] == i5_sequence]
+                else:
+                    matches = [w for w in ('A', 'B') if i5_sequence in i5_known[w]]
+                if not matches:
+                    error(line_number, 'index2 '+i5_sequence+(' for '+i5_ID if i5_ID else '')+
+                          ' matches the barcode tables in neither Workflow orientation')
+                    continue
+                report['workflow'] = matches[0]
+                i5_sequences = i5_tables[matches[0]]
+            if i5_ID is not None:
+                if i5_sequences[i5_ID] != i5_sequence:
+                    error(line_number, 'index2 for '+i5_ID+' should be '+i5_sequences[i5_ID]+' for Workflow '+
+                          report['workflow']+', got '+i5_sequence)
+            elif i5_sequence not in i5_known[report['workflow']]:
+                error(line_number, 'index2 '+i5_sequence+' is not in the barcode tables for Workflow '+report['workflow'])
+        elif section == '[Data]':
+            columns = fields
+            column = {name: n for n, name in enumerate(columns)}
+            for name in ('Sample_ID', 'index'):
+                if name not in column:
+                    raise ValueError('line '+str(line_number)+': [Data] has no '+name+' column')
+            if 'index2' not in columns and report['workflow'] is None:
+                report['workflow'] = 'A'
+        elif section == '[Reads]':
+            if not fields[0].strip().isdigit():
+                error(line_number, "[Reads] entry should be a number of cycles, got '"+','.join(fields)+"'")
+            else:
+                report['reads'].append(int(fields[0]))
+        elif section in ('[Header]', '[Settings]'):
+            report[section[1:-1].lower()][fields[0]] = ','.join(fields[1:])
+    if columns is None:
+        raise ValueError('no [Data] section (IEM v4 Sample Sheet expected)')
+    return report
+
+# Text summary of a validation report
+def format_validation_report(report):
+    lines = [str(report['rows'])+' [Data] rows, Workflow '+(report['workflow'] or 'unknown')+', '+
+             str(report['error_count'])+(' problem' if report['error_count'] == 1 else ' problems')]
+    lines.extend('    line '+str(line_number)+': '+message for line_number, message in report['errors'])
+    if report['error_count'] > len(report['errors']):
+        lines.append('    ... and '+str(report['error_count'] - len(report['errors']))+' more')
+    return '\n'.join(lines)
+
+# Validate Sample Sheet files against a barcode kit, printing a report for each; returns the number of Sample Sheets
+# with problems
+def validate(sheet_paths, workflow=None, barcode_kit=None):
+    failures = 0
+    for sheet_path in sheet_paths:
+        try:
+            report = validate_sample_sheet(sheet_path, workflow, barcode_kit=barcode_kit)
+        except (OSError, ValueError, UnicodeDecodeError) as e:
+            failures = failures + 1
+            print(str(sheet_path)+': ERROR: '+str(e), file = sys.stderr)
+            continue
+        if report['error_count']:
+            failures = failures + 1
+        print(str(sheet_path)+': '+format_validation_report(report))
+    return failures
+
+# Index-read demultiplexing check:
+# Index reads (I1, and I2 for dual-index Sample Sheets) from gzipped or plain FASTQ files are assigned to the samples of
+# a Sample Sheet as the instrument would: each index read (trimmed to the index length) is corrected to the Sample Sheet
+# index within max_mismatches, unless two Sample Sheet indices are equally close, and a read is assigned to the sample
+# with that index pair.  The main process decompresses the FASTQ files and passes chunks of index reads to worker
+# processes, which hold the correction tables (set up once per worker) and return read counts per sample and for the
+# demultiplex_unassigned_tracked most frequent unassigned index pairs of the chunk; the main process keeps at most as
+# many pairs again (dropping the least frequent), so memory and transfers stay bounded however many distinct
+# unassigned pairs the reads hold.  Pairs that are frequent overall are among the most frequent of nearly every chunk,
+# so their counts are exact or close to it; the most frequent unassigned index pairs are reported with their closest
+# barcodes in a barcode kit (e.g. indices of a different kit, or in the other orientation, than the Sample Sheet's).
+demultiplex_chunk_reads = 200000
+demultiplex_unassigned_reported = 10
+demultiplex_unassigned_tracked = 1000
+
+# Samples of the [Data] section of a Sample Sheet (of one lane, if lane is given): [(Sample_ID, Sample_Name, index, index2)],
+# index2 '' for single-index Sample Sheets
+def sample_sheet_samples(sheet_path, lane=None):
+    samples = []
+    column = None
+    for section, line_number, fields in sample_sheet_lines(sheet_path):
+        if section != '[Data]':
+            continue
+        if column is None:
+            column = {name: n for n, name in enumerate(fields)}
+            for name in ('Sample_ID', 'index'):
+                if name not in column:
+                    raise ValueError('line '+str(line_number)+': [Data] has no '+name+' column')
+            continue
+        if len(fields) != len(column):
+            raise ValueError('line '+str(line_number)+': expected '+str(len(column))+' columns, got '+str(len(fields)))
+        if lane is not None and 'Lane' in column and fields[column['Lane']] != str(lane):
+            continue
+        samples.append((fields[column['Sample_ID']], fields[column['Sample_Name']] if 'Sample_Name' in column else '',
+                        fields[column['index']].upper(), fields[column['index2']].upper() if 'index2' in column else ''))
+    if column is None:
+        raise ValueError('no [Data] section (IEM v4 Sample Sheet expected)')
+    if not samples:
+        raise ValueError('no samples'+(' in lane '+str(lane) if lane is not None else ''))
+    return samples
+
+# Correction table {observed index read: Sample Sheet index} for index reads within max_mismatches of exactly one index
+def index_corrections(sequences, max_mismatches):
+    index = build_barcode_index({(): {sequence: sequence for sequence in sequences}}, max_mismatches)
+    return {observed: entry[1][0][0] for observed, entry in index.items() if len(entry[1]) == 1}
+
+# Demultiplexing tables for Sample Sheet samples: (i7 corrections, i5 corrections or None for single-index Sample
+# Sheets, {(index, index2): sample number}, i7 index length, i5 index length)
+def demultiplex_tables(samples, max_mismatches=1):
+    pair_samples = {}
+    for n, (sample_id, sample_name, index, index2) in enumerate(samples):
+        if (index, index2) in pair_samples:
+            raise ValueError("samples '"+samples[pair_samples[(index, index2)]][0]+"' and '"+sample_id+
+                             "' share index pair "+index+(' + '+index2 if index2 else '')+' (choose a lane?)')
+        pair_samples[(index, index2)] = n
+    i7_lengths = {len(i[2]) for i in samples}
+    i5_lengths = {len(i[3]) for i in samples}
+    if len(i7_lengths) > 1 or len(i5_lengths) > 1:
+        raise ValueError('indices of different lengths cannot be demultiplexed together')
+    i5_length = i5_lengths.pop()
+    i5_correct = index_corrections({i[3] for i in samples}, max_mismatches) if i5_length else None
+    return (index_corrections({i[2] for i in samples}, max_mismatches), i5_correct, pair_samples, i7_lengths.pop(), i5_length)
+
+# Sequence lines of a FASTQ file (gzipped or plain), in chunks of up to chunk_reads newline-separated lines (bytes);
+# the file is decompressed in large blocks, which is several times faster than reading it line by line
+def fastq_index_chunks(fastq_path, chunk_reads=demultiplex_chunk_reads, block_size=1 << 22):
+    import gzip
+    with open(fastq_path, 'rb') as f:
+        opener = gzip.open if f.read(2) == b'\x1f\x8b' else open
+    chunk_lines = 4 * chunk_reads
+    lines = []
+    tail = b''
+    with opener(fastq_path, 'rb') as f:
+        while True:
+            block = f.read(block_size)
+            if not block:
+                break
+            lines.extend((tail + block).split(b'\n'))
+            tail = lines.pop()
+            while len(lines) >= chunk_lines:
+                yield b'\n'.join(lines[1:chunk_lines:4])
+                del lines[:chunk_lines]
+    if tail.strip():
+        lines.append(tail)
+    if len(lines) % 4:
+        raise ValueError(str(fastq_path)+': incomplete FASTQ record at end of file')
+    if lines:
+        yield b'\n'.join(lines[1::4])
+
+# Demultiplexing tables of the current (worker) process
+worker_demultiplex_tables = None
+
+def set_demultiplex_tables(tables):
+    global worker_demultiplex_tables
+    worker_demultiplex_tables = tables
+
+# Worker: read counts ({sample number (None for unassigned): reads}, [((I1 read, I2 read or ''), reads)] for the
+# demultiplex_unassigned_tracked most frequent unassigned pairs) for a chunk (I1 sequence lines, I2 sequence lines or None)
+def demultiplex_chunk(chunk):
+    i7_correct, i5_correct, pair_samples, i7_length, i5_length = worker_demultiplex_tables
+    if chunk[0] is None or (i5_correct is not None and chunk[1] is None):
+        raise ValueError('I1 and I2 FASTQ files have different numbers of reads')
+    i7_reads = [i[:i7_length] for i in chunk[0].decode('ascii').split()]
+    i7_indices = map(i7_correct.get, i7_reads)
+    if i5_correct is None:
+        read_pairs = zip(i7_reads, itertools.repeat(''))
+        samples = [pair_samples.get((i, '')) for i in i7_indices]
+    else:
+        i5_reads = [i[:i5_length] for i in chunk[1].decode('ascii').split()]
+        if len(i5_reads) != len(i7_reads):
+            raise ValueError('I1 and I2 FASTQ files have different numbers of reads')
+        read_pairs = zip(i7_reads, i5_reads)
+        samples = list(map(pair_samples.get, zip(i7_indices, map(i5_correct.get, i5_reads))))
+    unassigned = collections.Counter(itertools.compress(read_pairs, map(operator.is_, samples, itertools.repeat(None))))
+    return collections.Counter(samples), unassigned.most_common(demultiplex_unassigned_tracked)
+
+# Assign index reads from I1 (and I2) FASTQ files to the samples of a Sample Sheet.  Returns a report dictionary:
+#   'reads': number of reads; 'unassigned': number of reads not assigned to a sample; 'unassigned_fraction'
+#   'samples': [(Sample_ID, Sample_Name, index, index2, reads)] in Sample Sheet order
+#   'unassigned_indices': [(index, index2, reads, index lookup, index2 lookup)] for the most frequent unassigned index
+#       pairs (reads counted in the chunks where the pair was tracked, see above), where lookups are lookup_barcode() entries in barcode_kit (index2 lookup None for SE); 'max_mismatches'
+def demultiplex(sheet_path, i1_path, i2_path=None, max_mismatches=1, lane=None, workers=None, chunk_reads=demultiplex_chunk_reads, barcode_kit=None):
+    load_barcode_kit(barcode_kit)
+    samples = sample_sheet_samples(sheet_path, lane)
+    tables = demultiplex_tables(samples, max_mismatches)
+    if tables[1] is not None and i2_path is None:
+        raise ValueError('the Sample Sheet has index2 sequences; an I2 FASTQ file is needed')
+    if tables[1] is None:
+        chunks = zip(fastq_index_chunks(i1_path, chunk_reads), itertools.repeat(None))
+    else:
+        chunks = itertools.zip_longest(fastq_index_chunks(i1_path, chunk_reads), fastq_index_chunks(i2_path, chunk_reads))
+    counts = collections.Counter()
+    unassigned = collections.Counter()
+
+    def add(chunk_counts):
+        counts.update(chunk_counts[0])
+        for pair, pair_reads in chunk_counts[1]:
+            unassigned[pair] += pair_reads
+        if len(unassigned) > 2 * demultiplex_unassigned_tracked:
+            for pair, pair_reads in unassigned.most_common()[demultiplex_unassigned_tracked:]:
+                del unassigned[pair]
+
+    workers = workers or os.cpu_count() or 1
+    if workers == 1:
+        set_demultiplex_tables(tables)
+        for chunk in chunks:
+            add(demultiplex_chunk(chunk))
+    else:
+        import concurrent.futures
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers, initializer=set_demultiplex_tables, initargs=(tables,)) as executor:
+            # a few chunks in flight per worker keep memory bounded
+            pending = collections.deque()
+            for chunk in chunks:
+                pending.append(executor.submit(demultiplex_chunk, chunk))
+                if len(pending) >= 2 * workers:
+                    add(pending.popleft().result())
+            while pending:
+                add(pending.popleft().result())
+    reads = sum(counts.values())
+    unassigned_indices = []
+    for (index, index2), pair_reads in unassigned.most_common(demultiplex_unassigned_reported):
+        i5_entry = lookup_barcode(index2, max_mismatches, barcode_kit) if index2 else None
+        unassigned_indices.append((index, index2, pair_reads, lookup_barcode(index, max_mismatches, barcode_kit), i5_entry))
+    return {'reads': reads, 'unassigned': counts[None], 'unassigned_fraction': counts[None] / reads if reads else 0.0,
+            'samples': [sample + (counts[n],) for n, sample in enumerate(samples)], 'unassigned_indices': unassigned_indices,
+            'max_mismatches': max_mismatches}
+
+# Text summary of a demultiplexing report
+def format_demultiplex_report(report):
+    lines = ['Sample_ID,Sample_Name,index,index2,reads,fraction']
+    for sample_id, sample_name, index, index2, reads in report['samples']:
+        lines.append(','.join([sample_id, sample_name, index, index2, str(reads), '%.4f' % (reads / report['reads'] if report['reads'] else 0.0)]))
+    lines.append(str(report['reads'])+' reads, '+str(report['unassigned'])+' unassigned (%.2f%%)' % (100 * report['unassigned_fraction']))
+    if report['unassigned_indices']:
+        lines.append('most frequent unassigned index pairs (closest barcodes):')
+    for index, index2, reads, i7_entry, i5_entry in report['unassigned_indices']:
+        lines.append('    '+index+(' + '+index2 if index2 else '')+': '+str(reads)+' reads; index: '+format_lookup_entry(i7_entry, report['max_mismatches'])+
+                     ('; index2: '+format_lookup_entry(i5_entry, report['max_mismatches']) if index2 else ''))
+    return '\n'.join(lines)
+
+# Incremental Sample Sheet updates:
+# Plates are added to, replaced in or removed from an existing IEM v4 Sample Sheet without writing it again in full.
+# Reading the Sample Sheet still costs O(rows): its Sample_ID, Sample_Name and index columns are taken from the [Data]
+# block with whole-block string operations (see data_column_values()) rather than a Python loop over rows, and the
+# rows of each i7 and i5 sequence are counted.  The index checks then cost O(changed rows): new rows continue the
+# Sample_ID numbering and are checked against the index pairs and Sample_Names kept with dictionary lookups, their
+# near-collisions are looked up among the neighbors of their i7 and i5 sequences (see near_sequences()), and color
+# balance is computed from the sequence counts less those of removed rows plus those of added rows.  The file is
+# rewritten from the first removed row onwards ([Header] through [Data] column names, and the rows before it, stay in
+# place); adding plates only appends rows.  Plates are identified by the Sample_Names of their samples
+# ('<plate name>-<i7 well>' or '<plate name>-<i7 well>-<i5 well>', see data_rows()).
+
+# Whether text is a well label as used in Sample_Names ('A01', 'AF48')
+def is_well_label(text):
+    return len(text) in (3, 4) and text[:-2].isalpha() and text[:-2].isupper() and text[-2:].isdigit()
+
+# Plate names a Sample_Name can belong to: the name without its trailing '-<well>', or '-<well>-<well>'
+def sample_plate_names(sample_name):
+    parts = sample_name.rsplit('-', 2)
+    if len(parts) < 2 or not is_well_label(parts[-1]):
+        return ()
+    if len(parts) == 3 and is_well_label(parts[1]):
+        return (sample_name[:-len(parts[-1]) - 1], parts[0])
+    return (sample_name[:-len(parts[-1]) - 1],)
+
+# Values of the named [Data] columns (those the Sample Sheet has) of its rows (numbers of the non-empty [Data] lines after
+# the column names line): {column name: [value of each row]}.  Rows on consecutive lines with one field per column and
+# no quotes are split into fields all at once, each column a slice of the fields; other rows are split one at a time
+# (quoted fields and trailing empty fields by sample_sheet_fields()).
+def data_column_values(lines, rows, column, names, first_line):
+    if rows and rows[-1] - rows[0] + 1 == len(rows):
+        row_lines = lines[rows[0]:rows[-1] + 1]
+        if set(map(str.count, row_lines, itertools.repeat(','))) == {len(column) - 1}:
+            text = '\n'.join(row_lines)
+            if '"' not in text:
+                fields = text.replace('\r', '').replace('\n', ',').split(',')
+                return {name: fields[column[name]::len(column)] for name in names if name in column}
+    fields = [lines[n].rstrip('\r').split(',') for n in rows]
+    for i, n in enumerate(rows):
+        if len(fields[i]) != len(column) or '"' in lines[n]:
+            fields[i] = sample_sheet_fields(lines[n].rstrip('\r'))
+            if len(fields[i]) != len(column):
+                raise ValueError('line '+str(first_line + n)+': expected '+str(len(column))+' columns, got '+str(len(fields[i])))
+    return {name: list(map(operator.itemgetter(column[name]), fields)) for name in names if name in column}
+
+# Update an IEM v4 Sample Sheet file: plates of input_list (plate lines, as for expand_input_list()) are added, replacing
+# plates of the same name, and plates named in remove are removed.  The Workflow is taken from the i5 indices if None;
+# index sequences of added plates (and of i5 indices, for the Workflow) are taken from barcode_kit (None for the default kit).
+# Raises ValueError (leaving the file unchanged) for index pairs or Sample_Names already in the Sample Sheet, or for plates
+# to remove that it does not have.  Returns a report dictionary: 'rows' (after the update), 'kept', 'removed', 'added'
+# (numbers of rows), 'first_sample_id' (of the added rows), 'plates_removed' (names of plates removed or replaced) and
+# 'warnings' (as index_warnings() gives: near-collisions of the added rows with each other and with the rows kept, and
+# color balance of the rows kept and added together, for chemistries).  Index pairs shared by added rows are conflicts.
+def update_sample_sheet(sheet_path, input_list=(), remove=(), workflow=None, plate=None, barcode_kit=None, chemistries=color_balance_chemistries):
+    with open(sheet_path, 'rb') as f:
+        data = f.read()
+    newline = b'\r\n' if data.split(b'\n', 1)[0].endswith(b'\r') else b'\n'
+    if data.startswith((b'[Data]', b'\xef\xbb\xbf[Data]')):
+        section = 0
+    else:
+        section = data.find(b'\n[Data]') + 1
+        if section == 0:
+            raise ValueError('no [Data] section (IEM v4 Sample Sheet expected)')
+    # [Data] lines, up to the next section or the end of the file
+    block_start = data.find(b'\n', section) + 1 or len(data)
+    block_end = data.find(b'\n[', block_start - 1) + 1 or len(data)
+    lines = data[block_start:block_end].decode('utf-8').split('\n')
+    is_ascii = data.isascii()
+
+    # byte offset of [Data] line n in the file
+    def offset(n):
+        return block_start + n + (sum(map(len, lines[:n])) if is_ascii else len(''.join(lines[:n]).encode('utf-8')))
+
+    first_line = data.count(b'\n', 0, block_start) + 1
+    rows = list(itertools.compress(range(len(lines)), map(str.strip, lines, itertools.repeat('\r\t ,'))))
+    if not rows:
+        raise ValueError('[Data] has no column names line')
+    columns_line = rows.pop(0)
+    column = {name: i for i, name in enumerate(sample_sheet_fields(lines[columns_line].rstrip('\r')))}
+    for name in ('Sample_ID', 'Sample_Name', 'index'):
+        if name not in column:
+            raise ValueError('line '+str(first_line + columns_line)+': [Data] has no '+name+' column')
+    if 'Lane' in column:
+        raise ValueError('line '+str(first_line + columns_line)+': Sample Sheets with a Lane column cannot be updated')
+    values = data_column_values(lines, rows, column, ('Sample_ID', 'Sample_Name', 'index', 'index2', 'I5_Index_ID'), first_line)
+    readstype = 'PE' if 'index2' in column else 'SE'
+    sample_ids = values['Sample_ID']
+    sample_names = values['Sample_Name']
+    i7_sequences = list(map(str.upper, values['index']))
+    i5_sequences = list(map(str.upper, values['index2'])) if readstype == 'PE' else [''] * len(rows)
+    index_pairs = list(zip(i7_sequences, i5_sequences))
+
+    if workflow is None:
+        workflow = 'A'
+        for i5_name, i5_sequence in zip(values.get('I5_Index_ID', ()), i5_sequences):
+            matches = [w for w in workflow_orientations if workflow_barcodes(w, barcode_kit)[1].get(i5_name) == i5_sequence]
+            if len(matches) == 1:
+                workflow = matches[0]
+                break
+    expanded = expand_input_list(input_list, readstype, plate) if input_list else []
+
+    # rows of plates to remove or replace (only Sample_Names starting with a plate name are looked at)
+    targets = set(remove) | {i[0] for i in expanded}
+    removed = set()
+    plates_found = set()
+    if targets:
+        prefixes = tuple(name + '-' for name in targets)
+        for i in itertools.compress(range(len(rows)), map(str.startswith, sample_names, itertools.repeat(prefixes))):
+            names = targets.intersection(sample_plate_names(sample_names[i]))
+            if names:
+                removed.add(i)
+                plates_found.update(names)
+    missing = [name for name in remove if name not in plates_found]
+    if missing:
+        raise ValueError('plate(s) '+', '.join("'"+i+"'" for i in missing)+' not in the Sample Sheet')
+
+    # new rows, checked against the index pairs and Sample_Names of the rows kept (those of removed rows are taken out
+    # of the Sample Sheet's, unless it repeats an index pair or Sample_Name)
+    first_sample_id = max(map(int, filter(str.isdigit, sample_ids)), default=len(rows)) + 1
+    added = list(data_rows(expanded, workflow, readstype, first_sample_id, barcode_kit))
+    added_pairs = [(row[3], row[5] if readstype == 'PE' else '') for row in added]
+    kept_pairs = dict(zip(index_pairs, sample_names))
+    kept_names = set(sample_names)
+    if removed and len(kept_pairs) == len(kept_names) == len(rows):
+        for i in removed:
+            del kept_pairs[index_pairs[i]]
+            kept_names.remove(sample_names[i])
+    elif removed:
+        kept_pairs = {index_pairs[i]: sample_names[i] for i in range(len(rows)) if i not in removed}
+        kept_names = {sample_names[i] for i in range(len(rows)) if i not in removed}
+    conflicts = []
+    added_samples = {}
+    for row, index_pair in zip(added, added_pairs):
+        if index_pair in kept_pairs:
+            conflicts.append(row[1]+' shares index pair '+'+'.join(i for i in index_pair if i)+' with '+kept_pairs[index_pair])
+        elif index_pair in added_samples:
+            conflicts.append(row[1]+' shares index pair '+'+'.join(i for i in index_pair if i)+' with '+added_samples[index_pair])
+        else:
+            added_samples[index_pair] = row[1]
+        if row[1] in kept_names:
+            conflicts.append("Sample_Name '"+row[1]+"' is already in the Sample Sheet")
+    if conflicts:
+        raise ValueError(str(len(conflicts))+' conflict(s) with the Sample Sheet, not updated\n  '+'\n  '.join(conflicts[:max_reported_errors]))
+    # near-collisions of the added rows, and color balance of the rows kept and added together, from the number of
+    # rows of each i7 and i5 sequence in the Sample Sheet, less those of removed rows, plus those of added rows
+    warnings = []
+    if added:
+        i7_counts = collections.Counter(i7_sequences)
+        i5_counts = collections.Counter(i5_sequences)
+        i7_counts.subtract(i7_sequences[i] for i in removed)
+        i5_counts.subtract(i5_sequences[i] for i in removed)
+        i7_counts.update(i[0] for i in added_pairs)
+        i5_counts.update(i[1] for i in added_pairs)
+        near_collisions = added_near_collisions(added_samples, kept_pairs, (i7_counts, i5_counts), readstype)
+        if near_collisions:
+            warnings.append('added rows: '+format_collision_report({'samples': len(added), 'index_pairs': len(added_samples),
+                                                                   'min_distance': min(i[4] for i in near_collisions),
+                                                                   'collisions': [], 'near_collisions': near_collisions}))
+        if chemistries:
+            reads = {'i7': +i7_counts, 'i5': +i5_counts} if readstype == 'PE' else {'i7': +i7_counts}
+            color_balance_report = index_color_balance(reads, len(rows) - len(removed) + len(added), chemistries)
+            if any(cycle['flags'] for cycles in color_balance_report['reads'].values() for cycle in cycles):
+                warnings.append('index color balance\n'+format_color_balance_report(color_balance_report))
+
+    # rewrite from the first removed row, or append after the last row (last_end: end of the last [Data] line)
+    last = rows[-1] if rows else columns_line
+    last_end = offset(last + 1) - 1
+    if removed:
+        first_removed = min(removed)
+        start = offset(rows[first_removed])
+        tail = [(lines[rows[i]] + '\n').encode('utf-8') for i in range(first_removed + 1, len(rows)) if i not in removed]
+    else:
+        start = last_end
+        tail = [b'\n' if last_end < len(data) else newline]
+    if added:
+        tail.append(iem_v4_lines(added, None).encode().replace(b'\n', newline))
+    tail.append(data[last_end + 1:])
+    with open(sheet_path, 'r+b') as f:
+        f.seek(start)
+        f.write(b''.join(tail))
+        f.truncate()
+    return {'rows': len(rows) - len(removed) + len(added), 'kept': len(rows) - len(removed), 'removed': len(removed),
+            'added': len(added), 'first_sample_id': first_sample_id, 'warnings': warnings, 'plates_removed': sorted(plates_found)}
+
+# Update a Sample Sheet from the command line (see update_sample_sheet()); returns 1 if it could not be updated, else 0
+def update(sheet_path, input_list, remove, workflow=None, plate=None, barcode_kit=None, chemistries=color_balance_chemistries):
+    try:
+        report = update_sample_sheet(sheet_path, input_list, remove, workflow, plate, barcode_kit, chemistries)
+    except (OSError, ValueError, IndexError) as e:
+        print(sheet_path+': ERROR: '+str(e), file = sys.stderr)
+        return 1
+    for warning in report['warnings']:
+        print(sheet_path+': WARNING: '+warning, file = sys.stderr)
+    print(sheet_path+': '+format_update_report(report))
+    return 0
+
+# Text summary of an update report (see update_sample_sheet()): rows added and removed, and rows after the update
+def format_update_report(report):
+    added = str(report['added'])+' rows added'
+    if report['added']:
+        added = added+' (Sample_IDs from '+str(report['first_sample_id'])+')'
+    removed = str(report['removed'])+' rows removed'
+    if report['plates_removed']:
+        removed = removed+' (plates '+', '.join(report['plates_removed'])+')'
+    return added+', '+removed+'; '+str(report['rows'])+' rows'
+
+# Batch operation (no prompts):
+# A manifest is a text file holding the same entries the interactive prompts collect, one 'field: value' per line,
+# followed by the [Data] input list after an 'input_list:' line (see SampleFiles/ExampleManifest.txt):
+#     workflow: A
+#     filename: SampleSheet.csv
+#     header: Dorothy Gale, Sequences
+#     reads: PE, 151, 151
+#     input_list:
+#     DG-1, 1-96, 1
+#     DG-2, 1-96, 9
+# Optional 'plate: 384' (96, 384 or 1536 wells) and 'well_order: column' (default 'row') set how index numbers map to wells.
+# Optional 'lanes: 4' assigns plates to 4 lanes (see shard_plates()), written as one Sample Sheet with a Lane column, or,
+# with 'lane_output: sheets', as one Sample Sheet per lane.
+# Optional 'format: v2' writes a BCL Convert (v2) Sample Sheet instead of IEM v4 ('v1'); 'format: v1, v2' writes both,
+# the second as '<name>_v2.csv' (see sample_sheet_formats).
+# Optional 'barcode_kit: NexteraXT_A' takes index sequences from a barcode kit other than the default (see Barcode kits).
+# Optional 'chemistry: 2-channel' checks index color balance for one chemistry only ('none': no check; default 'all').
+manifest_fields = ('workflow', 'filename', 'header', 'reads', 'plate', 'well_order', 'lanes', 'lane_output', 'format', 'barcode_kit', 'chemistry')
+
+# Read a manifest into a dictionary of its fields, input_list and the manifest line numbers of input_list (line_numbers)
+def read_manifest(manifest_path):
+    manifest = {'header': '', 'input_list': []}
+    with open(manifest_path) as f:
+        lines = enumerate(f, start=1)
+        for line_number, line in lines:
+            if line.strip() == '' or line.lstrip().startswith('#'):
+                continue
+            field, sep, value = line.partition(':')
+            field = field.strip()
+            if field == 'input_list':
+                entries = [(n, i.rstrip('\n')) for n, i in lines if i.strip() != '']
+                manifest['line_numbers'] = [n for n, i in entries]
+                manifest['input_list'] = [i for n, i in entries]
+            elif sep and field in manifest_fields:
+                manifest[field] = value.strip()
+            else:
+                raise ValueError("unrecognized manifest line '"+line.strip()+"'")
+    for field in ('workflow', 'reads'):
+        if field not in manifest:
+            raise ValueError("manifest is missing '"+field+":'")
+    if not manifest['input_list']:
+        raise ValueError("manifest has no input_list entries")
+    return manifest
+
+# Check expanded plates for index collisions (raising ValueError); returns a list of near-collision and color balance
+# warnings (empty if there are none), color balance for chemistries (none: no color balance check).  The checks are
+# timed in metrics, if given, which counts collisions found.
+def index_warnings(expanded, workflow, readstype, metrics=None, barcode_kit=None, chemistries=color_balance_chemistries):
+    warnings = []
+    with metrics_span(metrics, 'validate'):
+        records = SampleRecords(expanded)
+        collision_report = check_index_collisions(records, workflow, readstype, barcode_kit=barcode_kit)
+        color_balance_report = check_color_balance(records, workflow, readstype, chemistries, barcode_kit=barcode_kit) if chemistries else {'reads': {}}
+    if metrics is not None:
+        metrics.count('index_collisions', len(collision_report['collisions']))
+        metrics.count('index_near_collisions', len(collision_report['near_collisions']))
+    if collision_report['collisions']:
+        raise ValueError('index collisions, Sample Sheet not written\n'+format_collision_report(collision_report))
+    if collision_report['near_collisions']:
+        warnings.append(format_collision_report(collision_report))
+    if any(cycle['flags'] for cycles in color_balance_report['reads'].values() for cycle in cycles):
+        warnings.append('index color balance\n'+format_color_balance_report(color_balance_report))
+    return warnings
+
+# Check expanded plates for index collisions (raising ValueError) and print near-collision and color balance warnings
+def check_indices(expanded, workflow, readstype, source, metrics=None, barcode_kit=None, chemistries=color_balance_chemistries):
+    for warning in index_warnings(expanded, workflow, readstype, metrics, barcode_kit, chemistries):
+        print(source+': WARNING: '+warning, file = sys.stderr)
+
+# Sample Sheet entries of a manifest dictionary (see read_manifest()), checked and expanded: (workflow, InvestigatorName,
+# ProjectName, readstype, readsvalue, expanded plates, Sample Sheet formats, lane_plates (one list of plates per lane,
+# or None without 'lanes'), barcode kit name (None for the default kit)); expansion is timed in metrics, if given
+def manifest_entries(manifest, metrics=None):
+    workflow = manifest['workflow']
+    InvestigatorName, ProjectName = parse_header(manifest['header'])
+    readstype, readsvalue = parse_reads(manifest['reads'])
+    check_workflow(workflow, readstype)
+    barcode_kit = manifest.get('barcode_kit') or None
+    kit_files = load_barcode_kit(barcode_kit).files
+    for kit in ('i7', 'i5') if readstype == 'PE' else ('i7',):
+        if kit not in kit_files:
+            raise ValueError("barcode kit '"+barcode_kit+"' has no "+kit+" primer table")
+    wells = manifest.get('plate', '96')
+    if not wells.isdigit():
+        raise ValueError("plate should be a number of wells (96, 384 or 1536), got '"+wells+"'")
+    plate = plate_format(int(wells), manifest.get('well_order', 'row'))
+    expanded = expand_input_list(manifest['input_list'], readstype, plate, manifest.get('line_numbers'), metrics)
+    if metrics is not None:
+        metrics.count('plates', len(expanded))
+        metrics.count('samples', sum(len(i[1]) * (len(i[2]) if len(i) > 2 else 1) for i in expanded))
+    sheet_formats = [i.strip() for i in manifest.get('format', 'v1').split(',')]
+    for name in sheet_formats:
+        if name not in sample_sheet_formats:
+            raise ValueError("format should be one or more of "+', '.join(sample_sheet_formats)+", got '"+name+"'")
+    lane_plates = None
+    if 'lanes' in manifest:
+        if not manifest['lanes'].isdigit():
+            raise ValueError("lanes should be a number of lanes, got '"+manifest['lanes']+"'")
+        with metrics_span(metrics, 'expand'):
+            lane_plates = shard_plates(expanded, workflow, readstype, int(manifest['lanes']), barcode_kit)
+    return workflow, InvestigatorName, ProjectName, readstype, readsvalue, expanded, sheet_formats, lane_plates, barcode_kit
+
+# Count Sample Sheet files written, and their bytes (except for standard output), in metrics, if given
+def count_sheets_written(metrics, filepaths):
+    if metrics is not None:
+        for filepath in filepaths:
+            metrics.count('sheets_written')
+            if str(filepath) != '-':
+                metrics.count('bytes_written', os.path.getsize(filepath))
+
+# Generate the Sample Sheet(s) described by a manifest; a relative (or missing) filename is placed in output_dir
+# (by default, next to the manifest).  Returns the list of Sample Sheet paths written.  Stages are timed, and rows,
+# bytes and collisions counted, in metrics, if given (see Metrics).
+def run_manifest(manifest_path, output_dir=None, metrics=None):
+    from pathlib import Path
+    manifest_path = Path(manifest_path)
+    with metrics_span(metrics, 'parse'):
+        manifest = read_manifest(manifest_path)
+    workflow, InvestigatorName, ProjectName, readstype, readsvalue, expanded, sheet_formats, lane_plates, barcode_kit = manifest_entries(manifest, metrics)
+    chemistries = setting_chemistries(manifest.get('chemistry', 'all'))
+    filepath = Path(manifest.get('filename') or manifest_path.stem+'.csv')
+    if not filepath.is_absolute() and str(filepath) != '-':
+        filepath = Path(output_dir or manifest_path.parent) / filepath
+    if str(filepath) == '-' and len(sheet_formats) > 1:
+        raise ValueError("more than one format needs a filename (not '-')")
+
+    if lane_plates is not None:
+        lane_output = manifest.get('lane_output', 'column')
+        if lane_output not in ('column', 'sheets'):
+            raise ValueError("lane_output should be 'column' or 'sheets', got '"+lane_output+"'")
+        for lane, plates in enumerate(lane_plates, start=1):
+            if plates:
+                check_indices(plates, workflow, readstype, str(manifest_path)+' (lane '+str(lane)+')', metrics, barcode_kit, chemistries)
+        if lane_output == 'sheets':
+            if str(filepath) == '-':
+                raise ValueError("'lane_output: sheets' needs a filename (not '-')")
+            filepaths = write_lane_sample_sheets(filepath, workflow, InvestigatorName, ProjectName, readstype, readsvalue, lane_plates, sheet_formats=sheet_formats, metrics=metrics, barcode_kit=barcode_kit)
+            count_sheets_written(metrics, filepaths)
+            return filepaths
+    else:
+        check_indices(expanded, workflow, readstype, str(manifest_path), metrics, barcode_kit, chemistries)
+        lane_plates = [expanded]
+
+    outputs = format_filepaths(filepath, sheet_formats)
+    with contextlib.ExitStack() as stack:
+        with metrics_span(metrics, 'write'):
+            streams = [(name, stack.enter_context(open_sample_sheet(path, 'w'))) for name, path in outputs]
+        write_sample_sheets(streams, workflow, InvestigatorName, ProjectName, readstype, readsvalue, lane_plates, lane_column='lanes' in manifest, metrics=metrics, barcode_kit=barcode_kit)
+        # closing flushes the last of the text and moves the files into place
+        with metrics_span(metrics, 'write'):
+            stack.close()
+    filepaths = [path for name, path in outputs]
+    count_sheets_written(metrics, filepaths)
+    return filepaths
+
+# Generate a Sample Sheet for each manifest; returns the number of manifests that failed.  With metrics_path, stage
+# times and counters of all manifests are written to a metrics file (see Metrics.write()).  With profile (a profiler
+# kind, see Profiler), each manifest is profiled, its profile written next to its Sample Sheet (or manifest, if no
+# Sample Sheet file was written) and its profile_top hottest functions printed.
+def batch(manifest_paths, metrics_path=None, profile=None, profile_top=15):
+    metrics = Metrics() if metrics_path else None
+    failures = 0
+    for manifest_path in manifest_paths:
+        profiler = Profiler(profile) if profile else None
+        filepaths = None
+        try:
+            with profiling(profiler):
+                filepaths = run_manifest(manifest_path, metrics=metrics)
+        except (OSError, ValueError, IndexError) as e:
+            failures = failures + 1
+            print(str(manifest_path)+': ERROR: '+str(e), file = sys.stderr)
+        else:
+            # a Sample Sheet written to standard output keeps status messages out of the way
+            print(str(manifest_path)+' -> '+', '.join(str(i) for i in filepaths), file = sys.stderr if str(filepaths[0]) == '-' else sys.stdout)
+        if profiler is not None:
+            profile_path = profiler.dump(filepaths[0] if filepaths and str(filepaths[0]) != '-' else manifest_path)
+            print(str(manifest_path)+': profile ('+profiler.kind+') written to '+str(profile_path)+'; hottest functions:\n'+
+                  profiler.summary(profile_top), file = sys.stderr)
+    if metrics is not None:
+        metrics.count('manifests', len(manifest_paths))
+        metrics.count('manifests_failed', failures)
+        metrics.write(metrics_path)
+    return failures
+
+# Watch-folder operation:
+# Manifests dropped into a directory are turned into Sample Sheets by a pool of worker processes, each running
+# run_manifest() as for batch.  A manifest is picked up once its size and modification time are unchanged between two
+# scans (files still being copied in are left alone), and Sample Sheets are written atomically (see atomic_open()).
+# Each finished job is appended to a job-state file in the directory (one JSON object per line: 'manifest' name,
+# 'mtime_ns', 'size', 'status' ('done' or 'failed'), and 'outputs' or 'error'); a manifest is processed again only
+# if it changes, so a restarted watcher skips finished manifests and resumes with the others.
+watch_state_filename = '.SampleSheet_jobs.jsonl'
+
+# Read a job-state file into {manifest name: latest job record}; a line cut short (by a crash while it was written)
+# is ignored
+def read_watch_state(state_path):
+    import json
+    state = {}
+    try:
+        with open(state_path) as f:
+            for line in f:
+                try:
+                    job = json.loads(line)
+                except ValueError:
+                    continue
+                state[job['manifest']] = job
+    except FileNotFoundError:
+        pass
+    return state
+
+# Worker: generate the Sample Sheets of one manifest from (manifest path, output directory); returns (Sample Sheet
+# paths, None, metrics), or (None, error message, metrics) if the manifest failed, with metrics as Metrics.as_dict()
+def watch_job(job):
+    metrics = Metrics()
+    try:
+        return [str(i) for i in run_manifest(job[0], job[1], metrics)], None, metrics.as_dict()
+    except (OSError, ValueError, IndexError) as e:
+        return None, str(e), metrics.as_dict()
+
+# Worker initializer: interrupts (Ctrl-C) and termination are left to the watcher, which stops the pool
+def watch_worker_init():
+    import signal
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+# Watch a directory for manifests (file names matching pattern, scanned every interval seconds) and generate their
+# Sample Sheets in worker processes (default: one per CPU), into output_dir or next to each manifest.  Runs until
+# interrupted; with once, processes the manifests present and returns.  Returns the number of manifests that failed.
+# With metrics_path, stage times and counters of the jobs finished so far are written to a metrics file (see
+# Metrics.write()) after each job.
+def watch(directory, output_dir=None, workers=None, pattern='*.txt', interval=2.0, once=False, metrics_path=None):
+    import concurrent.futures
+    import fnmatch
+    import json
+    import signal
+    if not os.path.isdir(directory):
+        raise ValueError("'"+str(directory)+"' is not a directory")
+    state_path = os.path.join(directory, watch_state_filename)
+    # compact the job-state file to the latest record of each manifest still in the directory
+    state = {name: job for name, job in read_watch_state(state_path).items() if os.path.isfile(os.path.join(directory, name))}
+    with atomic_open(state_path) as f:
+        f.writelines(json.dumps(job) + '\n' for job in state.values())
+    state_file = open(state_path, 'a')
+    executor = concurrent.futures.ProcessPoolExecutor(max_workers=workers, initializer=watch_worker_init)
+    terminate_handler = signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    print('Watching '+str(directory)+' for '+pattern+' manifests', file = sys.stderr, flush = True)
+    seen = {}
+    running = {}
+    failures = 0
+    metrics = Metrics()
+    next_scan = time.monotonic()
+    try:
+        while True:
+            if time.monotonic() >= next_scan:
+                scanned = {}
+                with os.scandir(directory) as entries:
+                    for entry in entries:
+                        if fnmatch.fnmatch(entry.name, pattern) and not entry.name.startswith('.') and entry.is_file():
+                            stat = entry.stat()
+                            scanned[entry.name] = (stat.st_mtime_ns, stat.st_size)
+                busy = {name for name, signature in running.values()}
+                for name, signature in sorted(scanned.items()):
+                    job = state.get(name)
+                    if name in busy or (job and (job['mtime_ns'], job['size']) == signature):
+                        continue
+                    if once or seen.get(name) == signature:
+                        future = executor.submit(watch_job, (os.path.join(directory, name), output_dir))
+                        running[future] = (name, signature)
+                seen = scanned
+                next_scan = float('inf') if once else time.monotonic() + interval
+            if once and not running:
+                return failures
+            timeout = None if once else max(0, next_scan - time.monotonic())
+            if not running:
+                time.sleep(timeout)
+                continue
+            done, pending = concurrent.futures.wait(running, timeout=timeout, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                name, signature = running.pop(future)
+                filepaths, error, job_metrics = future.result()
+                job = {'manifest': name, 'mtime_ns': signature[0], 'size': signature[1]}
+                manifest_path = os.path.join(directory, name)
+                if error is None:
+                    job.update(status='done', outputs=filepaths)
+                    print(manifest_path+' -> '+', '.join(filepaths), flush = True)
+                else:
+                    failures = failures + 1
+                    job.update(status='failed', error=error)
+                    print(manifest_path+': ERROR: '+error, file = sys.stderr, flush = True)
+                state[name] = job
+                state_file.write(json.dumps(job) + '\n')
+                state_file.flush()
+                if metrics_path:
+                    metrics.merge(job_metrics)
+                    metrics.count('manifests')
+                    metrics.count('manifests_failed', error is not None)
+                    metrics.write(metrics_path)
+    except KeyboardInterrupt:
+        return failures
+    finally:
+        # unfinished jobs are not recorded, and run again when the watcher restarts
+        executor.shutdown(wait=True, cancel_futures=True)
+        state_file.close()
+        signal.signal(signal.SIGTERM, terminate_handler)
+
+# Sample Sheet service:
+# A local HTTP service that generates Sample Sheets from the entries a batch manifest holds, for programs (LIMS, web
+# forms) that would otherwise start a Python process per Sample Sheet.  Barcode tables and plateviews are loaded once at
+# startup and shared by all requests; requests are handled concurrently in threads, and optionally in several worker
+# processes sharing the listening socket.
+#   POST /sheet       JSON object of Sample Sheet entries (service_fields; input_list is a list of plate lines or a
+#                     string of lines, and numbers may be JSON numbers) -> JSON object with 'sheets' ({format: Sample
+#                     Sheet text}), 'columns' ([Data] column names), 'rows' ([Data] rows as lists of column values) and
+#                     'warnings' (near-collision and color balance warnings)
+#   POST /sheet.csv   same request -> Sample Sheet text (first format)
+#   GET /plateview/<kit>?orientation=&plate=&well_order=&style=   plateview (see render_plateview())
+#   GET /health       {"status": "ok"}
+# Errors are returned as status 400 (invalid entries) or 404 (unknown resource) with a JSON object {"error": message}.
+service_fields = ('workflow', 'header', 'reads', 'plate', 'well_order', 'lanes', 'format', 'barcode_kit', 'chemistry', 'input_list')
+plateview_content_types = {'text': 'text/plain; charset=utf-8', 'markdown': 'text/markdown; charset=utf-8', 'html': 'text/html; charset=utf-8'}
+
+# Manifest dictionary (see read_manifest()) from a service request object
+def service_manifest(fields):
+    if not isinstance(fields, dict):
+        raise ValueError('request should be a JSON object of Sample Sheet entries')
+    manifest = {'header': ''}
+    for field, value in fields.items():
+        if field not in service_fields:
+            raise ValueError("unrecognized field '"+field+"' (fields: "+', '.join(service_fields)+")")
+        if field == 'input_list':
+            lines = value.splitlines() if isinstance(value, str) else value
+            if not isinstance(lines, list) or not all(isinstance(i, str) for i in lines):
+                raise ValueError('input_list should be a list of plate lines')
+            manifest['input_list'] = [i for i in lines if i.strip() != '']
+        elif isinstance(value, (str, int)) and not isinstance(value, bool):
+            manifest[field] = str(value).strip()
+        else:
+            raise ValueError("'"+field+"' should be text")
+    for field in ('workflow', 'reads', 'input_list'):
+        if not manifest.get(field):
+            raise ValueError("request is missing '"+field+"'")
+    return manifest
+
+# Generate the Sample Sheets for a service request object; returns the response object (see above)
+def service_sheet(fields):
+    manifest = service_manifest(fields)
+    workflow, InvestigatorName, ProjectName, readstype, readsvalue, expanded, sheet_formats, lane_plates, barcode_kit = manifest_entries(manifest)
+    chemistries = setting_chemistries(manifest.get('chemistry', 'all'))
+    lane_column = lane_plates is not None
+    if lane_column:
+        warnings = []
+        for lane, plates in enumerate(lane_plates, start=1):
+            if plates:
+                warnings.extend('lane '+str(lane)+': '+i for i in index_warnings(plates, workflow, readstype, barcode_kit=barcode_kit, chemistries=chemistries))
+    else:
+        warnings = index_warnings(expanded, workflow, readstype, barcode_kit=barcode_kit, chemistries=chemistries)
+        lane_plates = [expanded]
+    streams = [(name, io.StringIO()) for name in sheet_formats]
+    write_sample_sheets(streams, workflow, InvestigatorName, ProjectName, readstype, readsvalue, lane_plates, lane_column=lane_column, barcode_kit=barcode_kit)
+    rows = []
+    for lane, plates in enumerate(lane_plates, start=1):
+        lane_value = [str(lane)] if lane_column else []
+        rows.extend(lane_value + row for row in data_rows(plates, workflow, readstype, len(rows) + 1, barcode_kit))
+    return {'sheets': {name: f.getvalue() for name, f in streams},
+            'columns': (['Lane'] if lane_column else []) + list(data_columns[readstype]),
+            'rows': rows,
+            'warnings': warnings}
+
+# Handle a service request: method ('GET' or 'POST'), path (with any query string) and body (bytes); returns
+# (HTTP status, content type, response body bytes)
+def service_response(method, path, body=b''):
+    import json
+    from urllib.parse import urlsplit, parse_qs
+    url = urlsplit(path)
+    try:
+        if method == 'POST' and url.path in ('/sheet', '/sheet.csv'):
+            try:
+                fields = json.loads(body)
+            except ValueError as e:
+                raise ValueError('request body is not JSON ('+str(e)+')')
+            response = service_sheet(fields)
+            if url.path == '/sheet.csv':
+                return 200, 'text/csv; charset=utf-8', next(iter(response['sheets'].values())).encode()
+            return 200, 'application/json', json.dumps(response).encode()
+        if method == 'GET' and url.path.startswith('/plateview/'):
+            kit = url.path[len('/plateview/'):]
+            query = {field: values[-1] for field, values in parse_qs(url.query).items()}
+            orientation = query.get('orientation', 'forward')
+            wells = query.get('plate', '96')
+            order = query.get('well_order', 'row')
+            style = query.get('style', 'text')
+            barcode_kit = query.get('barcode_kit') or default_barcode_kit
+            if kit not in barcode_table_files:
+                raise ValueError("kit should be one of "+', '.join(barcode_table_files)+", got '"+kit+"'")
+            if orientation not in ('forward', 'revcomp'):
+                raise ValueError("orientation should be 'forward' or 'revcomp', got '"+orientation+"'")
+            if not wells.isdigit():
+                raise ValueError("plate should be a number of wells (96, 384 or 1536), got '"+wells+"'")
+            if style not in plateview_styles:
+                raise ValueError("style should be one of "+', '.join(plateview_styles)+", got '"+style+"'")
+            plate = plate_format(int(wells), order)
+            return 200, plateview_content_types[style], render_plateview(kit, orientation, plate.wells, plate.order, style, barcode_kit).encode()
+        if method == 'GET' and url.path == '/health':
+            return 200, 'application/json', b'{"status": "ok"}'
+    except (ValueError, IndexError) as e:
+        return 400, 'application/json', json.dumps({'error': str(e)}).encode()
+    return 404, 'application/json', json.dumps({'error': 'no such resource: '+method+' '+url.path}).encode()
+
+# Run the Sample Sheet service on host:port (port 0 picks a free port) until interrupted.  workers > 1 forks worker
+# processes that share the listening socket (a single process where fork is unavailable).  Request logging to
+# standard error is turned off by quiet.
+def serve(host='127.0.0.1', port=8000, workers=1, quiet=False):
+    import http.server
+    import signal
+
+    class SampleSheetHandler(http.server.BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        # headers and body are sent separately; without TCP_NODELAY, delayed acknowledgements stall keep-alive clients
+        disable_nagle_algorithm = True
+
+        def do_GET(self):
+            self.respond(*service_response('GET', self.path))
+
+        def do_POST(self):
+            length = self.headers.get('Content-Length', '0')
+            if not length.isdigit():
+                self.respond(411, 'application/json', b'{"error": "Content-Length required"}')
+                return
+            self.respond(*service_response('POST', self.path, self.rfile.read(int(length))))
+
+        def respond(self, status, content_type, body):
+            self.send_response(status)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            if not quiet:
+                super().log_message(format, *args)
+
+    # Load barcode tables and render 96-well plateviews before serving (worker processes inherit them)
+    for kit in barcode_table_files:
+        for orientation in ('forward', 'revcomp'):
+            barcode_table(kit, orientation)
+            for style in plateview_styles:
+                render_plateview(kit, orientation, 96, 'row', style, default_barcode_kit)
+    server = http.server.ThreadingHTTPServer((host, port), SampleSheetHandler)
+    children = []
+    if hasattr(os, 'fork'):
+        for worker in range(workers - 1):
+            pid = os.fork()
+            if pid == 0:
+                try:
+                    server.serve_forever()
+                finally:
+                    os._exit(0)
+            children.append(pid)
+    print('Serving Sample Sheets on http://'+host+':'+str(server.server_address[1])+'/ ('+str(len(children) + 1)+' worker process'+('es' if children else '')+')', flush = True)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for pid in children:
+            os.kill(pid, signal.SIGTERM)
+            os.waitpid(pid, 0)
+        server.server_close()
+
+# Command line arguments; with no arguments, SampleSheet.py runs interactively
+def build_argument_parser():
+    import argparse
+    parser = argparse.ArgumentParser(description='Create an Illumina Sample Sheet. Run without arguments for interactive prompts.')
+    parser.add_argument('--profile', nargs='?', const='cprofile', choices=profile_kinds, help="interactive prompts: profile Sample Sheet generation with cProfile (default) or a sampling profiler, writing the profile next to the Sample Sheet")
+    parser.add_argument('--profile-top', type=int, default=15, metavar='N', help='number of hottest functions to print from a profile (default 15)')
+    parser.add_argument('--chemistry', choices=chemistry_settings, default='all', help='interactive prompts: '+chemistry_help)
+    subparsers = parser.add_subparsers(dest='command')
+    batch_parser = subparsers.add_parser('batch', help='generate Sample Sheets from manifest files, without prompts')
+    batch_parser.add_argument('manifests', nargs='+', help='manifest file(s) (see SampleFiles/ExampleManifest.txt)')
+    batch_parser.add_argument('--metrics', metavar='FILE', help="write stage times and counters to FILE: JSON for a '.json' name, Prometheus text otherwise")
+    batch_parser.add_argument('--profile', nargs='?', const='cprofile', choices=profile_kinds, help='profile each manifest with cProfile (default) or a sampling profiler, writing the profile next to its Sample Sheet')
+    batch_parser.add_argument('--profile-top', type=int, default=15, metavar='N', help='number of hottest functions to print from each profile (default 15)')
+    validate_parser = subparsers.add_parser('validate', help='check existing Sample Sheets against the barcode tables')
+    validate_parser.add_argument('sheets', nargs='+', help='Sample Sheet file(s)')
+    validate_parser.add_argument('--workflow', choices=('A', 'B'), help='Workflow orientation of the i5 indices (default: detect from the Sample Sheet)')
+    validate_parser.add_argument('--barcode-kit', help='barcode kit the Sample Sheet was written from (default: '+default_barcode_kit+')')
+    lookup_parser = subparsers.add_parser('lookup', help='find the barcodes (kit, orientation, well) closest to observed index sequences')
+    lookup_parser.add_argument('sequences', nargs='+', help='observed index sequence(s)')
+    lookup_parser.add_argument('--mismatches', type=int, choices=(0, 1, 2), default=2, help='maximum mismatches (default 2)')
+    lookup_parser.add_argument('--barcode-kit', help='barcode kit to search (default: '+default_barcode_kit+')')
+    demultiplex_parser = subparsers.add_parser('demultiplex', help='count index reads (FASTQ) per sample of a Sample Sheet')
+    demultiplex_parser.add_argument('sheet', help='Sample Sheet file')
+    demultiplex_parser.add_argument('fastq', nargs='+', help='I1 FASTQ file, and I2 FASTQ file for dual-index Sample Sheets (.gz or plain)')
+    demultiplex_parser.add_argument('--mismatches', type=int, choices=(0, 1), default=1, help='mismatches allowed per index read (default 1)')
+    demultiplex_parser.add_argument('--lane', type=int, help='Lane of the Sample Sheet to use (Sample Sheets with a Lane column)')
+    demultiplex_parser.add_argument('--workers', type=int, help='worker processes (default: number of CPUs)')
+    demultiplex_parser.add_argument('--barcode-kit', help='barcode kit to name unassigned index reads from (default: '+default_barcode_kit+')')
+    plateview_parser = subparsers.add_parser('plateview', help='show a barcode table laid out by plate wells')
+    plateview_parser.add_argument('kit', choices=('i7', 'i5'), help='barcode table')
+    plateview_parser.add_argument('--orientation', choices=('forward', 'revcomp'), default='forward', help='index sequences as in primers (forward, default) or reverse complemented')
+    plateview_parser.add_argument('--plate', type=int, choices=tuple(plate_dimensions), default=96, help='plate format (default 96 wells)')
+    plateview_parser.add_argument('--well-order', choices=('row', 'column'), default='row', help='wells numbered across rows (default) or down columns')
+    plateview_parser.add_argument('--style', choices=plateview_styles, default='text', help='console table (text, default), Markdown or HTML')
+    plateview_parser.add_argument('--barcode-kit', help='barcode kit (default: '+default_barcode_kit+')')
+    watch_parser = subparsers.add_parser('watch', help='generate Sample Sheets for manifests dropped into a directory')
+    watch_parser.add_argument('directory', help='directory to watch for manifests')
+    watch_parser.add_argument('--output-dir', help='directory for Sample Sheets with a relative filename (default: next to the manifest)')
+    watch_parser.add_argument('--pattern', default='*.txt', help="manifest file names (default '*.txt')")
+    watch_parser.add_argument('--workers', type=int, help='worker processes (default: number of CPUs)')
+    watch_parser.add_argument('--interval', type=float, default=2.0, help='seconds between directory scans (default 2)')
+    watch_parser.add_argument('--once', action='store_true', help='process the manifests present, then exit')
+    watch_parser.add_argument('--metrics', metavar='FILE', help="rewrite stage times and counters to FILE after each job: JSON for a '.json' name, Prometheus text otherwise")
+    update_parser = subparsers.add_parser('update', help='add, replace or remove plates in an existing Sample Sheet')
+    update_parser.add_argument('sheet', help='Sample Sheet file (IEM v4)')
+    update_parser.add_argument('plates', nargs='*', help="plate lines to add, e.g. 'DG-5, 1-96, 3' (plates of the same name in the Sample Sheet are replaced)")
+    update_parser.add_argument('--input-list', help="file of plate lines to add ('-' for standard input)")
+    update_parser.add_argument('--remove', nargs='+', default=[], metavar='PLATE', help='names of plates to remove')
+    update_parser.add_argument('--workflow', choices=('A', 'B'), help='Workflow orientation of the i5 indices (default: detect from the Sample Sheet)')
+    update_parser.add_argument('--plate', type=int, choices=tuple(plate_dimensions), default=96, help='plate format of the plate lines (default 96 wells)')
+    update_parser.add_argument('--well-order', choices=('row', 'column'), default='row', help='wells numbered across rows (default) or down columns')
+    update_parser.add_argument('--barcode-kit', help='barcode kit the Sample Sheet was written from (default: '+default_barcode_kit+')')
+    update_parser.add_argument('--chemistry', choices=chemistry_settings, default='all', help=chemistry_help)
+    serve_parser = subparsers.add_parser('serve', help='generate Sample Sheets for HTTP/JSON requests (local service)')
+    serve_parser.add_argument('--host', default='127.0.0.1', help='address to listen on (default 127.0.0.1, this computer only)')
+    serve_parser.add_argument('--port', type=int, default=8000, help='port to listen on (default 8000; 0 picks a free port)')
+    serve_parser.add_argument('--workers', type=int, default=1, help='worker processes (default 1)')
+    serve_parser.add_argument('--quiet', action='store_true', help='do not log requests to standard error')
+    return parser
+
+# Interactive operation: prompt for Sample Sheet inputs at the console, then create the Sample Sheet.  With profile (a
+# profiler kind, see Profiler), index expansion, checks and writing are profiled, the profile is written next to the
+# Sample Sheet and its profile_top hottest functions are printed with the processing time.  Index color balance is
+# checked for chemistries (none: no color balance check).
+def main(profile=None, profile_top=15, chemistries=color_balance_chemistries):
+    # Log start time (monotonic clock); stages of Sample Sheet generation are timed in metrics
+    from pathlib import Path
+    initialTime = time.perf_counter()
+    metrics = Metrics()
+    profiler = Profiler(profile) if profile else None
+
+    # Welcome/orient to script:
+    print("""
     ==============================================
     SampleSheet.py v1.0
     ==============================================
@@ -1028,7 +2628,7 @@ print("""
     This script accepts text to standard input, and returns a Sample Sheet file compatible with
     Illumina sequencing platforms.
     
-    Python3 is required for operation.  Installation of Python package "PrettyTable" is recommended.
+    Python3 is required for operation.
     
     For usage details, please refer to README file at GitHub location and to the following manuscript:
         Ehmsen, Knuesel, Martinez, Aridomi, Asahina, Yamamoto (2021)
@@ -1050,64 +2650,12 @@ print("""
     in 96-well "array" format.
     
     """)
-    
-input("    Press Enter to continue...")
-
-
-# Check for prettytable installation
-prettytable_loader = importlib.util.find_spec('prettytable')
-found = prettytable_loader is not None
-if found is True:
-    pass
-# Optional PrettyTable opt-out
-else:
-    optout = input("""    
-    ---------------------------------------------------------------------------------------------------
-    PrettyTable recommendation
-    ...for console PLATEVIEW: correspondence between barcode well ID ('A01'-'H12') and number ('1'-'96')
-    ---------------------------------------------------------------------------------------------------
-    SampleSheet.py uses the Python module PrettyTable to generate a console view of i7 and i5 barcode sequences,
-    arrayed in 96-well format and identified to well ID as '1'-'96'.
-    
-    SampleSheet.py requires entry of i7 and i5 identities in number format ('1'-'96') corrresponding to well ID,
-    making a console plateview potentially useful.
-        
-    PrettyTable is not found in your Python path.
-    
-    PrettyTable can be found at 'https://pypi.org/project/PrettyTable/', and installed to Python3 using
-    'python3 -m pip install prettytable'.
-    
-    Alternatively, PrettyTable can be installed in a Python virtual environment using the
-    SampleSheet_requirements.txt file available in the SampleSheet repository.  Guidelines for creating a
-    Python virtual environment for SampleSheet.py (with PrettyTable installed) can be found in the README.md
-    file in the SampleSheet GitHub repository (https://github.com/YamamotoLabUCSF/SampleSheet).
-        
-    Type 'Exit' to quit the script and make PrettyTable available to SampleSheet.py,
-    or type 'Pass' to proceed without PrettyTable:  """)
-    if optout in ('Exit', 'Pass'):
-        pass
-    else:
-        while optout not in ('Exit', 'Pass'):
-            optout = input("""
-    Type 'Exit' or 'Pass', or press Ctrl+C to quit:  """)
-    
-    if optout == 'Exit':
-        exit(0)
-    if optout == 'Pass':
-        print("""    
-    Okay, SampleSheet.py will proceed without displaying console view of i7 and i5 barcode sequences arrayed in 96-well
-    format and identified to well ID as '1-96'.
-    
-    Please note that SampleSheet.py requires entry of i7 and i5 identities in number format ('1'-'96') corrresponding
-    to well ID, making a console plateview potentially useful.
-    
-    As an alternative, a schematic of the console PLATEVIEW can be found in Ehmsen et al. 2021 (Supplemental Figure 6).
-    """)
-        input("    Press Enter to continue...")
 
-        
-# Specify Illumina Indexed Sequencing Workflow ('A' vs. 'B')
-workflow = input("""
+    input("    Press Enter to continue...")
+
+
+    # Specify Illumina Indexed Sequencing Workflow ('A' vs. 'B')
+    workflow = input("""
     ---------------------------------------------
     Illumina Indexed Sequencing Workflow (A or B)
     ---------------------------------------------
@@ -1145,15 +2693,14 @@ workflow = input("""
       
     Enter 'A' or 'B' to specify the Workflow, and therefore the index sequence orientations, appropriate for your Sample Sheet:  """)
 
-if workflow in ('A', 'B'):
-    pass
-else:
-    while workflow not in ('A', 'B'):
-        workflow = input("""
+    if workflow in ('A', 'B'):
+        pass
+    else:
+        while workflow not in ('A', 'B'):
+            workflow = input("""
     Type 'A' or 'B', or press Ctrl+C to quit:  """)
 
-# Display console PLATEVIEWs.
-if found is True:
+    # Display console PLATEVIEWs.
     if workflow == 'A':
         print("""
     WORKFLOW A.  A console view of 8-bp barcode sequences (indices) will now be displayed.
@@ -1170,7 +2717,7 @@ The displayed sequence is the reverse complement of the barcode sequence as it o
         input("    Press Enter to continue...")
 
         input("    Press Enter to display i5 plateview...")
-    
+
         print("""
 PLATEVIEW:  Barcode sequences, i5  (5'->3')
 
@@ -1195,7 +2742,7 @@ The displayed sequence is the reverse complement of the barcode sequence as it o
         input("    Press Enter to continue...")
 
         input("    Press Enter to display i5 plateview...")
-    
+
         print("""
 PLATEVIEW:  Barcode sequences, i5  (5'->3')
 
@@ -1203,17 +2750,17 @@ Please note, each 8-bp barcode sequence as displayed in this table is the sequen
 The displayed sequence is the reverse complement of the barcode sequence as it occurs in the i5 primer.
 """)
         i5_revcomp_plateview()
-        
-input("    Press Enter to continue...")
-    
-# Specify user inputs:
-# (1) Indicate where the output Sample Sheet file should go (future .csv filename and absolute path).
-print("""  
+
+    input("    Press Enter to continue...")
+
+    # Specify user inputs:
+    # (1) Indicate where the output Sample Sheet file should go (future .csv filename and absolute path).
+    print("""  
     ---------------------------------------------------------------------------
     Sample Sheet file name and location (absolute path to future .csv filename)
     ---------------------------------------------------------------------------""")
 
-filename = input(r"""
+    filename = input(r"""
     ***** Enter the name of the .csv file you'd like to create as your Sample Sheet, with an absolute path to its location.*****
 
     The .csv file should not exist yet -- it will be created as an output of this script.
@@ -1232,16 +2779,16 @@ filename = input(r"""
 
     -----> File name and path: """)
 
-# Wait to actually create the file until later in the script, in case there is a need to restart the script for a given file.
+    # Wait to actually create the file until later in the script, in case there is a need to restart the script for a given file.
 
 
-print("""  
+    print("""  
     -----------------------------------------------------------------
     Sample Sheet inputs: [Header], [Reads], and [Data] specifications
     -----------------------------------------------------------------""")
 
-# [Header] details: specify InvestigatorName & ProjectName
-header = input(r"""
+    # [Header] details: specify InvestigatorName & ProjectName
+    header = input(r"""
     ....................................................................
     ***** [Header] details: specify InvestigatorName & ProjectName *****
     
@@ -1257,15 +2804,10 @@ header = input(r"""
 
     -----> [Header] details. InvestigatorName & ProjectName: """)
 
-if type(header.split(',')) is list:
-    InvestigatorName = header.split(',')[0].strip()
-    ProjectName = header.split(',')[1].strip()
-else:
-    InvestigatorName = 'NA'
-    ProjectName = 'NA'
-    
-# [Reads] details: specify Single-End vs. Paired-End
-reads = input(r"""
+    InvestigatorName, ProjectName = parse_header(header)
+
+    # [Reads] details: specify Single-End vs. Paired-End
+    reads = input(r"""
     .............................................................................................................
     ***** [Reads] details: specify whether sequencing is Single-End or Paired-End, and the number of cycles *****
     
@@ -1284,43 +2826,43 @@ reads = input(r"""
 
     ----> [Reads] details: """)
 
-reads_verification = '0'
-while reads_verification == '0':
-    if reads.split(',')[0].strip() in ('SE', 'PE'):
-        readslist = [i.strip() for i in reads.split(',')]
-        if readslist[0] == 'SE':
-            if len(readslist) == 2:
-                readsvalue = readslist[1] 
-                readstype = readslist[0]
-                reads_verification = '1'
-            else:
-                reads = input("""
+    reads_verification = '0'
+    while reads_verification == '0':
+        if reads.split(',')[0].strip() in ('SE', 'PE'):
+            readslist = [i.strip() for i in reads.split(',')]
+            if readslist[0] == 'SE':
+                if len(readslist) == 2:
+                    readsvalue = readslist[1] 
+                    readstype = readslist[0]
+                    reads_verification = '1'
+                else:
+                    reads = input("""
     You indicated 'SE' run, but indicated an incommensurate value for # of reads (should be exactly one cycle # value);
     please correct your entry. Indicate only cycle # for insert read(s) (do not include index read cycles).
     Type 'PE' or 'SE' followed by appropriate cycle number(s), or press Ctrl+C to quit:  """)
-        elif readslist[0] == 'PE':
-            if len(readslist) == 3:
-                readsvalue = readslist[1]+'\n'+readslist[2]
-                readstype = readslist[0]
-                reads_verification = '1'
-            else:
-                reads = input("""
+            elif readslist[0] == 'PE':
+                if len(readslist) == 3:
+                    readsvalue = readslist[1]+'\n'+readslist[2]
+                    readstype = readslist[0]
+                    reads_verification = '1'
+                else:
+                    reads = input("""
     You indicated 'PE' run, but indicated an incommensurate value for # of reads (should be exactly two cycle # values);
     please correct your entry. Indicate only cycle # for insert read(s) (do not include index read cycles).
     Type 'PE' or 'SE' followed by appropriate cycle number(s), or press Ctrl+C to quit:  """)
-    else:
-        while reads.split(',')[0].strip() not in ('SE', 'PE'):
-            reads = input("""
+        else:
+            while reads.split(',')[0].strip() not in ('SE', 'PE'):
+                reads = input("""
     Type 'PE' or 'SE' followed by appropriate cycle numbers, or press Ctrl+C to quit:  """)
-        
-# Check for compatibility between SE/PE and Workflow A/B
-if readstype == 'PE':
-    pass
-elif readstype == 'SE':
-    if workflow == 'A':
+
+    # Check for compatibility between SE/PE and Workflow A/B
+    if readstype == 'PE':
         pass
-    elif workflow == 'B':
-        compatibility = input("""
+    elif readstype == 'SE':
+        if workflow == 'A':
+            pass
+        elif workflow == 'B':
+            compatibility = input("""
     ***** CAUTION: ***** 
     ***** Dual-indexed runs (using both i7 and i5 barcodes) may use Workflow A or B;
     single-indexed runs (using only i7 barcodes) must be specified as Workflow A. *****
@@ -1330,19 +2872,19 @@ elif readstype == 'SE':
     with Workflow A (i7 index is read on the same molecule as Read 1). 
     
     Please quit this script session and make appropriate corrections; type 'Exit' and press Enter or press Ctrl+C:  """)
-        if compatibility == 'Exit':
-            exit(0)
-        else:
-            input("""
+            if compatibility == 'Exit':
+                sys.exit(0)
+            else:
+                input("""
     ***** CAUTION: *****
     Workflow 'B' and 'SE' sequencing specifications are not compatible.
     You may now proceed temporarily in the script, but will encounter an error upon trying to populate
     non-existent i5 barcodes into Sample Sheet output file. Press Enter to continue...
     """)
 
-# [Data] details: specify list of plate names, i7 barcode range, and i5 barcode used for each plate.
-if readstype == 'PE':
-    print("""
+    # [Data] details: specify list of plate names, i7 barcode range, and i5 barcode used for each plate.
+    if readstype == 'PE':
+        print("""
     ....................................................................................
     ***** [Data] details: specify relationships between sample names and barcodes. ***** 
 
@@ -1356,10 +2898,15 @@ if readstype == 'PE':
         'i7 barcode' well ID.
             * 'Plate name' identifies a single 96-well plate identifier and must be unique.
                 * Any letter, digit, and punctuation characters are acceptable in names, excluding underscores ('_') which must *not* be used. 
+                * BCL Convert (v2) Sample Sheets allow only letters, digits, '-' and '_' in Sample_IDs; other characters are written as '-'.
             * 'i7 barcode' identifies an individual well (entry will be a numeric range, any # range up to '1-96')
             * 'i5 barcode' identifies all wells in a single plate (entry will be a single number, any # in '1' to '96'.)
+                * An i5 *range* (e.g., '1-4') instead combines every i7 barcode of the line with each i5 barcode in the range;
+                samples are then named by plate name, i7 well ID and i5 well ID (e.g., 'DG-1-A01-A02').
                 * For i7 and i5 barcode identifiers, use only the *range* (e.g., '1-96') or *number* (e.g., '1'-'96') that corresponds
                 to a given index. Refer to i5 and i7 96-well plate sequences (displayed earlier as console PLATEVIEWS), if needed.
+                * Ranges may also be well labels ('A05') or blocks of wells ('A01-D06', rows A-D of columns 1-6), and several
+                i7 ranges may be combined ('1-12,25-36'); combine i5 ranges with semicolons ('1-4;9-12').
         * Fields (plate name, i7 index range, i5 index) are comma-separated.
         * You may manually enter or paste up to 96 lines that specify sample name-barcode relationships.
         * If entering lines individually at the command line, press Enter at the end of each line to move on to the next line.
@@ -1379,8 +2926,8 @@ if readstype == 'PE':
 
     -----> [Data] details:  
     """)
-elif readstype == 'SE':
-    print("""
+    elif readstype == 'SE':
+        print("""
     ....................................................................................
     ***** [Data] details: specify relationships between sample names and barcode. ***** 
 
@@ -1394,9 +2941,12 @@ elif readstype == 'SE':
         'i7 barcode' well ID.
             * 'Plate name' identifies a single 96-well plate identifier and must be unique.
                 * Any letter, digit, and punctuation characters are acceptable in names, excluding underscores ('_') which must *not* be used. 
+                * BCL Convert (v2) Sample Sheets allow only letters, digits, '-' and '_' in Sample_IDs; other characters are written as '-'.
             * 'i7 barcode' identifies an individual well (entry will be a numeric range, any # range up to '1-96')
                 * For i7 barcode identifiers, use only the *range* (e.g., '1-96') or *number* (e.g., '1'-'96') that corresponds
                 to a given index. Refer to i7 96-well plate sequences (displayed earlier as console PLATEVIEW), if needed.
+                * Ranges may also be well labels ('A05') or blocks of wells ('A01-D06', rows A-D of columns 1-6), and several
+                ranges may be combined ('1-12,25-36').
         * Enter 'plate name, i7 index range'; fields (plate name, i7 index range) are comma-separated.
         * You may manually enter or paste up to 96 lines that specify sample name-barcode relationships.
         * If entering lines individually at the command line, press Enter at the end of each line to move on to the next line.
@@ -1416,219 +2966,151 @@ elif readstype == 'SE':
 
     -----> [Data] details:  
     """)
-    
-    
-input_list = []
 
-stopword = ""
-while True:
-    input_str = input()
-    if input_str.strip() == stopword:
-        break
-    else:
-        input_list.append(input_str)
 
-# Double-check whether entries look good:
-print("""
+    input_list = []
+
+    stopword = ""
+    while True:
+        input_str = input()
+        if input_str.strip() == stopword:
+            break
+        errors = parse_plate_lines([input_str], readstype)[1]
+        if errors:
+            for line_number, column, message in errors:
+                print('ERROR: column '+str(column)+': '+message)
+            print('Please re-enter this line.')
+        else:
+            input_list.append(input_str)
+
+    # Double-check whether entries look good:
+    print("""
 ---------------------------------------------------------------
 Preparation for output:
 Please double-check that your inputs were recorded as expected.
 ---------------------------------------------------------------""")
 
-print("""
+    print("""
 Your Workflow was recorded as:
 """)
-print(workflow)
+    print(workflow)
 
 
-print("""
+    print("""
 Your filepath and name were recorded as:
 """)
-print(filename)
+    print(filename)
 
 
-print("""
+    print("""
 Your [Header] InvestigatorName and ProjectName were recorded as:
 """)
-print("InvestigatorName,"+InvestigatorName+"\n"+"ProjectName,"+ProjectName)
+    print("InvestigatorName,"+InvestigatorName+"\n"+"ProjectName,"+ProjectName)
 
 
-print("""
+    print("""
 Your [Reads] were recorded as:
 """)
-print("[Reads]\n"+readsvalue)
+    print("[Reads]\n"+readsvalue)
 
 
-print("""
+    print("""
 Your [Data] input list was recorded as:
 """) 
-for input_str in input_list:
-    print(input_str)
+    for input_str in input_list:
+        print(input_str)
+
+    # Check that the expanded index pairs can be told apart
+    with profiling(profiler):
+        expanded = expand_input_list(input_list, readstype, metrics=metrics)
+        with metrics.span('validate'):
+            records = SampleRecords(expanded)
+            collision_report = check_index_collisions(records, workflow, readstype)
+    print("""
+Index collision check (i7+i5 index pairs):
+""")
+    print(format_collision_report(collision_report))
+    if collision_report['collisions'] or collision_report['near_collisions']:
+        print("""
+***** CAUTION: samples listed above share (or nearly share) index pairs and may not be separable by demultiplexing. *****""")
 
-check = input("""
+    # Check per-cycle color balance of the index reads
+    if chemistries:
+        with profiling(profiler), metrics.span('validate'):
+            color_balance_report = check_color_balance(records, workflow, readstype, chemistries)
+        print("""
+Index color balance check (per index cycle, """ + ' and '.join(chemistries) + """ chemistry):
+""")
+        print(format_color_balance_report(color_balance_report))
+        if any(cycle['flags'] for cycles in color_balance_report['reads'].values() for cycle in cycles):
+            print("""
+***** CAUTION: index cycles listed above lack signal (or nearly lack signal) in an imaging channel and may fail registration;
+consider adding samples with complementary indices to the pool (or choose your instrument's chemistry with --chemistry). *****""")
+
+    check = input("""
 Is this list accurately recorded? Type 'Y' or 'N': 
 """)
 
-if check == 'Y':
-    pass
-elif check == 'N':
-    checkup = input("""
+    if check == 'Y':
+        pass
+    elif check == 'N':
+        checkup = input("""
 If you have corrections to make, please quit the active script and start again.
 To continue in the script, type 'Continue' and press Enter.
 To quit the script, type 'Exit' and press Enter, or press 'Ctrl+C'.  """)
-    if checkup == 'Exit':
-        exit(0)
-    elif checkup == 'Continue':
-        pass
-
-# Log total user interaction time duration 
-interactionDuration = str(datetime.now() - initialTime).split(':')[0]+' hr|'+str(datetime.now() - initialTime).split(':')[1]+' min|'+str(datetime.now() - initialTime).split(':')[2].split('.')[0]+' sec|'+str(datetime.now() - initialTime).split(':')[2].split('.')[1]+' microsec'
-
-# Begin time clock
-startTime = datetime.now()
-    
-# Construct [Data] Section of Sample Sheet:
-
-# get plate names
-plate_names = [i.partition(',')[0].strip() for i in input_list]
-
-# get i7 indices
-if readstype == 'PE':
-    i7_indexrange = [i.partition(',')[-1].rpartition(',')[0].strip() for i in input_list]
-elif readstype == 'SE':
-    i7_indexrange = [i.partition(',')[2].strip() for i in input_list]  
-    
-# if there is interest in printing the list of i7 indices, activate this code:
-# if readstype == 'PE':
-#     for i in input_list:
-#        print(i.partition(',')[-1].rpartition(',')[0])
-# if readstype == 'SE':
-#     for i in input_list:
-#        print(i.partition(',')[2])
-
-if readstype == 'PE':
-# get i5 indices
-    i5_indexrange = [i.rpartition(',')[-1].strip() for i in input_list]
-
-# if there is interest in printing the list of i5 indices, activate this code:
-# for i in input_list:
-#    print(i.rpartition(',')[-1])
-
-# expand i7 index list.  Generates a list of lists containing tuples.
-i7_index_expansion = []
-for i in i7_indexrange:
-    i7_index_expansion.append(i7_well_IDs[int(i.partition('-')[0].strip())-1:int(i.rpartition('-')[-1].strip())])
-
-if readstype == 'PE':
-# expand i5 index list.  Generates a list of lists containing tuples.
-    i5_index_expansion = []
-    for i in i5_indexrange:
-        i5_index_expansion.append(i5_well_IDs[int(i.partition('-')[0].strip())-1:int(i.rpartition('-')[-1].strip())])
-
-# give each plate its own list of expanded i7 and i5 IDs
-expanded = []
-if readstype == 'PE':
-    for i in range(0, len(plate_names)):
-        expanded.append([plate_names[i], sorted(i[1] for i in i7_index_expansion[i]), sorted(i[1] for i in i5_index_expansion[i])])
-elif readstype == 'SE':
-    for i in range(0, len(plate_names)):
-        expanded.append([plate_names[i], sorted(i[1] for i in i7_index_expansion[i])])
-
-#for i in expanded:
-#    w = 0
-#    while w < len(i[1]):
-#        print(i[0] + "-" + well_ID_list[w][1], i[1][w], i7revcomp_Dict.get(i[1][w]), i[2][0], i5Dict.get(i[2][0]))
-#        w = w + 1
-
-# Create file object (f) in the target directory, with the filename initially entered at the start of the script:
-filepath = Path(filename)
-f = open(filepath, 'a')
-f.close()
-
-# Use print redirection to write to target file, in append mode (prepare entire Sample Sheet):
-with open(filepath, 'a') as f:
-    if readstype == 'PE':
-        print("""[Header]
-IEMFileVersion,4\n""" +
-"InvestigatorName," + InvestigatorName +
-"\nProjectName," + ProjectName +
-"\nDate," + (time.strftime("%m/%d/%Y")) + 
-"""\nWorkflow,GenerateFASTQ
-Application,FASTQ Only
-Assay,Nextera
-Description,Sequencing
-Chemistry,Amplicon
-
-[Reads]\n""" +
-readsvalue +
-"""\n\n[Settings]
-ReverseComplement,0
-Adapter,CTGTCTCTTATACACATCT
-
-[Data]
-Sample_ID,Sample_Name,I7_Index_ID,index,I5_Index_ID,index2""", file = f)
-    elif readstype == 'SE':
-         print("""[Header]
-IEMFileVersion,4\n""" +
-"InvestigatorName," + InvestigatorName +
-"\nProjectName," + ProjectName +
-"\nDate," + (time.strftime("%m/%d/%Y")) + 
-"""\nWorkflow,GenerateFASTQ
-Application,FASTQ Only
-Assay,Nextera
-Description,Sequencing
-Chemistry,Amplicon
-
-[Reads]\n""" +
-readsvalue +
-"""\n\n[Settings]
-ReverseComplement,0
-Adapter,CTGTCTCTTATACACATCT
-
-[Data]
-Sample_ID,Sample_Name,I7_Index_ID,index""", file = f)       
-        
-f.close()
-
-if workflow == 'A':
-    if readstype == 'PE':
-        with open(filename, 'a') as f:
-            count = 1
-            for i in expanded:
-                w = 0
-                while w < len(i[1]):
-                    print(str(count) + "," + i[0] + "-" + i[1][w].split('7',1)[1] + "," + i[1][w] + "," + i7revcomp_Dict.get(i[1][w]) + "," + i[2][0] + "," + i5Dict.get(i[2][0]), file = f)
-                    w = w + 1
-                    count = count + 1
-    elif readstype == 'SE':
-        with open(filename, 'a') as f:
-            count = 1
-            for i in expanded:
-                w = 0
-                while w < len(i[1]):
-                    print(str(count) + "," + i[0] + "-" + i[1][w].split('7',1)[1] + "," + i[1][w] + "," + i7revcomp_Dict.get(i[1][w]), file = f)
-                    w = w + 1
-                    count = count + 1
-elif workflow == 'B':
-    with open(filename, 'a') as f:
-        count = 1
-        for i in expanded:
-            w = 0
-            while w < len(i[1]):
-                print(str(count) + "," + i[0] + "-" + i[1][w].split('7',1)[1] + "," + i[1][w] + "," + i7revcomp_Dict.get(i[1][w]) + "," + i[2][0] + "," + i5revcomp_Dict.get(i[2][0]), file = f)
-                w = w + 1
-                count = count + 1                  
-
-f.close()
-
-
-# Log script processing time duration 
-processingDuration = str(datetime.now()- startTime).split(':')[0]+' hr|'+str(datetime.now() - startTime).split(':')[1]+' min|'+str(datetime.now() - startTime).split(':')[2].split('.')[0]+' sec|'+str(datetime.now() - startTime).split(':')[2].split('.')[1]+' microsec'
-
-# End of script operations
-print('\nUser input time: '+interactionDuration)
-print('\nSample Sheet processing time: '+processingDuration)
-print("""
+        if checkup == 'Exit':
+            sys.exit(0)
+        elif checkup == 'Continue':
+            pass
+
+    # An existing Sample Sheet at the filepath is updated (plates added, plates of the same name replaced) or replaced
+    filepath = Path(filename)
+    update_choice = 'R'
+    if filepath.is_file() and filepath.stat().st_size > 0:
+        update_choice = ''
+        while update_choice not in ('U', 'R'):
+            update_choice = input("""
+A file already exists at """ + filename + """
+To add these plates to its [Data] rows (Sample_IDs continue from its last Sample_ID, and plates of the same name
+are replaced), type 'U'.  To replace the file with a new Sample Sheet, type 'R':  """)
+
+    # Log total user interaction time duration; expansion and index checks ran between prompts, and are counted as
+    # processing (on the same monotonic clock, from their stage times) rather than as user input time
+    startTime = time.perf_counter()
+    checkSeconds = sum(metrics.seconds(stage) for stage in metrics.stages)
+    interactionDuration = format_duration(startTime - initialTime - checkSeconds)
+
+    # Create (or update) the Sample Sheet in the target directory, with the filename initially entered at the start of the script:
+    if update_choice == 'U':
+        try:
+            with profiling(profiler), metrics.span('update'):
+                update_report = update_sample_sheet(filepath, input_list, workflow=workflow, chemistries=chemistries)
+        except ValueError as e:
+            print('\nThe Sample Sheet at ' + filename + ' was not updated: ' + str(e))
+            sys.exit(1)
+        # near-collisions with the rows kept, and color balance of the updated Sample Sheet
+        for warning in update_report['warnings']:
+            print('\n***** WARNING: ' + warning)
+        print('\nThe Sample Sheet at ' + filename + ' was updated: ' + format_update_report(update_report))
+    else:
+        with profiling(profiler), contextlib.ExitStack() as stack:
+            with metrics.span('write'):
+                f = stack.enter_context(open_sample_sheet(filepath, 'w'))
+            write_sample_sheet(f, workflow, InvestigatorName, ProjectName, readstype, readsvalue, expanded, metrics=metrics)
+            with metrics.span('write'):
+                stack.close()
+
+    # Log script processing time duration 
+    processingDuration = format_duration(checkSeconds + time.perf_counter() - startTime)
+
+    # End of script operations
+    print('\nUser input time: '+interactionDuration)
+    print('\nSample Sheet processing time: '+processingDuration)
+    print('(stages: '+format_stage_times(metrics)+')')
+    if profiler is not None:
+        profile_path = profiler.dump(filepath if filename != '-' else 'SampleSheet')
+        print('\nProfile ('+profiler.kind+') written to '+str(profile_path)+'; hottest functions:\n'+profiler.summary(profile_top))
+    print("""
 ---------------------------------------------------------------------------------------------------
 Your Sample Sheet is complete.
 The file can be found at """ + filename + """ 
@@ -1640,6 +3122,65 @@ Please verify that the Sample Sheet contents describe your intended barcode assi
 
 """)
 
-sys.exit(0)
+if __name__ == '__main__':
+    args = build_argument_parser().parse_args()
+    if args.command == 'batch':
+        try:
+            failures = batch(args.manifests, args.metrics, args.profile, args.profile_top)
+        except OSError as e:
+            print('batch: ERROR: '+str(e), file = sys.stderr)
+            sys.exit(1)
+        sys.exit(1 if failures else 0)
+    if args.command == 'validate':
+        sys.exit(1 if validate(args.sheets, args.workflow, args.barcode_kit) else 0)
+    if args.command == 'lookup':
+        try:
+            lookup(args.sequences, args.mismatches, args.barcode_kit)
+        except (OSError, ValueError) as e:
+            print('lookup: ERROR: '+str(e), file = sys.stderr)
+            sys.exit(1)
+        sys.exit(0)
+    if args.command == 'plateview':
+        try:
+            plateview(args.kit, args.orientation, plate_format(args.plate, args.well_order), args.style, args.barcode_kit)
+        except ValueError as e:
+            print('plateview: ERROR: '+str(e), file = sys.stderr)
+            sys.exit(1)
+        sys.exit(0)
+    if args.command == 'demultiplex':
+        try:
+            report = demultiplex(args.sheet, args.fastq[0], args.fastq[1] if len(args.fastq) > 1 else None, args.mismatches, args.lane, args.workers,
+                                 barcode_kit=args.barcode_kit)
+        except (OSError, ValueError, EOFError) as e:
+            print(args.sheet+': ERROR: '+str(e), file = sys.stderr)
+            sys.exit(1)
+        print(format_demultiplex_report(report))
+        sys.exit(0)
+    if args.command == 'update':
+        input_list = list(args.plates)
+        if args.input_list:
+            try:
+                with contextlib.nullcontext(sys.stdin) if args.input_list == '-' else open(args.input_list) as f:
+                    input_list.extend(line.rstrip('\n') for line in f if line.strip() != '')
+            except OSError as e:
+                print(args.input_list+': ERROR: '+str(e), file = sys.stderr)
+                sys.exit(1)
+        sys.exit(update(args.sheet, input_list, args.remove, args.workflow, plate_format(args.plate, args.well_order), args.barcode_kit,
+                        setting_chemistries(args.chemistry)))
+    if args.command == 'watch':
+        try:
+            failures = watch(args.directory, args.output_dir, args.workers, args.pattern, args.interval, args.once, args.metrics)
+        except (OSError, ValueError) as e:
+            print(args.directory+': ERROR: '+str(e), file = sys.stderr)
+            sys.exit(1)
+        sys.exit(1 if failures else 0)
+    if args.command == 'serve':
+        try:
+            serve(args.host, args.port, args.workers, args.quiet)
+        except OSError as e:
+            print('serve: ERROR: '+str(e), file = sys.stderr)
+            sys.exit(1)
+        sys.exit(0)
+    main(args.profile, args.profile_top, setting_chemistries(args.chemistry))
 
 ############################################################################# end
@@ -0,0 +1,605 @@
+#!/usr/local/bin/anaconda3/bin/python3
+# Note: edit shebang line above as appropriate for your system
+# FILE: SampleSheet_benchmarks.py
+# DESC: Timing benchmarks for SampleSheet.py operations, using synthetic plate lists.
+# USAGE: python3 SampleSheet_benchmarks.py [--plates N] [--repeat N] [--output results.json]
+# REPO: https://github.com/YamamotoLabUCSF/SampleSheet
+
+#############################################################################
+# SCRIPT:
+
+# Import libraries, modules
+import argparse
+import contextlib
+import datetime
+import gzip
+import io
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import SampleSheet
+
+# Synthetic [Data] input list: one full 96-well plate per line, i5 index cycling through 1-96
+def synthetic_input_list(plates, readstype='PE'):
+    if readstype == 'PE':
+        return ['P' + str(n) + ', 1-96, ' + str(n % 96 + 1) for n in range(plates)]
+    return ['P' + str(n) + ', 1-96' for n in range(plates)]
+
+# Benchmark results, one dictionary per measurement, for the machine-readable results file
+results = []
+
+# Record (and print) one measurement: benchmark and case names, best time in seconds, and optionally a number of items
+# processed (count, in unit, e.g. 'rows'), from which a rate per second is reported; parameters of the case (params) are
+# recorded but not printed, and extra values are recorded and printed
+def record(benchmark, case, seconds, count=None, unit=None, params=None, **values):
+    result = {'benchmark': benchmark, 'case': case, 'seconds': seconds}
+    result.update(params or {})
+    line = '%-10s%-32s' % (benchmark, case)
+    if count is not None:
+        result.update({'count': count, 'unit': unit, 'per_second': count / seconds if seconds else None})
+        line = line + ' %9d %-5s %10.4f s  %12.0f %s/s' % (count, unit, seconds, count / seconds if seconds else 0, unit)
+    else:
+        line = line + ' %16s %10.4f s' % ('', seconds)
+    result.update(values)
+    if values:
+        line = line + '  (' + ', '.join(str(k) + ' ' + str(v) for k, v in values.items()) + ')'
+    results.append(result)
+    print(line)
+    return result
+
+# Best (minimum) wall-clock time of repeated calls to func, in seconds
+def best_time(func, repeat):
+    times = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+# Sample Sheet writer as originally implemented in SampleSheet.py v1.0 (file opened three times, one print() per row);
+# kept here as the baseline for writer benchmarks
+def original_write_sample_sheet(filepath, workflow, InvestigatorName, ProjectName, readstype, readsvalue, expanded):
+    f = open(filepath, 'a')
+    f.close()
+    with open(filepath, 'a') as f:
+        print(SampleSheet.sample_sheet_header(InvestigatorName, ProjectName, readstype, readsvalue).rstrip('\n'), file = f)
+    f.close()
+    with open(filepath, 'a') as f:
+        count = 1
+        for i in expanded:
+            w = 0
+            while w < len(i[1]):
+                if workflow == 'A':
+                    print(str(count) + "," + i[0] + "-" + i[1][w].split('7',1)[1] + "," + i[1][w] + "," + SampleSheet.i7revcomp_Dict.get(i[1][w]) + "," + i[2][0] + "," + SampleSheet.i5Dict.get(i[2][0]), file = f)
+                else:
+                    print(str(count) + "," + i[0] + "-" + i[1][w].split('7',1)[1] + "," + i[1][w] + "," + SampleSheet.i7revcomp_Dict.get(i[1][w]) + "," + i[2][0] + "," + SampleSheet.i5revcomp_Dict.get(i[2][0]), file = f)
+                w = w + 1
+                count = count + 1
+    f.close()
+
+# Writer throughput (rows/second): original print()-per-row writer vs. streaming single-open writer
+def bench_writer(plates, repeat):
+    expanded = SampleSheet.expand_input_list(synthetic_input_list(plates), 'PE')
+    rows = sum(len(i[1]) for i in expanded)
+    rates = {}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        filepath = os.path.join(tmpdir, 'SampleSheet.csv')
+
+        def original():
+            if os.path.exists(filepath):
+                os.remove(filepath)
+            original_write_sample_sheet(filepath, 'A', 'NA', 'NA', 'PE', '151\n151', expanded)
+
+        def streaming():
+            with SampleSheet.open_sample_sheet(filepath, 'w') as f:
+                SampleSheet.write_sample_sheet(f, 'A', 'NA', 'NA', 'PE', '151\n151', expanded)
+
+        for name, func in (('original', original), ('streaming', streaming)):
+            rates[name] = record('writer', name, best_time(func, repeat), rows, 'rows')['per_second']
+    print('writer    speedup                         %.2fx' % (rates['streaming'] / rates['original']))
+    return rates
+
+# Startup: 'import SampleSheet' time as reported by 'python -X importtime' (cumulative microseconds, bytecode cached;
+# best of repeat runs, each in a fresh interpreter) and wall-clock time of 'SampleSheet.py --help'.  Modules that
+# SampleSheet.py imports only where first used (deferred_imports) must not be loaded by the import itself.  Returns
+# True if the import time is within budget_ms and no deferred module was loaded.
+deferred_imports = ('concurrent.futures', 'gzip', 'csv', 'hashlib', 'argparse', 'datetime', 'pathlib', 'prettytable', 'cProfile', 'pstats')
+
+def bench_startup(repeat, budget_ms):
+    script_dir = os.path.dirname(os.path.abspath(SampleSheet.__file__))
+    env = dict(os.environ, PYTHONPATH=script_dir)
+    env.pop('PYTHONDONTWRITEBYTECODE', None)
+    check = 'import sys, SampleSheet; print(",".join(m for m in %r if m in sys.modules))' % (deferred_imports,)
+    loaded = subprocess.run([sys.executable, '-c', check], env=env, capture_output=True, text=True, check=True).stdout.strip()
+    import_times = []
+    for i in range(repeat):
+        stderr = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import SampleSheet'], env=env, capture_output=True, text=True, check=True).stderr
+        import_times.append(min(int(line.split('|')[1]) for line in stderr.splitlines() if line.rstrip().endswith('| SampleSheet')) / 1e6)
+    seconds = min(import_times)
+    record('startup', 'import SampleSheet', seconds, budget_seconds=budget_ms / 1000, deferred_loaded=loaded or 'none')
+    command = [sys.executable, os.path.join(script_dir, 'SampleSheet.py'), '--help']
+    record('startup', 'SampleSheet.py --help', best_time(lambda: subprocess.run(command, env=env, capture_output=True, check=True), repeat))
+    within_budget = seconds * 1000 <= budget_ms and not loaded
+    if not within_budget:
+        print('startup   OVER BUDGET: import %.1f ms (budget %.1f ms)%s' % (seconds * 1000, budget_ms, '; loaded ' + loaded if loaded else ''))
+    return within_budget
+
+# Sample Sheet generation for synthetic plate lists of 1, 100 and 10,000 plates, for SE (Workflow A) and PE (Workflows
+# A and B) runs.  For each case: expansion of the input list, writing the Sample Sheet, index checks (collisions and
+# color balance) and validation of the written Sample Sheet file.  Cases of more than 100,000 rows are timed once.
+sheet_cases = (('SE', 'A'), ('PE', 'A'), ('PE', 'B'))
+
+def bench_sheets(repeat, plate_counts=(1, 100, 10000)):
+    times = {}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        filepath = os.path.join(tmpdir, 'SampleSheet.csv')
+        readsvalue = {'SE': '151', 'PE': '151\n151'}
+        for plates in plate_counts:
+            for readstype, workflow in sheet_cases:
+                input_list = synthetic_input_list(plates, readstype)
+                expanded = SampleSheet.expand_input_list(input_list, readstype)
+                rows = sum(len(i[1]) * len(i[2]) if readstype == 'PE' else len(i[1]) for i in expanded)
+                case = str(plates) + ' ' + readstype + ' ' + workflow
+                n = repeat if rows <= 100000 else 1
+
+                def write():
+                    with SampleSheet.open_sample_sheet(filepath, 'w') as f:
+                        SampleSheet.write_sample_sheet(f, workflow, 'NA', 'NA', readstype, readsvalue[readstype], expanded)
+
+                def checks():
+                    SampleSheet.hamming_matrix.cache_clear()
+                    records = SampleSheet.SampleRecords(expanded)
+                    SampleSheet.check_index_collisions(records, workflow, readstype)
+                    SampleSheet.check_color_balance(records, workflow, readstype)
+
+                for stage, func in (('expand', lambda: SampleSheet.expand_input_list(input_list, readstype)), ('write', write),
+                                    ('check', checks), ('validate', lambda: SampleSheet.validate_sample_sheet(filepath))):
+                    times[(case, stage)] = record('sheet', case + ' ' + stage, best_time(func, n), rows, 'rows',
+                                                  params={'plates': plates, 'readstype': readstype, 'workflow': workflow, 'stage': stage})['seconds']
+    return times
+
+# Plateview rendering time for each barcode table and style, on 96- and 384-well plates: first rendering (cache
+# cleared) and cached
+def bench_plateview(repeat):
+    times = {}
+    for wells in (96, 384):
+        for style in SampleSheet.plateview_styles:
+            for kit, orientation in (('i7', 'forward'), ('i7', 'revcomp'), ('i5', 'forward'), ('i5', 'revcomp')):
+                case = kit + ' ' + orientation + ' ' + str(wells) + ' ' + style
+
+                def render():
+                    SampleSheet.render_plateview.cache_clear()
+                    SampleSheet.render_plateview(kit, orientation, wells, 'row', style)
+
+                params = {'kit': kit, 'orientation': orientation, 'wells': wells, 'style': style}
+                times[case] = record('plateview', case, best_time(render, repeat), params=params)['seconds']
+                times[case + ' cached'] = record('plateview', case + ' cached', best_time(lambda: SampleSheet.render_plateview(kit, orientation, wells, 'row', style), repeat),
+                                                 params=dict(params, cached=True))['seconds']
+    return times
+
+# Writing IEM v4 ('v1') and BCL Convert ('v2') Sample Sheets for ~10,000 samples: two separate passes (one per format)
+# vs. both formats from one pass over the data rows
+def bench_formats(repeat, plates=105):
+    expanded = SampleSheet.expand_input_list(synthetic_input_list(plates), 'PE')
+    rows = sum(len(i[1]) for i in expanded)
+
+    def separate():
+        for name in ('v1', 'v2'):
+            SampleSheet.write_sample_sheet(io.StringIO(), 'A', 'NA', 'NA', 'PE', '151\n151', expanded, sheet_format=name)
+
+    def one_pass():
+        SampleSheet.write_sample_sheets([('v1', io.StringIO()), ('v2', io.StringIO())], 'A', 'NA', 'NA', 'PE', '151\n151', [expanded])
+
+    return {name: record('formats', name, best_time(func, repeat), rows, 'rows')['seconds']
+            for name, func in (('separate', separate), ('one-pass', one_pass))}
+
+# Validation throughput (rows/second) of an existing Sample Sheet of about 100,000 rows (11 lanes of 96 plates, so that
+# index pairs are unique within each lane)
+def bench_validate(repeat, lanes=11):
+    expanded = SampleSheet.expand_input_list(synthetic_input_list(96), 'PE')
+    with tempfile.TemporaryDirectory() as tmpdir:
+        filepath = os.path.join(tmpdir, 'SampleSheet.csv')
+        with SampleSheet.open_sample_sheet(filepath, 'w') as f:
+            rows = SampleSheet.write_lane_sample_sheet(f, 'A', 'NA', 'NA', 'PE', '151\n151', [expanded] * lanes)
+        seconds = best_time(lambda: SampleSheet.validate_sample_sheet(filepath), repeat)
+    return record('validate', str(lanes) + ' lanes', seconds, rows, 'rows')['seconds']
+
+# Random DNA sequences (fixed seed, so runs are comparable)
+def random_sequences(count, length, seed=0):
+    rng = random.Random(seed)
+    return [''.join(rng.choice('ACGT') for i in range(length)) for n in range(count)]
+
+# Reverse-complement throughput (sequences/second) for a whole barcode set: per-base dictionary lookups,
+# per-string str.translate(), and the one-pass reverse_complement_all() engine
+def bench_reverse_complement(sequences, repeat, length=10):
+    seqs = random_sequences(sequences, length)
+    complement = {'A': 'T', 'C': 'G', 'G': 'C', 'T': 'A'}
+
+    def per_base_dict():
+        return [''.join(complement[b] for b in reversed(seq)) for seq in seqs]
+
+    def per_string():
+        return [SampleSheet.reverse_complement(seq) for seq in seqs]
+
+    def whole_set():
+        return SampleSheet.reverse_complement_all(seqs)
+
+    return {name: record('revcomp', name, best_time(func, repeat), sequences, 'seqs')['per_second']
+            for name, func in (('per-base', per_base_dict), ('per-string', per_string), ('whole-set', whole_set))}
+
+# Barcode lookup: time to build the 2-mismatch lookup table, and lookups/second for observed index sequences (barcodes
+# with 0-2 random substitutions, and random 8-mers)
+def bench_lookup(lookups, repeat):
+    start = time.perf_counter()
+    SampleSheet.barcode_index.cache_clear()
+    index = SampleSheet.barcode_index(2)
+    record('lookup', 'build', time.perf_counter() - start, keys=len(index))
+    rng = random.Random(0)
+    barcodes = [sequence for table in SampleSheet.barcode_tables().values() for sequence in table.values()]
+    observed = []
+    for n in range(lookups):
+        sequence = list(rng.choice(barcodes))
+        for p in rng.sample(range(len(sequence)), n % 4):
+            sequence[p] = rng.choice('ACGTN')
+        observed.append(''.join(sequence))
+    seconds = best_time(lambda: list(map(index.get, observed)), repeat)
+    found = sum(1 for i in map(index.get, observed) if i is not None)
+    return record('lookup', 'get', seconds, lookups, 'seqs', found=found)['per_second']
+
+# Synthetic gzipped I1/I2 FASTQ files of index reads for Sample Sheet samples ([(Sample_ID, Sample_Name, index, index2)]):
+# reads are drawn evenly from the samples' index pairs, with substitution_rate errors per base, and a fraction of
+# reads from random sequences (unassigned); I2 is not written for single-index samples
+def write_synthetic_fastq(samples, i1_path, i2_path, reads, substitution_rate=0.005, random_fraction=0.02, seed=0):
+    rng = random.Random(seed)
+
+    def observed(sequence):
+        if rng.random() < random_fraction:
+            return ''.join(rng.choice('ACGT') for i in sequence)
+        if rng.random() < substitution_rate * len(sequence):
+            p = rng.randrange(len(sequence))
+            sequence = sequence[:p] + rng.choice('ACGTN'.replace(sequence[p], '')) + sequence[p + 1:]
+        return sequence
+
+    dual = bool(samples[0][3])
+    with gzip.open(i1_path, 'wt', compresslevel=1) as i1, (gzip.open(i2_path, 'wt', compresslevel=1) if dual else io.StringIO()) as i2:
+        for n in range(reads):
+            sample = samples[n % len(samples)]
+            i1.write('@r' + str(n) + ' 1:N:0\n' + observed(sample[2]) + '\n+\n' + 'F' * len(sample[2]) + '\n')
+            if dual:
+                i2.write('@r' + str(n) + ' 2:N:0\n' + observed(sample[3]) + '\n+\n' + 'F' * len(sample[3]) + '\n')
+
+# Worker process counts for parallel benchmarks: 1 and one per CPU.  On a single-CPU machine 2 workers are run anyway,
+# so that every run reports a parallel case; such cases are labelled (and recorded as) oversubscribed.
+def worker_counts():
+    return sorted({1, max(2, os.cpu_count() or 1)})
+
+# Case label for a number of workers ('1 worker', '4 workers', '2 workers (oversubscribed, 1 CPU)')
+def workers_label(workers):
+    label = str(workers) + ' worker' + ('s' if workers > 1 else '')
+    cpus = os.cpu_count() or 1
+    return label + ' (oversubscribed, ' + str(cpus) + ' CPU' + ('s' if cpus > 1 else '') + ')' if workers > cpus else label
+
+# Demultiplexing throughput (reads/minute) of synthetic index reads for a 96-plate Sample Sheet, with 1 and all workers
+# (see worker_counts())
+def bench_demultiplex(reads):
+    expanded = SampleSheet.expand_input_list(synthetic_input_list(96), 'PE')
+    with tempfile.TemporaryDirectory() as tmpdir:
+        sheet_path = os.path.join(tmpdir, 'SampleSheet.csv')
+        with SampleSheet.open_sample_sheet(sheet_path, 'w') as f:
+            SampleSheet.write_sample_sheet(f, 'A', 'NA', 'NA', 'PE', '151\n151', expanded)
+        i1_path = os.path.join(tmpdir, 'I1.fastq.gz')
+        i2_path = os.path.join(tmpdir, 'I2.fastq.gz')
+        write_synthetic_fastq(SampleSheet.sample_sheet_samples(sheet_path), i1_path, i2_path, reads)
+        rates = {}
+        for workers in worker_counts():
+            start = time.perf_counter()
+            report = SampleSheet.demultiplex(sheet_path, i1_path, i2_path, workers=workers)
+            seconds = time.perf_counter() - start
+            rates[workers] = record('demux', workers_label(workers), seconds, reads, 'reads',
+                                    params={'workers': workers, 'oversubscribed': workers > (os.cpu_count() or 1)},
+                                    reads_per_minute=round(reads / seconds * 60), unassigned_fraction=round(report['unassigned_fraction'], 4))['reads_per_minute']
+    return rates
+
+# Index collision check time for 96 full plates (96 i7 x 96 i5 = 9,216 index pairs), computing the Hamming distance
+# tables of the i7 and i5 sequences ('96x96') and with the tables cached from an earlier check ('96x96 cached')
+def bench_collisions(repeat):
+    expanded = SampleSheet.expand_input_list(synthetic_input_list(96), 'PE')
+
+    def check():
+        SampleSheet.hamming_matrix.cache_clear()
+        return SampleSheet.check_index_collisions(expanded, 'A', 'PE')
+
+    seconds = record('collide', '96x96', best_time(check, repeat), 9216, 'pairs')['seconds']
+    record('collide', '96x96 cached', best_time(lambda: SampleSheet.check_index_collisions(expanded, 'A', 'PE'), repeat), 9216, 'pairs')
+    return seconds
+
+# Combinatorial expansion (96 i7 x 96 i5 per line) + writing, for 1, 4 and 16 lines: time should grow linearly with rows
+def bench_combinatorial(repeat):
+    times = {}
+    for lines in (1, 4, 16):
+        input_list = ['M' + str(n) + ', 1-96, 1-96' for n in range(lines)]
+
+        def generate():
+            expanded = SampleSheet.expand_input_list(input_list, 'PE')
+            return SampleSheet.write_sample_sheet(io.StringIO(), 'A', 'NA', 'NA', 'PE', '151\n151', expanded)
+
+        rows = generate()
+        times[rows] = record('combine', str(lines) + 'x96x96', best_time(generate, repeat), rows, 'rows')['seconds']
+    return times
+
+# Incremental updates of a 9,120-row PE Sample Sheet (95 full plates, i5 indices 1-95): adding one plate (i5 index 96),
+# replacing the last plate and removing the first plate with update_sample_sheet(), against generating the whole
+# Sample Sheet again as batch does (expansion, index checks and writing)
+def bench_update(repeat, plates=95):
+    input_list = synthetic_input_list(plates)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        sheet_path = os.path.join(tmpdir, 'SampleSheet.csv')
+
+        def write():
+            expanded = SampleSheet.expand_input_list(input_list, 'PE')
+            SampleSheet.index_warnings(expanded, 'A', 'PE')
+            with SampleSheet.open_sample_sheet(sheet_path, 'w') as f:
+                return SampleSheet.write_sample_sheet(f, 'A', 'NA', 'NA', 'PE', '151\n151', expanded)
+
+        rows = write()
+        times = {'regenerate': record('update', 'regenerate ' + str(rows) + ' rows', best_time(write, repeat), rows, 'rows')['seconds']}
+        cases = (('add 1 plate', ['NEW, 1-96, 96'], ()), ('replace last plate', [input_list[-1]], ()), ('remove first plate', [], ('P0',)))
+        for case, lines, remove in cases:
+            seconds = []
+            for i in range(repeat):
+                write()
+                start = time.perf_counter()
+                report = SampleSheet.update_sample_sheet(sheet_path, lines, remove, 'A')
+                seconds.append(time.perf_counter() - start)
+            times[case] = record('update', case, min(seconds), report['added'] + report['removed'], 'rows')['seconds']
+    return times
+
+# Watch-folder throughput: manifests (10 full 96-well PE plates each) processed by SampleSheet.watch(once=True) with 1
+# worker process and with one per CPU (see worker_counts()), from a fresh directory each time
+def bench_watch(manifests):
+    rates = {}
+    for workers in worker_counts():
+        with tempfile.TemporaryDirectory() as tmpdir:
+            for n in range(manifests):
+                with open(os.path.join(tmpdir, 'plates' + str(n) + '.txt'), 'w') as f:
+                    f.write('workflow: A\nheader: NA, NA\nreads: PE, 151, 151\ninput_list:\n' + '\n'.join(synthetic_input_list(10)) + '\n')
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+                failures = SampleSheet.watch(tmpdir, workers=workers, once=True)
+            seconds = time.perf_counter() - start
+            rates[workers] = record('watch', workers_label(workers), seconds, manifests, 'sheets',
+                                    params={'workers': workers, 'oversubscribed': workers > (os.cpu_count() or 1)}, failures=failures)['per_second']
+    return rates
+
+# Sample Sheet service load test: a service (SampleSheet.py serve) is started with 1 worker process and with one per
+# CPU (see worker_counts()), and clients (one thread each, keeping their connection open) POST /sheet requests for one full 96-well PE plate
+# (or /plateview/i7 requests) as fast as the service answers.  The clients run on the same machine as the service.
+def bench_service(requests, clients=8):
+    import http.client
+    import threading
+    body = json.dumps({'workflow': 'A', 'header': 'NA, NA', 'reads': 'PE, 151, 151', 'input_list': synthetic_input_list(1)}).encode()
+    cases = (('POST /sheet (96 rows)', 'POST', '/sheet', body), ('GET /plateview/i7', 'GET', '/plateview/i7', None))
+    rates = {}
+    for workers in worker_counts():
+        command = [sys.executable, os.path.abspath(SampleSheet.__file__), 'serve', '--port', '0', '--workers', str(workers), '--quiet']
+        server = subprocess.Popen(command, stdout=subprocess.PIPE, text=True)
+        try:
+            address = server.stdout.readline().split('http://')[1].split('/')[0]
+            host, port = address.rsplit(':', 1)
+            for case, method, path, case_body in cases:
+                failures = []
+
+                def client(count):
+                    connection = http.client.HTTPConnection(host, int(port))
+                    for i in range(count):
+                        connection.request(method, path, case_body, {'Content-Type': 'application/json'} if case_body else {})
+                        response = connection.getresponse()
+                        response.read()
+                        if response.status != 200:
+                            failures.append(response.status)
+                    connection.close()
+
+                threads = [threading.Thread(target=client, args=(requests // clients,)) for i in range(clients)]
+                start = time.perf_counter()
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+                seconds = time.perf_counter() - start
+                rates[(case, workers)] = record('service', case + ', ' + workers_label(workers), seconds, requests // clients * clients, 'req',
+                                                params={'workers': workers, 'clients': clients, 'oversubscribed': workers > (os.cpu_count() or 1)},
+                                                failures=len(failures))['per_second']
+        finally:
+            server.terminate()
+            server.wait()
+    return rates
+
+# Memory held per sample by the sample layouts of a plate list: expanded plates (lists of index names per plate), [Data]
+# rows as lists of strings (data_rows(), materialized), and SampleRecords (arrays of plate and well numbers, built from
+# the expanded plates), for full single-i5 96-well plates and for 96 i7 x 96 i5 combinatorial lines
+def bench_memory(plates):
+    layouts = {}
+    for case, input_list in (('plates', synthetic_input_list(plates)), ('combinatorial', ['M' + str(n) + ', 1-96, 1-96' for n in range(16)])):
+        expanded = SampleSheet.expand_input_list(input_list, 'PE')
+        SampleSheet.SampleRecords(expanded[:1])
+        builders = (('expanded', lambda: SampleSheet.expand_input_list(input_list, 'PE')),
+                    ('rows', lambda: list(SampleSheet.data_rows(expanded, 'A', 'PE'))),
+                    ('records', lambda: SampleSheet.SampleRecords(expanded)))
+        for layout, build in builders:
+            tracemalloc.start()
+            start = time.perf_counter()
+            built = build()
+            seconds = time.perf_counter() - start
+            size = tracemalloc.get_traced_memory()[0]
+            tracemalloc.stop()
+            samples = len(SampleSheet.SampleRecords(built)) if layout == 'expanded' else len(built)
+            layouts[case, layout] = size / samples
+            record('memory', case + ' ' + layout, seconds, samples, 'rows', bytes_per_sample=round(size / samples, 1))
+            del built
+    return layouts
+
+# Plate line expansion as originally implemented in SampleSheet.py v1.x (partition()/rpartition() and int() per line,
+# contiguous ranges only); kept here as the baseline for plate line parsing benchmarks
+def original_expand_input_list(input_list, readstype, plate=None):
+    plate = plate or SampleSheet.default_plate
+    expanded = []
+    for i in input_list:
+        i7_indexrange = i.partition(',')[-1].rpartition(',')[0].strip() if readstype == 'PE' else i.partition(',')[2].strip()
+        i7 = [plate.index_name('i7', n) for n in range(int(i7_indexrange.partition('-')[0].strip()), int(i7_indexrange.rpartition('-')[-1].strip()) + 1)]
+        if readstype == 'PE':
+            i5_indexrange = i.rpartition(',')[-1].strip()
+            i5 = [plate.index_name('i5', n) for n in range(int(i5_indexrange.partition('-')[0].strip()), int(i5_indexrange.rpartition('-')[-1].strip()) + 1)]
+            expanded.append([i.partition(',')[0].strip(), i7, i5])
+        else:
+            expanded.append([i.partition(',')[0].strip(), i7])
+    return expanded
+
+# Plate line parsing of 100,000-line manifests (read_manifest() and manifest_entries(), i.e. everything before a Sample
+# Sheet is written), with the compiled well field cache cleared for each run: contiguous ranges (against expansion alone
+# by the v1.x parser, on the same input list), mixed syntax with mostly distinct well fields (gapped ranges, well labels, blocks, i5
+# ranges), and the same mixed lines with one error in ten, all reported
+def bench_parse(lines, repeat):
+    rng = random.Random(0)
+    contiguous = ['P' + str(n) + ', 1-' + str(rng.randint(1, 96)) + ', ' + str(n % 96 + 1) for n in range(lines)]
+    mixed = []
+    for n in range(lines):
+        a = rng.randint(1, 40)
+        b = rng.randint(a, 48)
+        row = 'ABCDEFGH'[rng.randint(4, 7)]
+        mixed.append(['P' + str(n) + ', ' + str(a) + '-' + str(b) + ',' + str(b + 1 + n % 8) + '-96, ' + str(n % 96 + 1),
+                      'P' + str(n) + ', A01-' + row + '%02d' % rng.randint(1, 12) + ', ' + str(n % 48 + 1) + ';' + str(n % 48 + 49),
+                      'P' + str(n) + ', ' + row + str(rng.randint(1, 12)) + ',' + str(a) + '-' + str(a + 8) + ', H' + str(n % 12 + 1)][n % 3])
+    errors = [line.replace(',', ', x', 1) if n % 10 == 0 else line for n, line in enumerate(mixed)]
+    seconds = {}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for case, input_list in (('contiguous', contiguous), ('mixed syntax', mixed), ('1 error in 10', errors)):
+            manifest_path = os.path.join(tmpdir, 'manifest.txt')
+            with open(manifest_path, 'w') as f:
+                f.write('workflow: A\nreads: PE, 151, 151\ninput_list:\n' + '\n'.join(input_list) + '\n')
+
+            def parse():
+                SampleSheet.compile_wells.cache_clear()
+                try:
+                    return len(SampleSheet.manifest_entries(SampleSheet.read_manifest(manifest_path))[5])
+                except ValueError as e:
+                    return int(str(e).split()[0])
+
+            count = parse()
+            seconds[case] = record('parse', case, best_time(parse, repeat), lines, 'lines', errors=count if case == '1 error in 10' else 0)['seconds']
+            if case == 'contiguous':
+                record('parse', 'contiguous (v1.x parser)', best_time(lambda: original_expand_input_list(input_list, 'PE'), repeat), lines, 'lines')
+    return seconds
+
+# Barcode kit switching: Sample Sheet [Data] rows for one plate from each of kits synthetic barcode kits (copies of the
+# default primer tables in a barcode kit directory), in turn: first use of each kit (primer tables read, parsed and
+# cached), switching among as many kits as the kit cache holds, and cycling through more kits than it holds (each kit
+# is loaded again, from its parsed table cache)
+def bench_kits(kits, repeat):
+    expanded = SampleSheet.expand_input_list(['K1, 1-96, 1'], 'PE')
+    names = ['kit' + str(n) for n in range(kits)]
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for name in names:
+            os.mkdir(os.path.join(tmpdir, name))
+            for kit, path in SampleSheet.barcode_table_files.items():
+                with open(path, 'rb') as src, open(os.path.join(tmpdir, name, kit + '_barcode_primers.csv'), 'wb') as dst:
+                    dst.write(src.read())
+        os.environ['SAMPLESHEET_BARCODE_KITS'] = tmpdir
+
+        def switch(names):
+            for name in names:
+                list(SampleSheet.data_rows(expanded, 'A', 'PE', barcode_kit=name))
+
+        SampleSheet._load_barcode_kit.cache_clear()
+        start = time.perf_counter()
+        switch(names)
+        record('kits', 'first use', time.perf_counter() - start, kits, 'kits')
+        cached = names[:SampleSheet.barcode_kit_cache_size]
+        switch(cached)
+        record('kits', 'switch within cache', best_time(lambda: switch(cached), repeat), len(cached), 'kits')
+        record('kits', 'cycle beyond cache', best_time(lambda: switch(names), repeat), kits, 'kits',
+               loaded=SampleSheet._load_barcode_kit.cache_info().currsize)
+        del os.environ['SAMPLESHEET_BARCODE_KITS']
+        SampleSheet._load_barcode_kit.cache_clear()
+
+# Lane sharding of 96-well plates (i5 index cycling through 1-96, so that plates 96 apart share index pairs) into lanes
+def bench_shard(repeat, plates=3000, lanes=32):
+    expanded = SampleSheet.expand_input_list(synthetic_input_list(plates), 'PE')
+    return record('shard', str(plates) + ' plates, ' + str(lanes) + ' lanes', best_time(lambda: SampleSheet.shard_plates(expanded, 'A', 'PE', lanes), repeat),
+                  96 * plates, 'rows')['seconds']
+
+# Write recorded results, with the Python version, platform and date, as JSON
+def write_results(output_path, args):
+    with open(output_path, 'w') as f:
+        json.dump({'date': datetime.datetime.now().isoformat(timespec='seconds'), 'python': platform.python_version(),
+                   'platform': platform.platform(), 'cpus': os.cpu_count(), 'arguments': vars(args), 'results': results}, f, indent=1)
+        f.write('\n')
+
+benchmarks = ('startup', 'writer', 'formats', 'sheets', 'plateview', 'validate', 'revcomp', 'lookup', 'demux', 'collide', 'combine', 'update', 'watch', 'service', 'memory', 'parse', 'kits', 'shard')
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark SampleSheet.py operations on synthetic plate lists.')
+    parser.add_argument('--plates', type=int, default=200, help='number of 96-well plates (default 200, i.e. 19,200 rows)')
+    parser.add_argument('--repeat', type=int, default=5, help='repetitions per measurement; the best time is reported (default 5)')
+    parser.add_argument('--sequences', type=int, default=10000, help='number of 10-bp barcodes for reverse-complement benchmarks (default 10,000)')
+    parser.add_argument('--lookups', type=int, default=1000000, help='number of observed index sequences for barcode lookup benchmarks (default 1,000,000)')
+    parser.add_argument('--reads', type=int, default=1000000, help='number of synthetic index reads for demultiplexing benchmarks (default 1,000,000)')
+    parser.add_argument('--sheet-plates', type=int, nargs='+', default=[1, 100, 10000], help='plate list sizes for Sample Sheet generation benchmarks (default 1 100 10000)')
+    parser.add_argument('--manifests', type=int, default=200, help='number of manifests for the watch-folder benchmark (default 200)')
+    parser.add_argument('--service-requests', type=int, default=2000, help='number of requests per Sample Sheet service load test case (default 2,000)')
+    parser.add_argument('--parse-lines', type=int, default=100000, help='number of plate lines for plate line parsing benchmarks (default 100,000)')
+    parser.add_argument('--kits', type=int, default=32, help='number of synthetic barcode kits for the barcode kit benchmark (default 32)')
+    parser.add_argument('--only', nargs='+', choices=benchmarks, help='run only these benchmarks')
+    parser.add_argument('--startup-budget', type=float, default=25, help="'import SampleSheet' time budget in milliseconds; exceeding it exits with status 1 (default 25)")
+    parser.add_argument('--output', help='write results to this JSON file')
+    args = parser.parse_args()
+    run = set(args.only or benchmarks)
+    within_budget = True
+    if 'startup' in run:
+        within_budget = bench_startup(args.repeat, args.startup_budget)
+    if 'writer' in run:
+        bench_writer(args.plates, args.repeat)
+    if 'formats' in run:
+        bench_formats(args.repeat)
+    if 'sheets' in run:
+        bench_sheets(args.repeat, args.sheet_plates)
+    if 'plateview' in run:
+        bench_plateview(args.repeat)
+    if 'validate' in run:
+        bench_validate(args.repeat)
+    if 'revcomp' in run:
+        bench_reverse_complement(args.sequences, args.repeat)
+    if 'lookup' in run:
+        bench_lookup(args.lookups, args.repeat)
+    if 'demux' in run:
+        bench_demultiplex(args.reads)
+    if 'collide' in run:
+        bench_collisions(args.repeat)
+    if 'combine' in run:
+        bench_combinatorial(args.repeat)
+    if 'update' in run:
+        bench_update(args.repeat)
+    if 'watch' in run:
+        bench_watch(args.manifests)
+    if 'service' in run:
+        bench_service(args.service_requests)
+    if 'memory' in run:
+        bench_memory(args.plates)
+    if 'parse' in run:
+        bench_parse(args.parse_lines, args.repeat)
+    if 'kits' in run:
+        bench_kits(args.kits, args.repeat)
+    if 'shard' in run:
+        bench_shard(args.repeat)
+    if args.output:
+        write_results(args.output, args)
+    if not within_budget:
+        sys.exit(1)
+
+############################################################################# end